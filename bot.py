@@ -7,16 +7,19 @@ import logging
 import asyncio
 import signal
 import sys
-from datetime import time as dt_time
 from typing import Optional
 
+import pytz
+
 from telegram import Update
+from telegram.request import BaseRequest
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     ConversationHandler,
     CallbackQueryHandler,
+    TypeHandler,
     filters,
     ContextTypes,
 )
@@ -24,8 +27,10 @@ from telegram.ext import (
 # Конфигурация
 from config import (
     TOKEN, YOUR_CHAT_ID, GENDER, READY_CONFIRMATION, QUESTIONNAIRE,
-    ADD_PLAN_USER, ADD_PLAN_DATE, ADD_PLAN_CONTENT, logger,
-    POSTGRESQL_AVAILABLE, GOOGLE_SHEETS_AVAILABLE
+    ADD_PLAN_USER, ADD_PLAN_DATE, ADD_PLAN_CONTENT,
+    SELECT_TEMPLATE, SELECT_USER_FOR_TEMPLATE, SELECT_DATE_FOR_TEMPLATE, logger,
+    POSTGRESQL_AVAILABLE, GOOGLE_SHEETS_AVAILABLE, BOT_MODE, CONFIG,
+    MAX_CONCURRENT_UPDATES, PERSISTENCE_UPDATE_INTERVAL
 )
 
 # Обработчики
@@ -36,22 +41,43 @@ from handlers.start import (
 from handlers.user import (
     plan_command, progress_command, profile_command,
     points_info_command, help_command,
-    done_command, mood_command, energy_command, water_command
+    done_command, mood_command, energy_command, water_command,
+    timezone_command
 )
 from handlers.admin import (
     admin_add_plan, add_plan_user, add_plan_date,
-    add_plan_content, admin_stats, admin_users, button_callback
+    add_plan_content, admin_stats, admin_users, button_callback,
+    admin_assign_template, assign_template_select,
+    assign_template_users, assign_template_dates
 )
 from handlers.reminder import (
     remind_me_command, regular_remind_command,
     my_reminders_command, delete_remind_command,
     handle_reminder_nlp, schedule_reminders,
-    send_morning_plan, send_evening_survey
+    send_timezone_broadcasts
 )
 from handlers.base import handle_all_messages
+from handlers.middleware import user_context_middleware
 
 # База данных
-from database import initialize_database, close_connection_pool
+from database import (
+    initialize_database, close_connection_pool, deactivate_unreachable_users,
+    flush_pending_writes, PENDING_WRITES_FLUSH_INTERVAL
+)
+from services.leader_election import leader_only, release_job_leadership
+from utils.helpers import is_chat_unreachable_error
+from services.persistence import PostgresPersistence
+from services.plan_service import (
+    reconcile_plans_from_sheets, convert_legacy_plans, PLAN_RECONCILE_INTERVAL
+)
+from services.task_queue import task_queue
+from services.google_sheets import start_google_sheets_init
+from services.sheets_executor import sheets_executor
+from services.sheets_export import export_reports_to_sheets
+from services.plan_pregeneration import pregenerate_next_day_plans
+from services.sheets_snapshot import load_snapshot, save_snapshot, save_snapshot_job, SNAPSHOT_SAVE_INTERVAL
+from utils.update_processor import PerUserUpdateProcessor
+from utils.webhook_request import LocalWebhookRequest
 
 
 class TelegramBot:
@@ -60,18 +86,22 @@ class TelegramBot:
     Реализует полный жизненный цикл бота с graceful shutdown.
     """
     
-    def __init__(self, token: str, admin_chat_id: int):
+    def __init__(self, token: str, admin_chat_id: int, request: Optional[BaseRequest] = None):
         """
         Инициализация бота.
         
         Args:
             token: Токен бота от BotFather
             admin_chat_id: ID администратора для уведомлений
+            request: HTTP-слой Bot API вместо сетевого (нагрузочный тест tools/load_test.py)
         """
         self.token = token
         self.admin_chat_id = admin_chat_id
+        self.request = request
         self.application: Optional[Application] = None
         self.shutdown_event = asyncio.Event()
+        self._shutdown_lock = asyncio.Lock()
+        self._is_shut_down = False
         self._setup_logging()
     
     def _setup_logging(self) -> None:
@@ -97,6 +127,13 @@ class TelegramBot:
         """
         error = context.error
         
+        # Пользователь заблокировал бота или удалил чат - помечаем его, чтобы рассылки его пропускали
+        if is_chat_unreachable_error(error):
+            if isinstance(update, Update) and update.effective_chat and update.effective_chat.type == 'private':
+                await deactivate_unreachable_users([update.effective_chat.id])
+            self.logger.warning(f"🚫 Чат недоступен: {str(error)[:100]}")
+            return
+        
         # Игнорируем незначительные ошибки
         ignore_errors = [
             "terminated by other getUpdates request",
@@ -156,20 +193,58 @@ class TelegramBot:
         self.logger.info(f"🛑 Получен сигнал {signal_name}. Инициируем graceful shutdown...")
         self.shutdown_event.set()
         
-        if self.application and self.application.running:
-            await self.application.stop()
-            await self.application.shutdown()
-        
-        # Закрываем пул соединений с БД
-        await close_connection_pool()
-        
-        self.logger.info("✅ Бот корректно завершил работу")
+        # Завершение может быть вызвано и сигналом, и из run() - выполняем его один раз
+        async with self._shutdown_lock:
+            if self._is_shut_down:
+                return
+            
+            if self.application:
+                # Останавливаем получение обновлений (polling или webhook сервер) и дожидаемся
+                # обработчиков: их задачи еще должны попасть в фоновую очередь
+                if self.application.updater and self.application.updater.running:
+                    await self.application.updater.stop()
+                if self.application.running:
+                    await self.application.stop()
+                
+                # Дожидаемся фоновых задач, пока бот еще может отправлять сообщения
+                await task_queue.shutdown()
+                await self.application.shutdown()
+            else:
+                await task_queue.shutdown()
+            
+            # Дожидаемся записей в Google Sheets, уже отправленных в пул потоков
+            await sheets_executor.shutdown()
+            
+            # Сохраняем снимок состояния Google Sheets для быстрого следующего старта
+            try:
+                await asyncio.to_thread(save_snapshot)
+            except Exception as e:
+                self.logger.error(f"❌ Не удалось сохранить снимок Google Sheets: {e}")
+            
+            # Дописываем накопленную активность и сообщения
+            await flush_pending_writes()
+            
+            # Освобождаем лидерство, чтобы другая реплика сразу подхватила задачи
+            await release_job_leadership()
+            
+            # Закрываем пул соединений с БД
+            await close_connection_pool()
+            
+            self._is_shut_down = True
+            self.logger.info("✅ Бот корректно завершил работу")
     
     async def _setup_handlers(self) -> None:
         """Регистрация всех обработчиков команд."""
+        # Предобработка каждого обновления: регистрация, активность, журнал сообщений
+        self.application.add_handler(TypeHandler(Update, user_context_middleware), group=-1)
+        
         # ConversationHandler для анкеты
         conv_handler = ConversationHandler(
-            entry_points=[CommandHandler('start', start)],
+            entry_points=[
+                CommandHandler('start', start),
+                CommandHandler('add_plan', admin_add_plan),
+                CommandHandler('assign_template', admin_assign_template),
+            ],
             states={
                 GENDER: [
                     MessageHandler(
@@ -207,10 +282,29 @@ class TelegramBot:
                         add_plan_content
                     )
                 ],
+                SELECT_TEMPLATE: [
+                    MessageHandler(
+                        filters.TEXT & ~filters.COMMAND,
+                        assign_template_select
+                    )
+                ],
+                SELECT_USER_FOR_TEMPLATE: [
+                    MessageHandler(
+                        filters.TEXT & ~filters.COMMAND,
+                        assign_template_users
+                    )
+                ],
+                SELECT_DATE_FOR_TEMPLATE: [
+                    MessageHandler(
+                        filters.TEXT & ~filters.COMMAND,
+                        assign_template_dates
+                    )
+                ],
             },
             fallbacks=[CommandHandler('cancel', cancel)],
             allow_reentry=True,
-            name="main_conversation"
+            name="main_conversation",
+            persistent=POSTGRESQL_AVAILABLE
         )
         
         # Регистрируем ConversationHandler первым
@@ -227,6 +321,7 @@ class TelegramBot:
             ("mood", mood_command),
             ("energy", energy_command),
             ("water", water_command),
+            ("timezone", timezone_command),
         ]
         
         for command, handler in user_commands:
@@ -245,7 +340,6 @@ class TelegramBot:
         
         # Команды администратора
         admin_commands = [
-            ("add_plan", admin_add_plan),
             ("admin_stats", admin_stats),
             ("admin_users", admin_users),
         ]
@@ -273,20 +367,56 @@ class TelegramBot:
                 self.logger.warning("⚠️ JobQueue не доступен")
                 return
             
-            # Утреннее сообщение в 6:00 (3:00 UTC для UTC+3)
-            job_queue.run_daily(
-                callback=send_morning_plan,
-                time=dt_time(hour=3, minute=0, second=0),
-                days=tuple(range(7)),
-                name="morning_plan"
+            # Утренний план и вечерний опрос: каждый час в начале часа (UTC)
+            # рассылаем тем часовым поясам, где наступило локальное время рассылки
+            # Задачи выполняет только реплика-лидер (advisory-лок в PostgreSQL)
+            job_queue.run_custom(
+                callback=leader_only("timezone_broadcasts")(send_timezone_broadcasts),
+                job_kwargs={'trigger': 'cron', 'minute': 0, 'second': 0, 'timezone': pytz.utc},
+                name="timezone_broadcasts"
             )
             
-            # Вечерний опрос в 21:00 (18:00 UTC для UTC+3)
-            job_queue.run_daily(
-                callback=send_evening_survey,
-                time=dt_time(hour=18, minute=0, second=0),
-                days=tuple(range(7)),
-                name="evening_survey"
+            # Ночная генерация планов на завтра: каждый час в 15 минут (UTC) для часовых
+            # поясов, где наступил PLAN_PREGENERATION_HOUR; выполняет только лидер
+            if POSTGRESQL_AVAILABLE:
+                job_queue.run_custom(
+                    callback=leader_only("plan_pregeneration")(pregenerate_next_day_plans),
+                    job_kwargs={'trigger': 'cron', 'minute': 15, 'second': 0, 'timezone': pytz.utc},
+                    name="plan_pregeneration"
+                )
+            
+            # Импорт правок планов, сделанных прямо в Google Sheets
+            if GOOGLE_SHEETS_AVAILABLE and POSTGRESQL_AVAILABLE:
+                job_queue.run_repeating(
+                    callback=leader_only("plan_reconciliation")(reconcile_plans_from_sheets),
+                    interval=PLAN_RECONCILE_INTERVAL,
+                    first=60,
+                    name="plan_reconciliation"
+                )
+            
+            # Пакетная выгрузка отчетов и статистики месяца в Google Sheets: задача запускается
+            # каждый час, но обращается к таблице, только когда есть невыгруженный прошедший день
+            if GOOGLE_SHEETS_AVAILABLE and POSTGRESQL_AVAILABLE:
+                job_queue.run_custom(
+                    callback=leader_only("sheets_report_export")(export_reports_to_sheets),
+                    job_kwargs={'trigger': 'cron', 'minute': 30, 'second': 0},
+                    name="sheets_report_export"
+                )
+            
+            # Локальный снимок состояния Google Sheets - на каждой реплике
+            job_queue.run_repeating(
+                callback=save_snapshot_job,
+                interval=SNAPSHOT_SAVE_INTERVAL,
+                first=SNAPSHOT_SAVE_INTERVAL,
+                name="sheets_snapshot"
+            )
+            
+            # Пакетная запись активности и сообщений - на каждой реплике, буферы локальны
+            job_queue.run_repeating(
+                callback=self._flush_pending_writes_job,
+                interval=PENDING_WRITES_FLUSH_INTERVAL,
+                first=PENDING_WRITES_FLUSH_INTERVAL,
+                name="flush_pending_writes"
             )
             
             self.logger.info("✅ JobQueue настроен для автоматических сообщений")
@@ -294,6 +424,10 @@ class TelegramBot:
         except Exception as e:
             self.logger.error(f"❌ Настройка JobQueue не удалась: {e}", exc_info=True)
     
+    async def _flush_pending_writes_job(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Периодический сброс буферов активности и сообщений в БД."""
+        await flush_pending_writes()
+    
     async def _initialize_services(self) -> None:
         """Инициализация всех сервисов (БД, Google Sheets и т.д.)."""
         self.logger.info("=== ИНИЦИАЛИЗАЦИЯ СЕРВИСОВ ===")
@@ -314,9 +448,17 @@ class TelegramBot:
         if POSTGRESQL_AVAILABLE:
             self.logger.info("🔄 Инициализация базы данных...")
             await initialize_database()
+            await convert_legacy_plans()
             self.logger.info("✅ База данных инициализирована")
         else:
             self.logger.warning("⚠️ Пропускаем инициализацию БД - PostgreSQL не доступен")
+        
+        # Кэши Google Sheets из локального снимка доступны сразу, без запросов к API
+        load_snapshot()
+        
+        # Google Sheets подключается в фоне: старт бота не ждет сетевых запросов к API
+        start_google_sheets_init()
+        self.logger.info("🔄 Подключение к Google Sheets запущено в фоне")
     
     async def setup(self) -> None:
         """
@@ -324,7 +466,25 @@ class TelegramBot:
         """
         try:
             # Создаем приложение
-            self.application = Application.builder().token(self.token).build()
+            # Разные пользователи обрабатываются параллельно, обновления одного пользователя - по порядку
+            builder = (
+                Application.builder()
+                .token(self.token)
+                .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+            )
+            if self.request:
+                builder = builder.request(self.request).get_updates_request(self.request)
+            elif BOT_MODE == 'webhook' and not CONFIG.webhook_register:
+                # Локальная проверка webhook: доставка обновлений рабочего бота не перенастраивается
+                builder = builder.request(LocalWebhookRequest(connection_pool_size=256))
+                self.logger.warning("⚠️ WEBHOOK_REGISTER=false: setWebhook не вызывается")
+            
+            # Состояние анкеты переживает перезапуск: user_data и диалоги хранятся в PostgreSQL
+            if POSTGRESQL_AVAILABLE:
+                builder = builder.persistence(PostgresPersistence(update_interval=PERSISTENCE_UPDATE_INTERVAL))
+            
+            self.application = builder.build()
+            self.logger.info(f"⚙️ Параллельная обработка обновлений: до {MAX_CONCURRENT_UPDATES}")
             
             # Регистрируем глобальный обработчик ошибок
             self.application.add_error_handler(self.error_handler)
@@ -357,15 +517,21 @@ class TelegramBot:
             raise RuntimeError("Бот не настроен. Вызовите setup() перед run().")
         
         try:
-            self.logger.info("🤖 Запуск бота...")
-            self.logger.info("=== ВСЕ СИСТЕМЫ ЗАПУЩЕНЫ ===")
+            self.logger.info(f"🤖 Запуск бота в режиме {BOT_MODE}...")
             
-            # Запускаем бота
-            await self.application.run_polling(
-                drop_pending_updates=True,
-                allowed_updates=Update.ALL_TYPES,
-                close_loop=False
-            )
+            # Управляем жизненным циклом приложения вручную, т.к. мы уже внутри asyncio.run()
+            await self.application.initialize()
+            await self.application.start()
+            
+            if BOT_MODE == 'webhook':
+                await self._start_webhook()
+            else:
+                await self.application.updater.start_polling(
+                    drop_pending_updates=True,
+                    allowed_updates=Update.ALL_TYPES
+                )
+            
+            self.logger.info("=== ВСЕ СИСТЕМЫ ЗАПУЩЕНЫ ===")
             
             # Ждем сигнала завершения
             await self.shutdown_event.wait()
@@ -379,6 +545,31 @@ class TelegramBot:
             # Гарантируем завершение работы
             await self._handle_shutdown("shutdown_final")
     
+    async def _start_webhook(self) -> None:
+        """
+        Запуск встроенного webhook сервера python-telegram-bot.
+        
+        Сервер отклоняет запросы без корректного заголовка
+        X-Telegram-Bot-Api-Secret-Token.
+        """
+        webhook_url = f"{CONFIG.webhook_url.rstrip('/')}/{CONFIG.webhook_path}" if CONFIG.webhook_url else None
+        
+        await self.application.updater.start_webhook(
+            listen=CONFIG.webhook_listen,
+            port=CONFIG.webhook_port,
+            url_path=CONFIG.webhook_path,
+            webhook_url=webhook_url,
+            secret_token=CONFIG.webhook_secret_token,
+            max_connections=CONFIG.webhook_max_connections,
+            drop_pending_updates=True,
+            allowed_updates=Update.ALL_TYPES
+        )
+        
+        self.logger.info(
+            f"🌐 Webhook сервер слушает {CONFIG.webhook_listen}:{CONFIG.webhook_port}/{CONFIG.webhook_path} "
+            f"(max_connections={CONFIG.webhook_max_connections})"
+        )
+    
     async def stop(self) -> None:
         """
         Принудительная остановка бота.
@@ -1,19 +1,32 @@
 import logging
 import json
 import re
+import time
 import urllib.parse
 from datetime import datetime, timedelta
-from typing import Dict, Optional, Any, List
+from typing import Dict, Optional, Any, List, Set, Tuple
 from contextlib import asynccontextmanager
 
 import asyncpg
 from asyncpg import Connection, Record
 
-from config import DATABASE_URL, logger, QUESTIONS, POSTGRESQL_AVAILABLE
+from config import DATABASE_URL, logger, QUESTIONS, POSTGRESQL_AVAILABLE, DEFAULT_TIMEZONE
 
 # Глобальный пул подключений для эффективности
 _connection_pool = None
 
+# Кэш регистрации: зарегистрированные пользователи не удаляются, поэтому положительный
+# результат хранится до перезапуска, а отрицательный - недолго (пользователь может пройти /start)
+UNREGISTERED_CACHE_TTL = 30
+_registered_users: Set[int] = set()
+_unregistered_until: Dict[int, float] = {}
+
+# Буферы отложенной записи, сбрасываемые пакетом через flush_pending_writes()
+PENDING_WRITES_FLUSH_INTERVAL = 5  # секунд
+MAX_PENDING_MESSAGES = 10000
+_pending_activity: Dict[int, datetime] = {}
+_pending_messages: List[Tuple[int, str, str, str, datetime]] = []
+
 async def get_connection_pool():
     """Создает и возвращает пул подключений к PostgreSQL"""
     global _connection_pool
@@ -174,11 +187,53 @@ async def init_database():
                 )
             ''')
             
+            # Данные диалогов бота (persistence): user_data и состояния ConversationHandler
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS bot_user_data (
+                    user_id BIGINT PRIMARY KEY,
+                    data JSONB NOT NULL DEFAULT '{}',
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS bot_conversations (
+                    name TEXT NOT NULL,
+                    conv_key TEXT NOT NULL,
+                    state JSONB NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (name, conv_key)
+                )
+            ''')
+            
+            # Выполненные пакетные выгрузки в Google Sheets (чтобы не выгружать период повторно)
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS sheets_exports (
+                    export_name TEXT NOT NULL,
+                    period DATE NOT NULL,
+                    rows_exported INTEGER DEFAULT 0,
+                    exported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (export_name, period)
+                )
+            ''')
+            
+            # Полный текст плана (основное хранилище) и признак того, что он выгружен в Google Sheets
+            await conn.execute('ALTER TABLE user_plans ADD COLUMN IF NOT EXISTS plan_text TEXT')
+            await conn.execute('ALTER TABLE user_plans ADD COLUMN IF NOT EXISTS sheets_synced BOOLEAN DEFAULT FALSE')
+            
+            # Структурированный план (задачи, приоритеты, советы, ритуалы, цитата) - читается без парсинга
+            await conn.execute('ALTER TABLE user_plans ADD COLUMN IF NOT EXISTS plan_data JSONB')
+            
+            # Часовой пояс пользователя (NULL - используется часовой пояс по умолчанию)
+            await conn.execute('ALTER TABLE clients ADD COLUMN IF NOT EXISTS timezone TEXT')
+            
             # Создаем индексы для улучшения производительности
             await conn.execute('CREATE INDEX IF NOT EXISTS idx_clients_user_id ON clients(user_id)')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_clients_status_timezone ON clients(status, timezone)')
             await conn.execute('CREATE INDEX IF NOT EXISTS idx_questionnaire_user_id ON questionnaire_answers(user_id)')
             await conn.execute('CREATE INDEX IF NOT EXISTS idx_progress_user_date ON user_progress(user_id, progress_date)')
             await conn.execute('CREATE INDEX IF NOT EXISTS idx_plans_user_date ON user_plans(user_id, plan_date)')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_plans_data_gin ON user_plans USING GIN (plan_data jsonb_path_ops)')
             await conn.execute('CREATE INDEX IF NOT EXISTS idx_reminders_user_active ON user_reminders(user_id, is_active)')
             await conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_user_created ON user_messages(user_id, created_at)')
             
@@ -206,9 +261,12 @@ async def save_user_info(user_id: int, username: str, first_name: str, last_name
                              username = EXCLUDED.username,
                              first_name = EXCLUDED.first_name,
                              last_name = EXCLUDED.last_name,
-                             last_activity = EXCLUDED.last_activity''',
+                             last_activity = EXCLUDED.last_activity,
+                             status = CASE WHEN clients.status = 'blocked' THEN 'active' ELSE clients.status END''',
                           user_id, username, first_name, last_name, 'active', registration_date, registration_date)
             
+            _registered_users.add(user_id)
+            _unregistered_until.pop(user_id, None)
             logger.info(f"✅ Информация о пользователе {user_id} сохранена в БД")
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения пользователя {user_id}: {e}")
@@ -228,20 +286,84 @@ async def update_user_activity(user_id: int):
     except Exception as e:
         logger.error(f"❌ Ошибка обновления активности {user_id}: {e}")
 
+def touch_user_activity(user_id: int) -> None:
+    """Запоминает активность пользователя для пакетной записи в flush_pending_writes()"""
+    if POSTGRESQL_AVAILABLE:
+        _pending_activity[user_id] = datetime.now()
+
 async def check_user_registered(user_id: int) -> bool:
-    """Асинхронно проверяет зарегистрирован ли пользователь"""
+    """Асинхронно проверяет зарегистрирован ли пользователь (с кэшированием)"""
     if not POSTGRESQL_AVAILABLE:
         return False
     
+    if user_id in _registered_users:
+        return True
+    if _unregistered_until.get(user_id, 0) > time.monotonic():
+        return False
+    
     try:
         async with get_db_connection() as conn:
             result = await conn.fetchrow("SELECT user_id FROM clients WHERE user_id = $1", user_id)
-            return result is not None
+            
+            if result is not None:
+                _registered_users.add(user_id)
+                _unregistered_until.pop(user_id, None)
+                return True
+            
+            _unregistered_until[user_id] = time.monotonic() + UNREGISTERED_CACHE_TTL
+            return False
             
     except Exception as e:
         logger.error(f"❌ Ошибка проверки регистрации {user_id}: {e}")
         return False
 
+async def get_user_timezone(user_id: int) -> str:
+    """Асинхронно возвращает часовой пояс пользователя"""
+    if not POSTGRESQL_AVAILABLE:
+        return DEFAULT_TIMEZONE
+    
+    try:
+        async with get_db_connection() as conn:
+            timezone = await conn.fetchval("SELECT timezone FROM clients WHERE user_id = $1", user_id)
+            return timezone or DEFAULT_TIMEZONE
+            
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения часового пояса {user_id}: {e}")
+        return DEFAULT_TIMEZONE
+
+async def set_user_timezone(user_id: int, timezone: str) -> bool:
+    """Асинхронно сохраняет часовой пояс пользователя"""
+    if not POSTGRESQL_AVAILABLE:
+        return False
+    
+    try:
+        async with get_db_connection() as conn:
+            await conn.execute("UPDATE clients SET timezone = $1 WHERE user_id = $2", timezone, user_id)
+            
+            logger.info(f"✅ Часовой пояс {timezone} сохранен для пользователя {user_id}")
+            return True
+            
+    except Exception as e:
+        logger.error(f"❌ Ошибка сохранения часового пояса {user_id}: {e}")
+        return False
+
+async def get_active_timezones() -> List[str]:
+    """Асинхронно возвращает список часовых поясов активных пользователей"""
+    if not POSTGRESQL_AVAILABLE:
+        return []
+    
+    try:
+        async with get_db_connection() as conn:
+            rows = await conn.fetch(
+                "SELECT DISTINCT COALESCE(timezone, $1) AS timezone FROM clients WHERE status = 'active'",
+                DEFAULT_TIMEZONE
+            )
+            return [row['timezone'] for row in rows]
+            
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения часовых поясов: {e}")
+        return []
+
 async def save_questionnaire_answer(user_id: int, question_number: int, question_text: str, answer_text: str):
     """Асинхронно сохраняет ответ на вопрос анкеты"""
     if not POSTGRESQL_AVAILABLE:
@@ -269,6 +391,105 @@ async def save_questionnaire_answer(user_id: int, question_number: int, question
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения ответа {user_id}: {e}")
 
+def _classify_message(message_text: str) -> str:
+    """Определяет тип сообщения"""
+    if len(message_text) > 1000:
+        return 'long_text'
+    if any(keyword in message_text.lower() for keyword in ['команда', '/start', '/help']):
+        return 'command'
+    return 'text'
+
+def queue_message(user_id: int, message_text: str, direction: str) -> None:
+    """Ставит сообщение в буфер для пакетной записи в flush_pending_writes()"""
+    if POSTGRESQL_AVAILABLE:
+        _pending_messages.append(
+            (user_id, message_text, direction, _classify_message(message_text), datetime.now())
+        )
+
+async def flush_pending_writes() -> None:
+    """Пакетно записывает накопленную активность пользователей и сообщения"""
+    global _pending_activity, _pending_messages
+    if not POSTGRESQL_AVAILABLE or (not _pending_activity and not _pending_messages):
+        return
+    
+    # Забираем буферы целиком, чтобы новые записи копились уже в новых
+    activity, _pending_activity = _pending_activity, {}
+    messages, _pending_messages = _pending_messages, []
+    
+    try:
+        async with get_db_connection() as conn:
+            async with conn.transaction():
+                if activity:
+                    await conn.execute(
+                        '''UPDATE clients SET last_activity = v.last_activity
+                           FROM unnest($1::bigint[], $2::timestamp[]) AS v(user_id, last_activity)
+                           WHERE clients.user_id = v.user_id''',
+                        list(activity.keys()), list(activity.values())
+                    )
+                if messages:
+                    # Сообщения удаленных пользователей отбрасываем, чтобы не ломать весь пакет
+                    await conn.execute(
+                        '''INSERT INTO user_messages 
+                           (user_id, message_text, direction, message_type, created_at) 
+                           SELECT m.user_id, m.message_text, m.direction, m.message_type, m.created_at
+                           FROM unnest($1::bigint[], $2::text[], $3::text[], $4::text[], $5::timestamp[])
+                                AS m(user_id, message_text, direction, message_type, created_at)
+                           WHERE EXISTS (SELECT 1 FROM clients c WHERE c.user_id = m.user_id)''',
+                        *[list(column) for column in zip(*messages)]
+                    )
+            
+            logger.debug(f"💾 Записано пакетом: активность {len(activity)}, сообщений {len(messages)}")
+            
+    except Exception as e:
+        logger.error(f"❌ Ошибка пакетной записи активности и сообщений: {e}")
+        # Возвращаем данные в буферы, чтобы записать их при следующем сбросе
+        for user_id, last_activity in activity.items():
+            _pending_activity.setdefault(user_id, last_activity)
+        _pending_messages[:0] = messages
+        if len(_pending_messages) > MAX_PENDING_MESSAGES:
+            dropped = len(_pending_messages) - MAX_PENDING_MESSAGES
+            del _pending_messages[:dropped]
+            logger.warning(f"⚠️ Буфер сообщений переполнен, отброшено {dropped} старых сообщений")
+
+async def save_questionnaire_answers_bulk(user_id: int, answers: Dict[int, str]) -> bool:
+    """Асинхронно сохраняет пакет ответов анкеты одним запросом"""
+    if not POSTGRESQL_AVAILABLE:
+        logger.warning(f"⚠️ PostgreSQL не доступен, пропускаем сохранение ответов {user_id}")
+        return False
+    
+    if not answers:
+        return True
+    
+    try:
+        async with get_db_connection() as conn:
+            answer_date = datetime.now()
+            rows = [
+                (
+                    user_id,
+                    question_number,
+                    QUESTIONS[question_number]["text"][:500] if question_number < len(QUESTIONS) else "",
+                    answer_text,
+                    answer_date
+                )
+                for question_number, answer_text in sorted(answers.items())
+            ]
+            
+            async with conn.transaction():
+                await conn.executemany('''INSERT INTO questionnaire_answers 
+                                 (user_id, question_number, question_text, answer_text, answer_date) 
+                                 VALUES ($1, $2, $3, $4, $5)
+                                 ON CONFLICT (user_id, question_number) 
+                                 DO UPDATE SET 
+                                    answer_text = EXCLUDED.answer_text,
+                                    answer_date = EXCLUDED.answer_date''',
+                              rows)
+            
+            logger.debug(f"✅ Сохранено ответов: {len(rows)} для пользователя {user_id}")
+            return True
+    except Exception as e:
+        logger.error(f"❌ Ошибка пакетного сохранения ответов {user_id}: {e}")
+        return False
+
 async def save_message(user_id: int, message_text: str, direction: str):
     """Асинхронно сохраняет сообщение в базу данных"""
     if not POSTGRESQL_AVAILABLE:
@@ -277,13 +498,7 @@ async def save_message(user_id: int, message_text: str, direction: str):
     try:
         async with get_db_connection() as conn:
             created_at = datetime.now()
-            
-            # Определяем тип сообщения
-            message_type = 'text'
-            if len(message_text) > 1000:
-                message_type = 'long_text'
-            elif any(keyword in message_text.lower() for keyword in ['команда', '/start', '/help']):
-                message_type = 'command'
+            message_type = _classify_message(message_text)
             
             await conn.execute('''INSERT INTO user_messages 
                              (user_id, message_text, direction, message_type, created_at) 
@@ -293,23 +508,29 @@ async def save_message(user_id: int, message_text: str, direction: str):
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения сообщения {user_id}: {e}")
 
-async def save_user_plan_to_db(user_id: int, plan_data: Dict[str, Any]):
+async def save_user_plan_to_db(user_id: int, plan_data: Dict[str, Any]) -> bool:
     """Асинхронно сохраняет план пользователя в базу данных"""
     if not POSTGRESQL_AVAILABLE:
         logger.warning(f"⚠️ PostgreSQL не доступен, пропускаем сохранение плана {user_id}")
-        return
+        return False
     
     try:
         async with get_db_connection() as conn:
             created_date = datetime.now()
+            plan_date = plan_data.get('plan_date')
+            if isinstance(plan_date, str):
+                plan_date = datetime.strptime(plan_date, "%Y-%m-%d").date()
             
             await conn.execute('''INSERT INTO user_plans 
                              (user_id, plan_date, morning_ritual1, morning_ritual2, task1, task2, task3, task4, 
                               lunch_break, evening_ritual1, evening_ritual2, advice, sleep_time, water_goal, 
-                              activity_goal, created_date) 
-                             VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16)
+                              activity_goal, created_date, plan_text, plan_data) 
+                             VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17, $18::jsonb)
                              ON CONFLICT (user_id, plan_date) 
                              DO UPDATE SET
+                                plan_text = EXCLUDED.plan_text,
+                                plan_data = EXCLUDED.plan_data,
+                                sheets_synced = FALSE,
                                 morning_ritual1 = EXCLUDED.morning_ritual1,
                                 morning_ritual2 = EXCLUDED.morning_ritual2,
                                 task1 = EXCLUDED.task1,
@@ -324,16 +545,261 @@ async def save_user_plan_to_db(user_id: int, plan_data: Dict[str, Any]):
                                 water_goal = EXCLUDED.water_goal,
                                 activity_goal = EXCLUDED.activity_goal,
                                 updated_date = EXCLUDED.created_date''',
-                          user_id, plan_data.get('plan_date'), plan_data.get('morning_ritual1'), 
+                          user_id, plan_date, plan_data.get('morning_ritual1'), 
                           plan_data.get('morning_ritual2'), plan_data.get('task1'), plan_data.get('task2'),
                           plan_data.get('task3'), plan_data.get('task4'), plan_data.get('lunch_break'),
                           plan_data.get('evening_ritual1'), plan_data.get('evening_ritual2'), 
                           plan_data.get('advice'), plan_data.get('sleep_time'), plan_data.get('water_goal'),
-                          plan_data.get('activity_goal'), created_date)
+                          plan_data.get('activity_goal'), created_date, plan_data.get('plan_text'),
+                          json.dumps(plan_data['plan_data'], ensure_ascii=False) if plan_data.get('plan_data') is not None else None)
             
             logger.info(f"✅ План сохранен в БД для пользователя {user_id}")
+            return True
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения плана {user_id}: {e}")
+        return False
+
+async def get_plan_data_from_db(user_id: int, plan_date: str) -> Optional[Dict[str, Any]]:
+    """Асинхронно получает структурированный план пользователя на дату"""
+    if not POSTGRESQL_AVAILABLE:
+        return None
+    
+    try:
+        async with get_db_connection() as conn:
+            plan_data = await conn.fetchval(
+                '''SELECT plan_data FROM user_plans 
+                   WHERE user_id = $1 AND plan_date = $2 AND status = 'active' ''',
+                user_id, datetime.strptime(plan_date, "%Y-%m-%d").date()
+            )
+            return json.loads(plan_data) if plan_data else None
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения плана {user_id} на {plan_date}: {e}")
+        return None
+
+async def get_unconverted_plans(limit: int = 1000) -> List[Dict[str, Any]]:
+    """Асинхронно возвращает планы без структурированной версии (plan_data)"""
+    if not POSTGRESQL_AVAILABLE:
+        return []
+    
+    try:
+        async with get_db_connection() as conn:
+            rows = await conn.fetch(
+                '''SELECT * FROM user_plans WHERE plan_data IS NULL ORDER BY id LIMIT $1''',
+                limit
+            )
+            return [dict(row) for row in rows]
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения планов для конвертации: {e}")
+        return []
+
+async def save_plan_documents_bulk(documents: List[Tuple[int, Dict[str, Any]]]) -> bool:
+    """Асинхронно записывает структурированные планы пакетом: (id плана, документ)"""
+    if not POSTGRESQL_AVAILABLE or not documents:
+        return False
+    
+    try:
+        async with get_db_connection() as conn:
+            await conn.executemany(
+                'UPDATE user_plans SET plan_data = $2::jsonb WHERE id = $1',
+                [(plan_id, json.dumps(document, ensure_ascii=False)) for plan_id, document in documents]
+            )
+            return True
+    except Exception as e:
+        logger.error(f"❌ Ошибка записи структурированных планов: {e}")
+        return False
+
+async def mark_plan_synced(user_id: int, plan_date: str, plan_text: str) -> None:
+    """Отмечает, что план выгружен в Google Sheets (если с тех пор он не менялся)"""
+    if not POSTGRESQL_AVAILABLE:
+        return
+    
+    try:
+        async with get_db_connection() as conn:
+            await conn.execute(
+                '''UPDATE user_plans SET sheets_synced = TRUE
+                   WHERE user_id = $1 AND plan_date = $2 AND plan_text = $3''',
+                user_id, datetime.strptime(plan_date, "%Y-%m-%d").date(), plan_text
+            )
+    except Exception as e:
+        logger.error(f"❌ Ошибка отметки синхронизации плана {user_id}: {e}")
+
+async def mark_plans_synced_bulk(plans: List[Tuple[int, str, str]]) -> None:
+    """Отмечает пакет планов (user_id, дата, текст) выгруженными в Google Sheets"""
+    if not POSTGRESQL_AVAILABLE or not plans:
+        return
+    
+    try:
+        async with get_db_connection() as conn:
+            await conn.execute(
+                '''UPDATE user_plans p SET sheets_synced = TRUE
+                   FROM unnest($1::bigint[], $2::date[], $3::text[]) AS s(user_id, plan_date, plan_text)
+                   WHERE p.user_id = s.user_id AND p.plan_date = s.plan_date AND p.plan_text = s.plan_text''',
+                [plan[0] for plan in plans],
+                [datetime.strptime(plan[1], "%Y-%m-%d").date() for plan in plans],
+                [plan[2] for plan in plans]
+            )
+    except Exception as e:
+        logger.error(f"❌ Ошибка отметки синхронизации пакета планов: {e}")
+
+async def save_user_plans_bulk(plans: List[Tuple[int, str, str, Dict[str, Any]]],
+                              overwrite: bool = True) -> List[Tuple[int, str]]:
+    """
+    Асинхронно сохраняет пакет планов (user_id, дата, текст, документ) одним запросом.
+    С overwrite=False существующие планы на ту же дату не перезаписываются.
+    Возвращает сохраненные пары (user_id, дата); планы незарегистрированных пользователей пропускаются.
+    """
+    if not POSTGRESQL_AVAILABLE or not plans:
+        return []
+    
+    if overwrite:
+        on_conflict = '''DO UPDATE SET
+                      plan_text = EXCLUDED.plan_text,
+                      plan_data = EXCLUDED.plan_data,
+                      status = 'active',
+                      updated_date = CURRENT_TIMESTAMP,
+                      sheets_synced = FALSE'''
+    else:
+        on_conflict = "DO NOTHING"
+    
+    try:
+        async with get_db_connection() as conn:
+            rows = await conn.fetch(
+                f'''INSERT INTO user_plans (user_id, plan_date, plan_text, plan_data, created_date, sheets_synced)
+                   SELECT p.user_id, p.plan_date, p.plan_text, p.plan_data::jsonb, CURRENT_TIMESTAMP, FALSE
+                   FROM unnest($1::bigint[], $2::date[], $3::text[], $4::text[])
+                        AS p(user_id, plan_date, plan_text, plan_data)
+                   WHERE EXISTS (SELECT 1 FROM clients c WHERE c.user_id = p.user_id)
+                   ON CONFLICT (user_id, plan_date) {on_conflict}
+                   RETURNING user_id, plan_date''',
+                [plan[0] for plan in plans],
+                [datetime.strptime(plan[1], "%Y-%m-%d").date() for plan in plans],
+                [plan[2] for plan in plans],
+                [json.dumps(plan[3], ensure_ascii=False) for plan in plans]
+            )
+            
+            logger.info(f"✅ Пакет планов сохранен в БД: {len(rows)} из {len(plans)}")
+            return [(row['user_id'], row['plan_date'].strftime("%Y-%m-%d")) for row in rows]
+    except Exception as e:
+        logger.error(f"❌ Ошибка пакетного сохранения планов: {e}")
+        return []
+
+async def get_template_recipients(user_ids: Optional[List[int]] = None,
+                                  active_days: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Асинхронно возвращает активных клиентов для массового назначения плана:
+    из списка user_ids (None - все) и, если задано, заходивших за последние active_days дней.
+    """
+    if not POSTGRESQL_AVAILABLE:
+        return []
+    
+    try:
+        async with get_db_connection() as conn:
+            rows = await conn.fetch(
+                '''SELECT user_id, username, first_name FROM clients
+                   WHERE status = 'active'
+                     AND ($1::bigint[] IS NULL OR user_id = ANY($1::bigint[]))
+                     AND ($2::int IS NULL OR last_activity >= NOW() - make_interval(days => $2::int))
+                   ORDER BY user_id''',
+                user_ids, active_days
+            )
+            return [dict(row) for row in rows]
+    except Exception as e:
+        logger.error(f"❌ Ошибка выборки клиентов для назначения плана: {e}")
+        return []
+
+async def get_pregeneration_batch(timezones: List[str], plan_date, after_user_id: int,
+                                  limit: int) -> List[Tuple[int, Dict[int, str]]]:
+    """
+    Асинхронно возвращает следующую порцию пользователей для ночной генерации планов:
+    (user_id, {номер вопроса: ответ}) активных клиентов из указанных часовых поясов,
+    прошедших анкету и еще без плана на plan_date. Порции идут по возрастанию user_id.
+    """
+    if not POSTGRESQL_AVAILABLE:
+        return []
+    
+    try:
+        async with get_db_connection() as conn:
+            rows = await conn.fetch(
+                '''SELECT c.user_id, json_object_agg(q.question_number, q.answer_text) AS answers
+                   FROM clients c
+                   JOIN questionnaire_answers q ON q.user_id = c.user_id
+                   WHERE c.status = 'active'
+                     AND COALESCE(c.timezone, $1) = ANY($2::text[])
+                     AND c.user_id > $3
+                     AND NOT EXISTS (
+                         SELECT 1 FROM user_plans p WHERE p.user_id = c.user_id AND p.plan_date = $4
+                     )
+                   GROUP BY c.user_id
+                   ORDER BY c.user_id
+                   LIMIT $5''',
+                DEFAULT_TIMEZONE, timezones, after_user_id, plan_date, limit
+            )
+            return [
+                (row['user_id'], {int(number): answer for number, answer in json.loads(row['answers']).items()})
+                for row in rows
+            ]
+    except Exception as e:
+        logger.error(f"❌ Ошибка выборки пользователей для генерации планов: {e}")
+        return []
+
+async def get_plans_sync_state(start_date, end_date) -> Dict[Tuple[int, str], Dict[str, Any]]:
+    """Асинхронно возвращает тексты планов за период и признак их синхронизации с Google Sheets"""
+    if not POSTGRESQL_AVAILABLE:
+        return {}
+    
+    try:
+        async with get_db_connection() as conn:
+            rows = await conn.fetch(
+                '''SELECT user_id, plan_date, plan_text, COALESCE(sheets_synced, FALSE) AS synced
+                   FROM user_plans
+                   WHERE plan_date BETWEEN $1 AND $2''',
+                start_date, end_date
+            )
+            return {
+                (row['user_id'], row['plan_date'].strftime("%Y-%m-%d")): {
+                    'plan_text': row['plan_text'],
+                    'synced': row['synced']
+                }
+                for row in rows
+            }
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения состояния синхронизации планов: {e}")
+        return {}
+
+async def import_plan_texts_bulk(plans: List[Tuple[int, str, str, Dict[str, Any]]]) -> int:
+    """Асинхронно импортирует пакет планов (user_id, дата, текст, документ), отредактированных в Google Sheets"""
+    if not POSTGRESQL_AVAILABLE or not plans:
+        return 0
+    
+    try:
+        async with get_db_connection() as conn:
+            user_ids = [plan[0] for plan in plans]
+            plan_dates = [datetime.strptime(plan[1], "%Y-%m-%d").date() for plan in plans]
+            plan_texts = [plan[2] for plan in plans]
+            plan_documents = [json.dumps(plan[3], ensure_ascii=False) for plan in plans]
+            
+            # Планы незарегистрированных пользователей пропускаем (внешний ключ на clients)
+            result = await conn.execute(
+                '''INSERT INTO user_plans (user_id, plan_date, plan_text, plan_data, created_date, sheets_synced)
+                   SELECT p.user_id, p.plan_date, p.plan_text, p.plan_data::jsonb, CURRENT_TIMESTAMP, TRUE
+                   FROM unnest($1::bigint[], $2::date[], $3::text[], $4::text[])
+                        AS p(user_id, plan_date, plan_text, plan_data)
+                   WHERE EXISTS (SELECT 1 FROM clients c WHERE c.user_id = p.user_id)
+                   ON CONFLICT (user_id, plan_date) DO UPDATE SET
+                      plan_text = EXCLUDED.plan_text,
+                      plan_data = EXCLUDED.plan_data,
+                      status = 'active',
+                      updated_date = CURRENT_TIMESTAMP,
+                      sheets_synced = TRUE''',
+                user_ids, plan_dates, plan_texts, plan_documents
+            )
+            
+            imported = int(result.split()[-1]) if result else 0
+            logger.info(f"✅ Импортировано планов из Google Sheets: {imported}")
+            return imported
+    except Exception as e:
+        logger.error(f"❌ Ошибка импорта планов из Google Sheets: {e}")
+        return 0
 
 async def get_user_plan_from_db(user_id: int):
     """Асинхронно получает текущий план пользователя из базы данных"""
@@ -367,15 +833,15 @@ async def save_progress_to_db(user_id: int, progress_data: Dict[str, Any]):
                              VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
                              ON CONFLICT (user_id, progress_date)
                              DO UPDATE SET
-                                tasks_completed = EXCLUDED.tasks_completed,
-                                mood = EXCLUDED.mood,
-                                energy = EXCLUDED.energy,
-                                sleep_quality = EXCLUDED.sleep_quality,
-                                water_intake = EXCLUDED.water_intake,
-                                activity_done = EXCLUDED.activity_done,
-                                user_comment = EXCLUDED.user_comment,
-                                day_rating = EXCLUDED.day_rating,
-                                challenges = EXCLUDED.challenges''',
+                                tasks_completed = COALESCE(EXCLUDED.tasks_completed, user_progress.tasks_completed),
+                                mood = COALESCE(EXCLUDED.mood, user_progress.mood),
+                                energy = COALESCE(EXCLUDED.energy, user_progress.energy),
+                                sleep_quality = COALESCE(EXCLUDED.sleep_quality, user_progress.sleep_quality),
+                                water_intake = COALESCE(EXCLUDED.water_intake, user_progress.water_intake),
+                                activity_done = COALESCE(EXCLUDED.activity_done, user_progress.activity_done),
+                                user_comment = COALESCE(EXCLUDED.user_comment, user_progress.user_comment),
+                                day_rating = COALESCE(EXCLUDED.day_rating, user_progress.day_rating),
+                                challenges = COALESCE(EXCLUDED.challenges, user_progress.challenges)''',
                           user_id, progress_date, progress_data.get('tasks_completed'), 
                           progress_data.get('mood'), progress_data.get('energy'), 
                           progress_data.get('sleep_quality'), progress_data.get('water_intake'),
@@ -386,6 +852,92 @@ async def save_progress_to_db(user_id: int, progress_data: Dict[str, Any]):
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения прогресса {user_id}: {e}")
 
+async def get_daily_reports_for_export(report_date) -> Optional[List[Dict[str, Any]]]:
+    """Асинхронно возвращает записи прогресса всех пользователей за день для выгрузки в Google Sheets (None при ошибке)"""
+    if not POSTGRESQL_AVAILABLE:
+        return None
+    
+    try:
+        async with get_db_connection() as conn:
+            rows = await conn.fetch(
+                '''SELECT p.user_id, COALESCE(c.username, '') AS username, COALESCE(c.first_name, '') AS first_name,
+                          p.progress_date, p.tasks_completed, p.mood, p.energy, p.sleep_quality,
+                          p.water_intake, p.activity_done, p.user_comment, p.day_rating, p.challenges
+                   FROM user_progress p
+                   JOIN clients c ON c.user_id = p.user_id
+                   WHERE p.progress_date = $1
+                   ORDER BY p.user_id''',
+                report_date
+            )
+            return [dict(row) for row in rows]
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения отчетов за {report_date}: {e}")
+        return None
+
+async def get_monthly_progress_stats(month_start, month_end) -> List[Dict[str, Any]]:
+    """Асинхронно считает помесячную статистику прогресса по пользователям (одним запросом)"""
+    if not POSTGRESQL_AVAILABLE:
+        return []
+    
+    try:
+        async with get_db_connection() as conn:
+            rows = await conn.fetch(
+                '''SELECT p.user_id, COALESCE(c.username, '') AS username, COALESCE(c.first_name, '') AS first_name,
+                          ROUND(AVG(p.mood), 1) AS avg_mood,
+                          ROUND(AVG(p.energy), 1) AS avg_energy,
+                          COUNT(*) AS active_days,
+                          COALESCE(SUM(p.tasks_completed), 0) AS tasks_total,
+                          ROUND(AVG(p.tasks_completed), 1) AS avg_tasks,
+                          ROUND(AVG(p.mood) FILTER (WHERE EXTRACT(DAY FROM p.progress_date) > 15)
+                                - AVG(p.mood) FILTER (WHERE EXTRACT(DAY FROM p.progress_date) <= 15), 1) AS mood_trend
+                   FROM user_progress p
+                   JOIN clients c ON c.user_id = p.user_id
+                   WHERE p.progress_date BETWEEN $1 AND $2
+                   GROUP BY p.user_id, c.username, c.first_name
+                   ORDER BY p.user_id''',
+                month_start, month_end
+            )
+            return [dict(row) for row in rows]
+    except Exception as e:
+        logger.error(f"❌ Ошибка расчета статистики за {month_start:%Y-%m}: {e}")
+        return []
+
+async def get_exported_periods(export_name: str, start_date, end_date) -> Optional[Set[Any]]:
+    """Асинхронно возвращает периоды, уже выгруженные в Google Sheets (None при ошибке)"""
+    if not POSTGRESQL_AVAILABLE:
+        return None
+    
+    try:
+        async with get_db_connection() as conn:
+            rows = await conn.fetch(
+                'SELECT period FROM sheets_exports WHERE export_name = $1 AND period BETWEEN $2 AND $3',
+                export_name, start_date, end_date
+            )
+            return {row['period'] for row in rows}
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения выгрузок {export_name}: {e}")
+        return None
+
+async def mark_period_exported(export_name: str, period, rows_exported: int) -> bool:
+    """Асинхронно отмечает период как выгруженный в Google Sheets. False - отметка не сохранена"""
+    if not POSTGRESQL_AVAILABLE:
+        return False
+    
+    try:
+        async with get_db_connection() as conn:
+            await conn.execute(
+                '''INSERT INTO sheets_exports (export_name, period, rows_exported)
+                   VALUES ($1, $2, $3)
+                   ON CONFLICT (export_name, period) DO UPDATE SET
+                      rows_exported = EXCLUDED.rows_exported,
+                      exported_at = CURRENT_TIMESTAMP''',
+                export_name, period, rows_exported
+            )
+        return True
+    except Exception as e:
+        logger.error(f"❌ Ошибка отметки выгрузки {export_name} за {period}: {e}")
+        return False
+
 async def get_user_stats(user_id: int) -> Dict[str, Any]:
     """Асинхронно возвращает статистику пользователя"""
     if not POSTGRESQL_AVAILABLE:
@@ -632,6 +1184,35 @@ async def add_reminder_to_db(user_id: int, reminder_data: Dict[str, Any]) -> boo
         logger.error(f"❌ Ошибка добавления напоминания: {e}")
         return False
 
+async def deactivate_unreachable_users(user_ids: List[int]) -> int:
+    """Асинхронно помечает заблокировавших бота пользователей и отключает их напоминания одним пакетом"""
+    if not POSTGRESQL_AVAILABLE or not user_ids:
+        return 0
+    
+    unique_ids = list(set(user_ids))
+    
+    try:
+        async with get_db_connection() as conn:
+            async with conn.transaction():
+                result = await conn.execute(
+                    '''UPDATE clients SET status = 'blocked'
+                       WHERE user_id = ANY($1::bigint[]) AND status <> 'blocked' ''',
+                    unique_ids
+                )
+                await conn.execute(
+                    '''UPDATE user_reminders SET is_active = FALSE
+                       WHERE user_id = ANY($1::bigint[]) AND is_active = TRUE''',
+                    unique_ids
+                )
+            
+            updated = int(result.split()[-1]) if result else 0
+            logger.info(f"🚫 Помечено заблокировавших бота пользователей: {updated} из {len(unique_ids)}")
+            return updated
+            
+    except Exception as e:
+        logger.error(f"❌ Ошибка деактивации недоступных пользователей: {e}")
+        return 0
+
 async def get_user_reminders(user_id: int) -> List[Dict]:
     """Асинхронно возвращает список напоминаний пользователя"""
     if not POSTGRESQL_AVAILABLE:
@@ -1,12 +1,25 @@
 import logging
-from datetime import datetime
-from typing import Dict, Any, Optional
+import re
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CallbackContext, ConversationHandler, MessageHandler, filters
 
-from config import YOUR_CHAT_ID, logger, ADD_PLAN_USER, ADD_PLAN_DATE, ADD_PLAN_CONTENT
-from database import get_connection_pool, save_user_plan_to_db, update_user_activity
-from services.google_sheets import save_daily_plan_to_sheets, parse_structured_plan
+from config import (
+    YOUR_CHAT_ID, logger, ADD_PLAN_USER, ADD_PLAN_DATE, ADD_PLAN_CONTENT,
+    SELECT_TEMPLATE, SELECT_USER_FOR_TEMPLATE, SELECT_DATE_FOR_TEMPLATE, PLAN_TEMPLATES
+)
+from database import get_connection_pool, get_template_recipients
+from services.google_sheets import parse_structured_plan
+from services.plan_service import (
+    save_daily_plan, save_daily_plans_bulk, get_plan_latency_stats, get_plan_cache_size
+)
+from services.template import template_key_for_date
+
+# Ключевое слово для назначения шаблонов по недельному расписанию
+SCHEDULE_TEMPLATE_KEY = "расписание"
+# Максимальная длина периода массового назначения плана (дней)
+MAX_TEMPLATE_DAYS = 31
 
 def is_admin(user_id: int) -> bool:
     """Проверяет, является ли пользователь администратором"""
@@ -21,7 +34,6 @@ async def admin_add_plan(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
         return ConversationHandler.END
     
-    await update_user_activity(user_id)
     await update.message.reply_text(
         "📋 **ДОБАВЛЕНИЕ ПЕРСОНАЛЬНОГО ПЛАНА**\n\n"
         "Введите ID пользователя (число):"
@@ -167,38 +179,23 @@ async def add_plan_content(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         # Парсим структурированный план
         plan_data = parse_structured_plan(plan_content)
         
-        # Сохраняем в Google Sheets
-        success = save_daily_plan_to_sheets(target_user_id, date_str, plan_data)
+        # Сохраняем в PostgreSQL, выгрузка в Google Sheets идет в фоне
+        success = await save_daily_plan(target_user_id, date_str, plan_data)
         
         if not success:
             await update.message.reply_text(
-                "❌ Ошибка при сохранении плана в Google Sheets.\n"
+                "❌ Ошибка при сохранении плана в базу данных.\n"
                 "Проверьте подключение и попробуйте снова."
             )
             return ConversationHandler.END
         
-        # Подготавливаем данные для БД
-        db_plan_data = {
-            'plan_date': date_str,
-            'task1': plan_data.get('strategic_tasks', [''])[0] if plan_data.get('strategic_tasks') else '',
-            'task2': plan_data.get('strategic_tasks', [''])[1] if len(plan_data.get('strategic_tasks', [])) > 1 else '',
-            'task3': plan_data.get('strategic_tasks', [''])[2] if len(plan_data.get('strategic_tasks', [])) > 2 else '',
-            'task4': plan_data.get('critical_tasks', [''])[0] if plan_data.get('critical_tasks') else '',
-            'advice': plan_data.get('advice', [''])[0] if plan_data.get('advice') else '',
-            'motivation_quote': plan_data.get('motivation_quote', ''),
-            'priorities': plan_data.get('priorities', [''])[0] if plan_data.get('priorities') else ''
-        }
-        
-        # Сохраняем в PostgreSQL
-        await save_user_plan_to_db(target_user_id, db_plan_data)
-        
         # Формируем ответ администратору
         response = (
             f"✅ **План успешно добавлен!**\n\n"
             f"👤 **Пользователь:** {user_name}\n"
             f"🆔 **ID:** {target_user_id}\n"
             f"📅 **Дата:** {date_str}\n"
-            f"📊 **Сохранено в:** Google Sheets и PostgreSQL\n\n"
+            f"📊 **Сохранено в:** PostgreSQL (Google Sheets обновится в фоне)\n\n"
         )
         
         if plan_data.get('strategic_tasks'):
@@ -244,6 +241,186 @@ async def add_plan_content(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     return ConversationHandler.END
 
 
+async def admin_assign_template(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Начинает массовое назначение шаблона плана (только для администратора)"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+        return ConversationHandler.END
+    
+    templates_text = "\n".join(
+        f"• `{key}` – {template.name}" for key, template in PLAN_TEMPLATES.items()
+    )
+    await update.message.reply_text(
+        "📋 **МАССОВОЕ НАЗНАЧЕНИЕ ШАБЛОНА**\n\n"
+        f"{templates_text}\n"
+        f"• `{SCHEDULE_TEMPLATE_KEY}` – шаблон по дню недели\n\n"
+        "Введите ключ шаблона:"
+    )
+    return SELECT_TEMPLATE
+
+
+async def assign_template_select(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Обрабатывает выбор шаблона"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+        return ConversationHandler.END
+    
+    template_key = update.message.text.strip().lower()
+    if template_key != SCHEDULE_TEMPLATE_KEY and template_key not in PLAN_TEMPLATES:
+        await update.message.reply_text(
+            "❌ Шаблон не найден.\n\n"
+            "Введите один из ключей из списка выше:"
+        )
+        return SELECT_TEMPLATE
+    
+    context.user_data['template_key'] = template_key
+    
+    await update.message.reply_text(
+        "👥 **Кому назначить план?**\n\n"
+        "• ID пользователей через пробел или запятую\n"
+        "• `все` – все активные клиенты\n"
+        "• `активные 7` – клиенты, заходившие за последние N дней"
+    )
+    return SELECT_USER_FOR_TEMPLATE
+
+
+async def assign_template_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Обрабатывает список или фильтр пользователей"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+        return ConversationHandler.END
+    
+    text = update.message.text.strip().lower()
+    user_ids: Optional[List[int]] = None
+    active_days: Optional[int] = None
+    
+    try:
+        if text.startswith('активные'):
+            active_days = int(text.split()[1]) if len(text.split()) > 1 else 7
+        elif text != 'все':
+            user_ids = [int(part) for part in re.split(r'[\s,;]+', text) if part]
+    except ValueError:
+        await update.message.reply_text(
+            "❌ Не удалось разобрать список пользователей.\n\n"
+            "Введите ID через пробел, `все` или `активные N`:"
+        )
+        return SELECT_USER_FOR_TEMPLATE
+    
+    recipients = await get_template_recipients(user_ids, active_days)
+    if not recipients:
+        await update.message.reply_text(
+            "❌ Подходящие активные клиенты не найдены.\n\n"
+            "Проверьте список и попробуйте снова:"
+        )
+        return SELECT_USER_FOR_TEMPLATE
+    
+    context.user_data['template_user_ids'] = [recipient['user_id'] for recipient in recipients]
+    
+    not_found = ""
+    if user_ids:
+        missing = len(set(user_ids)) - len(recipients)
+        if missing:
+            not_found = f"⚠️ Не найдено или неактивно: {missing}\n"
+    
+    await update.message.reply_text(
+        f"✅ **Выбрано клиентов:** {len(recipients)}\n"
+        f"{not_found}\n"
+        f"📅 Введите дату или период (формат: ГГГГ-ММ-ДД или ГГГГ-ММ-ДД ГГГГ-ММ-ДД, "
+        f"не больше {MAX_TEMPLATE_DAYS} дней):"
+    )
+    return SELECT_DATE_FOR_TEMPLATE
+
+
+async def assign_template_dates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Обрабатывает период и сохраняет планы всем выбранным пользователям"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+        return ConversationHandler.END
+    
+    template_key = context.user_data.get('template_key')
+    user_ids = context.user_data.get('template_user_ids')
+    
+    if not template_key or not user_ids:
+        await update.message.reply_text("❌ Ошибка: данные назначения не найдены. Начните заново.")
+        return ConversationHandler.END
+    
+    try:
+        parts = update.message.text.split()
+        start_date = datetime.strptime(parts[0], "%Y-%m-%d").date()
+        end_date = datetime.strptime(parts[1], "%Y-%m-%d").date() if len(parts) > 1 else start_date
+    except (IndexError, ValueError):
+        await update.message.reply_text(
+            "❌ Неверный формат даты.\n\n"
+            "Используйте формат: **ГГГГ-ММ-ДД** или **ГГГГ-ММ-ДД ГГГГ-ММ-ДД**\n"
+            "Попробуйте снова:"
+        )
+        return SELECT_DATE_FOR_TEMPLATE
+    
+    days_count = (end_date - start_date).days + 1
+    if days_count < 1 or days_count > MAX_TEMPLATE_DAYS:
+        await update.message.reply_text(
+            f"❌ Период должен содержать от 1 до {MAX_TEMPLATE_DAYS} дней.\n\n"
+            "Попробуйте снова:"
+        )
+        return SELECT_DATE_FOR_TEMPLATE
+    
+    try:
+        # Документ шаблона на каждую дату строится один раз и общий для всех пользователей
+        dates = [(start_date + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(days_count)]
+        documents = {}
+        for date_str in dates:
+            key = template_key_for_date(date_str) if template_key == SCHEDULE_TEMPLATE_KEY else template_key
+            documents[date_str] = PLAN_TEMPLATES[key].to_dict()
+        
+        plans = [
+            (target_user_id, date_str, documents[date_str])
+            for target_user_id in user_ids
+            for date_str in dates
+        ]
+        saved = await save_daily_plans_bulk(plans)
+        
+        if not saved:
+            await update.message.reply_text(
+                "❌ Ошибка при сохранении планов в базу данных.\n"
+                "Проверьте подключение и попробуйте снова."
+            )
+        else:
+            template_name = (
+                "по недельному расписанию" if template_key == SCHEDULE_TEMPLATE_KEY
+                else PLAN_TEMPLATES[template_key].name
+            )
+            await update.message.reply_text(
+                f"✅ **Планы назначены!**\n\n"
+                f"📋 **Шаблон:** {template_name}\n"
+                f"👥 **Пользователей:** {len(user_ids)}\n"
+                f"📅 **Период:** {dates[0]} – {dates[-1]}\n"
+                f"📊 **Сохранено планов:** {saved} из {len(plans)}\n"
+                f"📤 Google Sheets обновится в фоне"
+            )
+            logger.info(
+                f"✅ Шаблон {template_key} назначен {len(user_ids)} пользователям на {dates[0]} – {dates[-1]}: "
+                f"{saved} планов"
+            )
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка массового назначения шаблона: {e}")
+        await update.message.reply_text("❌ Произошла ошибка при назначении планов. Попробуйте снова.")
+    
+    # Очищаем временные данные
+    context.user_data.pop('template_key', None)
+    context.user_data.pop('template_user_ids', None)
+    
+    return ConversationHandler.END
+
+
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Статистика для администратора"""
     user_id = update.effective_user.id
@@ -252,8 +429,6 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
         return
     
-    await update_user_activity(user_id)
-    
     try:
         pool = await get_connection_pool()
         if not pool:
@@ -310,6 +485,44 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         except:
             stats_text += "📊 **Google Sheets:** ❌ ошибка проверки\n"
         
+        from services.sheets_gateway import sheets_gateway
+        sheets_stats = sheets_gateway.get_stats()
+        stats_text += (
+            f"📈 **Запросы к Sheets:** чтений {sheets_stats['reads']}, записей {sheets_stats['writes']}, "
+            f"повторов {sheets_stats['retries']}, объединено {sheets_stats['coalesced_reads']}, "
+            f"ожидание квоты {sheets_stats['throttled_seconds']:.1f} с\n"
+        )
+        
+        from services.sheets_executor import sheets_executor
+        pool_stats = sheets_executor.get_stats()
+        stats_text += (
+            f"🧵 **Пул Sheets:** {pool_stats['active']}/{pool_stats['workers']} потоков, "
+            f"в очереди {pool_stats['queued']}, ожидание p99 {pool_stats['wait_p99']:.0f} мс, "
+            f"выполнение p50/p99 {pool_stats['run_p50']:.0f}/{pool_stats['run_p99']:.0f} мс\n"
+        )
+        
+        plan_latency = get_plan_latency_stats()
+        stats_text += (
+            f"\n⏱ **/plan:** p50 {plan_latency['p50']:.0f} мс, p99 {plan_latency['p99']:.0f} мс "
+            f"({plan_latency['count']} запросов, в кэше {get_plan_cache_size()} планов)\n"
+        )
+        
+        from services.template import get_template_cache_stats
+        template_cache = get_template_cache_stats()
+        stats_text += (
+            f"🧩 **Кэш шаблонов:** попаданий {template_cache['hits']}, промахов {template_cache['misses']}, "
+            f"{template_cache['size']}/{template_cache['max_size']} вариантов\n"
+        )
+        
+        from services.plan_pregeneration import get_pregeneration_stats
+        pregeneration = get_pregeneration_stats()
+        if pregeneration:
+            stats_text += (
+                f"🌙 **Ночная генерация** ({pregeneration['finished_at']:%d.%m %H:%M}): "
+                f"пользователей {pregeneration['users']}, сохранено {pregeneration['saved']} "
+                f"за {pregeneration['seconds']:.0f} с\n"
+            )
+        
         stats_text += f"\n🔄 Последнее обновление: {datetime.now().strftime('%H:%M:%S')}"
         
         await update.message.reply_text(stats_text, parse_mode='Markdown')
@@ -329,8 +542,6 @@ async def admin_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
         return
     
-    await update_user_activity(user_id)
-    
     try:
         pool = await get_connection_pool()
         if not pool:
@@ -365,6 +576,7 @@ async def admin_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         users_text += (
             "💡 **Команды:**\n"
             "• /add_plan – добавить план\n"
+            "• /assign_template – назначить шаблон нескольким пользователям\n"
             "• /admin_stats – статистика\n"
             "• /admin_users – список пользователей\n\n"
             "📊 Всего пользователей: " + str(len(users))
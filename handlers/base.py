@@ -4,7 +4,7 @@ from telegram import Update
 from telegram.ext import ContextTypes, CallbackContext
 
 from config import logger
-from database import update_user_activity, save_message, get_connection_pool
+from handlers.middleware import is_questionnaire_active
 
 async def handle_all_messages(update: Update, context: CallbackContext) -> None:
     """Обрабатывает все текстовые сообщения включая кнопки"""
@@ -14,29 +14,13 @@ async def handle_all_messages(update: Update, context: CallbackContext) -> None:
     user_id = update.effective_user.id
     message_text = update.message.text.strip()
     
-    # Получаем данные пользователя для проверки состояния анкеты
-    user_data = context.user_data or {}
-    
-    # Проверяем различные состояния анкеты
-    questionnaire_states = [
-        user_data.get('questionnaire_started', False),
-        user_data.get('current_question', -2) >= -1,
-        bool(user_data.get('assistant_gender')),
-        bool(user_data.get('assistant_name')),
-        bool(user_data.get('waiting_for_gender')),
-        bool(user_data.get('waiting_for_ready'))
-    ]
-    
-    # Если пользователь в ЛЮБОМ из этих состояний анкеты - пропускаем обработку
-    if any(questionnaire_states):
+    # Если пользователь в процессе заполнения анкеты - пропускаем обработку
+    if is_questionnaire_active(context.user_data):
         logger.info(f"⏩ Пропускаем сообщение в состоянии анкеты: {message_text}")
         return
     
     try:
-        # Сохраняем сообщение и обновляем активность
-        await save_message(user_id, message_text, 'incoming')
-        await update_user_activity(user_id)
-        
+        # Сообщение и активность уже записаны middleware
         logger.info(f"💬 Получено сообщение от {user_id}: {message_text}")
         
         # Проверяем, является ли сообщение напоминанием
@@ -0,0 +1,83 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from config import logger
+from database import check_user_registered, touch_user_activity, queue_message
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class UserContext:
+    """Данные пользователя, подготовленные один раз на обновление"""
+    user_id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    is_registered: bool
+
+
+def is_questionnaire_active(user_data: Optional[dict]) -> bool:
+    """Проверяет, находится ли пользователь в процессе заполнения анкеты"""
+    user_data = user_data or {}
+    return any([
+        user_data.get('questionnaire_started', False),
+        user_data.get('current_question', -2) >= -1,
+        bool(user_data.get('assistant_gender')),
+        bool(user_data.get('assistant_name')),
+        bool(user_data.get('waiting_for_gender')),
+        bool(user_data.get('waiting_for_ready'))
+    ])
+
+
+async def build_user_context(update: Update) -> UserContext:
+    """Собирает контекст пользователя (проверка регистрации идет через кэш)"""
+    user = update.effective_user
+    return UserContext(
+        user_id=user.id,
+        username=user.username,
+        first_name=user.first_name,
+        is_registered=await check_user_registered(user.id)
+    )
+
+
+async def get_user_context(update: Update, context: ContextTypes.DEFAULT_TYPE) -> UserContext:
+    """Возвращает контекст пользователя, подготовленный middleware, или собирает его"""
+    user_context = getattr(context, 'user_context', None)
+    if user_context is None or user_context.user_id != update.effective_user.id:
+        user_context = await build_user_context(update)
+        context.user_context = user_context
+    return user_context
+
+
+async def user_context_middleware(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Предобработка каждого обновления (группа -1).
+    
+    Проверяет регистрацию, отмечает активность и логирует входящее
+    сообщение. Запись в БД идет пакетами через flush_pending_writes().
+    """
+    if not update.effective_user:
+        return
+    
+    try:
+        user_context = await build_user_context(update)
+        context.user_context = user_context
+        
+        # Незарегистрированных пользователей еще нет в clients - писать нечего
+        if not user_context.is_registered:
+            return
+        
+        touch_user_activity(user_context.user_id)
+        
+        # Ответы анкеты сохраняются отдельно, команды в журнал сообщений не попадали и раньше
+        message = update.message
+        if (message and message.text and not message.text.startswith('/')
+                and not is_questionnaire_active(context.user_data)):
+            queue_message(user_context.user_id, message.text.strip(), 'incoming')
+            
+    except Exception as e:
+        logger.error(f"❌ Ошибка предобработки обновления {update.update_id}: {e}")
@@ -3,15 +3,19 @@ import re
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple, Any
 
+import pytz
 from telegram import Update
 from telegram.ext import ContextTypes, CallbackContext
 
-from config import logger
+from config import logger, DEFAULT_TIMEZONE, MORNING_PLAN_HOUR, EVENING_SURVEY_HOUR
 from database import (
-    update_user_activity, add_reminder_to_db, get_user_reminders,
-    delete_reminder_from_db, get_db_connection, get_connection_pool
+    add_reminder_to_db, get_user_reminders,
+    delete_reminder_from_db, get_db_connection, get_connection_pool,
+    deactivate_unreachable_users, get_active_timezones
 )
-from services.google_sheets import get_daily_plan_from_sheets
+from services.plan_service import get_daily_plan
+from services.leader_election import leader_only
+from utils.helpers import is_chat_unreachable_error
 
 # Константы для ограничений
 MAX_REMINDERS_PER_USER = 20
@@ -41,10 +45,8 @@ DAY_MAP = {
     'пн': 'пн', 'вт': 'вт', 'ср': 'ср', 'чт': 'чт', 'пт': 'пт', 'сб': 'сб', 'вс': 'вс'
 }
 
-EN_TO_RU_DAY = {
-    'monday': 'пн', 'tuesday': 'вт', 'wednesday': 'ср',
-    'thursday': 'чт', 'friday': 'пт', 'saturday': 'сб', 'sunday': 'вс'
-}
+# Дни недели в порядке ISO (понедельник = 1)
+WEEKDAYS_RU = ['пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс']
 
 REGULAR_KEYWORDS = [
     'каждый', 'каждое', 'ежедневно', 'регулярно', 'каждую', 'ежедневное',
@@ -55,8 +57,6 @@ REGULAR_KEYWORDS = [
 async def remind_me_command(update: Update, context: CallbackContext) -> None:
     """Установка разового напоминания"""
     user_id = update.effective_user.id
-    await update_user_activity(user_id)
-    
     if not context.args or len(context.args) < 2:
         await update.message.reply_text(
             "⏰ Установка разового напоминания:\n\n"
@@ -123,8 +123,6 @@ async def remind_me_command(update: Update, context: CallbackContext) -> None:
 async def regular_remind_command(update: Update, context: CallbackContext) -> None:
     """Установка регулярного напоминания"""
     user_id = update.effective_user.id
-    await update_user_activity(user_id)
-    
     if not context.args or len(context.args) < 3:
         await update.message.reply_text(
             "🔄 Установка регулярного напоминания:\n\n"
@@ -217,8 +215,6 @@ async def regular_remind_command(update: Update, context: CallbackContext) -> No
 async def my_reminders_command(update: Update, context: CallbackContext) -> None:
     """Показывает активные напоминания"""
     user_id = update.effective_user.id
-    await update_user_activity(user_id)
-    
     reminders = await get_user_reminders(user_id)
     
     if not reminders:
@@ -250,9 +246,6 @@ async def my_reminders_command(update: Update, context: CallbackContext) -> None
 
 async def delete_remind_command(update: Update, context: CallbackContext) -> None:
     """Удаляет напоминание"""
-    user_id = update.effective_user.id
-    await update_user_activity(user_id)
-    
     if not context.args:
         await update.message.reply_text(
             "❌ Укажите ID напоминания для удаления:\n"
@@ -289,8 +282,6 @@ async def handle_reminder_nlp(update: Update, context: CallbackContext) -> None:
     """Обрабатывает естественные запросы на напоминания"""
     user_id = update.effective_user.id
     message_text = update.message.text
-    await update_user_activity(user_id)
-    
     logger.info(f"🔍 Обработка естественного запроса: {message_text}")
     
     # Проверяем лимит напоминаний
@@ -380,62 +371,92 @@ async def send_reminder_once(context: ContextTypes.DEFAULT_TYPE) -> None:
         logger.info(f"✅ Разовое напоминание отправлено пользователю {user_id}")
         
     except Exception as e:
+        if is_chat_unreachable_error(e):
+            logger.warning(f"🚫 Пользователь {context.job.data['user_id']} недоступен: {e}")
+            await deactivate_unreachable_users([context.job.data['user_id']])
+            return
         logger.error(f"❌ Ошибка отправки разового напоминания: {e}")
 
 
-async def send_reminder_job(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Отправляет напоминания пользователям (асинхронная)"""
-    try:
-        # Получаем текущее время и день недели
-        now = datetime.now()
-        current_time = now.strftime("%H:%M")
-        current_day_en = now.strftime("%A").lower()
-        current_day = EN_TO_RU_DAY.get(current_day_en, 'пн')
+async def fetch_due_reminders(conn, now_utc: datetime) -> List[Any]:
+    """Активные напоминания, время которых наступило в часовом поясе пользователя"""
+    return await conn.fetch('''
+        SELECT ur.id, ur.user_id, ur.reminder_text, c.first_name, ur.reminder_type
+        FROM user_reminders ur 
+        JOIN clients c ON ur.user_id = c.user_id 
+        CROSS JOIN LATERAL (
+            SELECT date_trunc('minute', $1::timestamptz AT TIME ZONE COALESCE(c.timezone, $2)) AS local_now
+        ) lt
+        WHERE ur.is_active = TRUE 
+        AND c.status = 'active'
+        AND ur.reminder_time = lt.local_now::time
+        AND (
+            ur.days_of_week = 'ежедневно' 
+            OR ur.days_of_week LIKE '%' || ($3::text[])[EXTRACT(ISODOW FROM lt.local_now)::int] || '%'
+            OR (ur.days_of_week = '' AND ur.reminder_type = 'once')
+        )
+    ''', now_utc, DEFAULT_TIMEZONE, WEEKDAYS_RU)
+
+
+async def dispatch_due_reminders(bot, now_utc: datetime) -> int:
+    """Отправляет напоминания, наступившие в момент now_utc, возвращает количество отправленных"""
+    pool = await get_connection_pool()
+    if not pool:
+        logger.error("❌ Нет пула соединений с БД")
+        return 0
+    
+    unreachable_users = set()
+    sent = 0
         
-        pool = await get_connection_pool()
-        if not pool:
-            logger.error("❌ Нет пула соединений с БД")
-            return
+    async with pool.acquire() as conn:
+        # Ищем активные напоминания для текущего времени
+        reminders = await fetch_due_reminders(conn, now_utc)
+        
+        for reminder in reminders:
+            reminder_id = reminder['id']
+            user_id = reminder['user_id']
+            reminder_text = reminder['reminder_text']
+            first_name = reminder['first_name']
+            reminder_type = reminder['reminder_type']
             
-        async with pool.acquire() as conn:
-            # Ищем активные напоминания для текущего времени
-            reminders = await conn.fetch('''
-                SELECT ur.id, ur.user_id, ur.reminder_text, c.first_name, ur.reminder_type
-                FROM user_reminders ur 
-                JOIN clients c ON ur.user_id = c.user_id 
-                WHERE ur.is_active = TRUE 
-                AND ur.reminder_time = $1
-                AND (
-                    ur.days_of_week = 'ежедневно' 
-                    OR ur.days_of_week LIKE $2 
-                    OR (ur.days_of_week = '' AND ur.reminder_type = 'once')
-                )
-            ''', current_time, f'%{current_day}%')
+            # Пользователь уже оказался недоступен в этом цикле
+            if user_id in unreachable_users:
+                continue
             
-            for reminder in reminders:
-                reminder_id = reminder['id']
-                user_id = reminder['user_id']
-                reminder_text = reminder['reminder_text']
-                first_name = reminder['first_name']
-                reminder_type = reminder['reminder_type']
+            try:
+                await bot.send_message(
+                    chat_id=user_id,
+                    text=f"🔔 Напоминание для {first_name}: {reminder_text}"
+                )
+                sent += 1
+                logger.info(f"✅ Напоминание {reminder_id} отправлено пользователю {user_id}")
                 
-                try:
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text=f"🔔 Напоминание для {first_name}: {reminder_text}"
+                # Если это разовое напоминание - деактивируем его
+                if reminder_type == 'once':
+                    await conn.execute(
+                        'UPDATE user_reminders SET is_active = FALSE WHERE id = $1',
+                        reminder_id
                     )
-                    logger.info(f"✅ Напоминание {reminder_id} отправлено пользователю {user_id}")
+                    logger.info(f"📝 Разовое напоминание {reminder_id} деактивировано")
                     
-                    # Если это разовое напоминание - деактивируем его
-                    if reminder_type == 'once':
-                        await conn.execute(
-                            'UPDATE user_reminders SET is_active = FALSE WHERE id = $1',
-                            reminder_id
-                        )
-                        logger.info(f"📝 Разовое напоминание {reminder_id} деактивировано")
-                        
-                except Exception as e:
+            except Exception as e:
+                if is_chat_unreachable_error(e):
+                    unreachable_users.add(user_id)
+                    logger.warning(f"🚫 Пользователь {user_id} недоступен, напоминания будут отключены: {e}")
+                else:
                     logger.error(f"❌ Ошибка отправки напоминания {reminder_id} пользователю {user_id}: {e}")
+    
+    if unreachable_users:
+        await deactivate_unreachable_users(list(unreachable_users))
+    
+    return sent
+
+
+async def send_reminder_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Отправляет напоминания пользователям (асинхронная)"""
+    try:
+        # Текущий момент в UTC - локальное время и день недели считаются в часовом поясе каждого пользователя
+        await dispatch_due_reminders(context.bot, datetime.now(pytz.utc))
                     
     except Exception as e:
         logger.error(f"❌ Ошибка в send_reminder_job: {e}")
@@ -678,7 +699,7 @@ def schedule_reminders(application):
         if job_queue:
             # Проверяем напоминания каждую минуту
             job_queue.run_repeating(
-                callback=send_reminder_job,
+                callback=leader_only("reminder_checker")(send_reminder_job),
                 interval=CHECK_REMINDERS_INTERVAL,
                 first=10,  # начать через 10 секунд после запуска
                 name="reminder_checker"
@@ -688,28 +709,67 @@ def schedule_reminders(application):
         logger.error(f"❌ Ошибка настройки напоминаний: {e}")
 
 
+def get_timezones_at_local_hour(timezones: List[str], hour: int, now_utc: datetime) -> List[str]:
+    """Возвращает часовые пояса, в которых сейчас наступил указанный локальный час"""
+    result = []
+    for timezone in timezones:
+        try:
+            if now_utc.astimezone(pytz.timezone(timezone)).hour == hour:
+                result.append(timezone)
+        except pytz.UnknownTimeZoneError:
+            logger.warning(f"⚠️ Неизвестный часовой пояс: {timezone}")
+    return result
+
+
+async def send_timezone_broadcasts(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Ежечасно отправляет утренний план и вечерний опрос тем часовым поясам, где наступил нужный час"""
+    try:
+        now_utc = datetime.now(pytz.utc)
+        timezones = await get_active_timezones()
+        
+        morning_timezones = get_timezones_at_local_hour(timezones, MORNING_PLAN_HOUR, now_utc)
+        evening_timezones = get_timezones_at_local_hour(timezones, EVENING_SURVEY_HOUR, now_utc)
+        
+        if morning_timezones:
+            logger.info(f"🌅 Утренняя волна рассылки для часовых поясов: {', '.join(morning_timezones)}")
+            await send_morning_plan(context, timezones=morning_timezones)
+        
+        if evening_timezones:
+            logger.info(f"🌙 Вечерняя волна рассылки для часовых поясов: {', '.join(evening_timezones)}")
+            await send_evening_survey(context, timezones=evening_timezones)
+            
+    except Exception as e:
+        logger.error(f"❌ Ошибка в send_timezone_broadcasts: {e}")
+
+
 # Функции для автоматических сообщений
-async def send_morning_plan(context: ContextTypes.DEFAULT_TYPE) -> None:
+async def send_morning_plan(context: ContextTypes.DEFAULT_TYPE, timezones: Optional[List[str]] = None) -> None:
     """Отправляет утренний план пользователям (асинхронная)"""
     try:
         pool = await get_connection_pool()
         if not pool:
             logger.error("❌ Нет пула соединений с БД")
             return
+        
+        unreachable_users = []
             
         async with pool.acquire() as conn:
             users = await conn.fetch(
-                "SELECT user_id, first_name, username FROM clients WHERE status = 'active'"
+                '''SELECT user_id, first_name, username, COALESCE(timezone, $1) AS timezone
+                   FROM clients
+                   WHERE status = 'active'
+                   AND ($2::text[] IS NULL OR COALESCE(timezone, $1) = ANY($2::text[]))''',
+                DEFAULT_TIMEZONE, timezones
             )
             
             for user in users:
                 user_id = user['user_id']
                 first_name = user['first_name']
-                today = datetime.now().strftime("%Y-%m-%d")
+                today = datetime.now(pytz.timezone(user['timezone'])).strftime("%Y-%m-%d")
                 
                 try:
-                    # Получаем план из Google Sheets (синхронная функция)
-                    plan_data = get_daily_plan_from_sheets(user_id, today)
+                    # Получаем план из PostgreSQL (через кэш)
+                    plan_data = await get_daily_plan(user_id, today)
                     
                     if plan_data:
                         message = f"🌅 Доброе утро, {first_name}!\n\n"
@@ -755,23 +815,35 @@ async def send_morning_plan(context: ContextTypes.DEFAULT_TYPE) -> None:
                     logger.info(f"✅ Утренний план отправлен пользователю {user_id}")
                     
                 except Exception as e:
-                    logger.error(f"❌ Ошибка отправки утреннего плана пользователю {user_id}: {e}")
+                    if is_chat_unreachable_error(e):
+                        unreachable_users.append(user_id)
+                        logger.warning(f"🚫 Пользователь {user_id} недоступен для утреннего плана: {e}")
+                    else:
+                        logger.error(f"❌ Ошибка отправки утреннего плана пользователю {user_id}: {e}")
+        
+        await deactivate_unreachable_users(unreachable_users)
                     
     except Exception as e:
         logger.error(f"❌ Ошибка в send_morning_plan: {e}")
 
 
-async def send_evening_survey(context: ContextTypes.DEFAULT_TYPE) -> None:
+async def send_evening_survey(context: ContextTypes.DEFAULT_TYPE, timezones: Optional[List[str]] = None) -> None:
     """Отправляет вечерний опрос пользователям (асинхронная)"""
     try:
         pool = await get_connection_pool()
         if not pool:
             logger.error("❌ Нет пула соединений с БД")
             return
+        
+        unreachable_users = []
             
         async with pool.acquire() as conn:
             users = await conn.fetch(
-                "SELECT user_id, first_name FROM clients WHERE status = 'active'"
+                '''SELECT user_id, first_name
+                   FROM clients
+                   WHERE status = 'active'
+                   AND ($2::text[] IS NULL OR COALESCE(timezone, $1) = ANY($2::text[]))''',
+                DEFAULT_TIMEZONE, timezones
             )
             
             for user in users:
@@ -801,7 +873,13 @@ async def send_evening_survey(context: ContextTypes.DEFAULT_TYPE) -> None:
                     await context.bot.send_message(chat_id=user_id, text=message)
                     logger.info(f"✅ Вечерний опрос отправлен пользователю {user_id}")
                 except Exception as e:
-                    logger.error(f"❌ Ошибка отправки вечернего опроса пользователю {user_id}: {e}")
+                    if is_chat_unreachable_error(e):
+                        unreachable_users.append(user_id)
+                        logger.warning(f"🚫 Пользователь {user_id} недоступен для вечернего опроса: {e}")
+                    else:
+                        logger.error(f"❌ Ошибка отправки вечернего опроса пользователю {user_id}: {e}")
+        
+        await deactivate_unreachable_users(unreachable_users)
                     
     except Exception as e:
         logger.error(f"❌ Ошибка в send_evening_survey: {e}")
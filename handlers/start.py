@@ -1,14 +1,36 @@
 import logging
 from datetime import datetime
+from typing import Dict, List, Optional
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler, CallbackContext
 
 from config import QUESTIONS, YOUR_CHAT_ID, logger, GENDER, READY_CONFIRMATION, QUESTIONNAIRE
 from database import (
-    save_user_info, update_user_activity, check_user_registered,
-    save_questionnaire_answer, save_message
+    save_user_info, save_questionnaire_answers_bulk, save_message
 )
+from services.analytics import analyze_user_profile
 from services.google_sheets import save_client_to_sheets
+from services.task_queue import task_queue
+
+# Ответы копятся в user_data (сохраняется persistence) и пишутся в БД пакетами
+ANSWER_CHECKPOINT_INTERVAL = 5
+# Данные анкеты, которые остаются в user_data, пока ответы не записаны в БД
+UNSAVED_ANSWER_KEYS = ('answers', 'answers_checkpoint', 'questionnaire_id')
+
+
+async def checkpoint_answers(user_id: int, user_data: dict) -> bool:
+    """Сохраняет в БД ответы, накопленные после предыдущей контрольной точки"""
+    answers = user_data.get('answers', {})
+    checkpoint = user_data.get('answers_checkpoint', -1)
+    pending = {number: text for number, text in answers.items() if number > checkpoint}
+    
+    if not pending:
+        return True
+    
+    if await save_questionnaire_answers_bulk(user_id, pending):
+        user_data['answers_checkpoint'] = max(pending)
+        return True
+    return False
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -24,7 +46,6 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         
         try:
             await save_user_info(user_id, user.username, user.first_name, user.last_name)
-            await update_user_activity(user_id)
         except Exception as e:
             logger.error(f"❌ Ошибка сохранения пользователя {user_id}: {e}")
         
@@ -120,6 +141,7 @@ async def handle_ready_confirmation(update: Update, context: ContextTypes.DEFAUL
         # ВСЕГДА начинаем анкету с ПЕРВОГО вопроса
         context.user_data['current_question'] = 0
         context.user_data['answers'] = {}
+        context.user_data['answers_checkpoint'] = -1
         context.user_data['questionnaire_started'] = True
         
         # Отправляем ПЕРВЫЙ вопрос (БРАТЬ ТЕКСТ ВОПРОСА!)
@@ -151,21 +173,15 @@ async def handle_question(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         current_question = context.user_data.get('current_question', 0)
         logger.info(f"🔍 Обрабатываем вопрос #{current_question}: {answer_text[:50]}...")
         
-        # 🔴🔴🔴 ИСПРАВЛЕНИЕ КРИТИЧЕСКОЙ ОШИБКИ 🔴🔴🔴
-        # Берем текст вопроса из словаря, а не весь словарь
-        question_text = QUESTIONS[current_question]["text"] if current_question < len(QUESTIONS) else "Вопрос"
-        
-        try:
-            # ✅ ПРАВИЛЬНО: передаем текст вопроса, а не словарь
-            await save_questionnaire_answer(user_id, current_question, question_text, answer_text)
-            context.user_data['answers'][current_question] = answer_text
-        except Exception as e:
-            logger.error(f"❌ Ошибка сохранения ответа пользователя {user_id}: {e}")
-            # Продолжаем, так как ответ сохранен в context.user_data
+        context.user_data['answers'][current_question] = answer_text
         
         # Переходим к следующему вопросу
         next_question = current_question + 1
         
+        # Контрольная точка: при сбое БД ответы остаются в user_data и уйдут со следующим пакетом
+        if next_question < len(QUESTIONS) and next_question % ANSWER_CHECKPOINT_INTERVAL == 0:
+            await checkpoint_answers(user_id, context.user_data)
+        
         if next_question < len(QUESTIONS):
             # Отправляем следующий вопрос (БРАТЬ ТЕКСТ ВОПРОСА!)
             context.user_data['current_question'] = next_question
@@ -187,8 +203,69 @@ async def handle_question(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return ConversationHandler.END
 
 
+async def send_admin_digest(bot, parts: List[str], reply_markup: Optional[InlineKeyboardMarkup],
+                            summary_text: str, progress: Dict[str, int]) -> None:
+    """Отправляет анкету администратору частями; при повторе продолжает с неотправленной части"""
+    while progress['sent'] < len(parts):
+        part_num = progress['sent'] + 1
+        await bot.send_message(chat_id=YOUR_CHAT_ID, text=parts[progress['sent']])
+        progress['sent'] += 1
+        logger.info(f"✅ Отправлена часть анкеты {part_num}/{len(parts)}")
+    
+    if not progress.get('summary_sent'):
+        await bot.send_message(chat_id=YOUR_CHAT_ID, text=summary_text, reply_markup=reply_markup)
+        progress['summary_sent'] = 1
+        logger.info("✅ Кнопки действий отправлены админу")
+
+
+async def analyze_profile_for_admin(bot, user_id: int, first_name: str) -> bool:
+    """Анализирует профиль по ответам из БД и ставит краткую сводку в очередь администратору"""
+    profile = await analyze_user_profile(user_id)
+    if not profile:
+        return False
+    
+    optimal_times = profile.get('optimal_times', {})
+    summary = (
+        f"🧠 Анализ профиля {first_name} ({user_id}):\n\n"
+        f"• Тип личности: {profile.get('personality_type', 'unknown')}\n"
+        f"• Уровень активности: {profile.get('activity_level', 'unknown')}\n"
+        f"• Подъем: {optimal_times.get('wake_up', '-')}, глубокая работа с {optimal_times.get('deep_work_start', '-')}\n"
+        f"• Препятствия: {', '.join(profile.get('obstacles', [])) or 'не указаны'}\n"
+        f"• Мотивация: {', '.join(profile.get('motivation_triggers', [])) or 'не указана'}"
+    )
+    task_queue.submit(
+        'admin_digest', send_admin_digest, bot, [], None, summary, {'sent': 0},
+        description=f"анализ профиля {user_id}"
+    )
+    return True
+
+
+async def save_remaining_answers(application, user_id: int, first_name: str, questionnaire_id: str,
+                                 pending: Dict[int, str], user_data: dict) -> bool:
+    """
+    Фоновый повтор записи ответов, не сохраненных при завершении анкеты.
+    До успешной записи ответы остаются в user_data; после нее убираются
+    оттуда (если пользователь не начал новую анкету) и запускается анализ профиля.
+    """
+    if not await save_questionnaire_answers_bulk(user_id, pending):
+        return False
+    
+    if user_data.get('questionnaire_id') == questionnaire_id:
+        for key in UNSAVED_ANSWER_KEYS:
+            user_data.pop(key, None)
+        # Изменение вне обработки обновления: persistence само его не заметит
+        application.mark_data_for_update_persistence(user_ids=user_id)
+    
+    logger.info(f"✅ Ответы анкеты {questionnaire_id} сохранены в БД повторной попыткой")
+    task_queue.submit(
+        'profile_analysis', analyze_profile_for_admin, application.bot, user_id, first_name,
+        description=f"профиль {user_id}"
+    )
+    return True
+
+
 async def finish_questionnaire(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Завершает анкету и отправляет данные"""
+    """Завершает анкету: отвечает пользователю сразу, остальное - в фоновой очереди"""
     try:
         user = update.effective_user
         user_id = user.id
@@ -197,13 +274,36 @@ async def finish_questionnaire(update: Update, context: ContextTypes.DEFAULT_TYP
         
         logger.info(f"🎉 Завершаем анкету {questionnaire_id} для пользователя {user_id}")
         
+        # Сообщение пользователю с меню
+        keyboard = [
+            ['📊 Прогресс', '👤 Профиль'],
+            ['📋 План на сегодня', '🔔 Мои напоминания'],
+            ['ℹ️ Помощь', '🎮 Очки опыта']
+        ]
+        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        
+        await update.message.reply_text(
+            "🎉 Спасибо за ответы!\n\n"
+            "✅ Я передал всю информацию нашему специалисту. В течение 24 часов он проанализирует ваши данные и составит для вас индивидуальный план.\n\n"
+            "🔔 Теперь у вас есть доступ к персональному ассистенту!\n\n"
+            "💡 Вы можете писать напоминания естественным языком:\n"
+            "'напомни мне в 20:00 сходить в душ'\n"
+            "'напоминай каждый день в 8:00 делать зарядку'\n\n"
+            "Или использовать команды из меню ниже:",
+            reply_markup=reply_markup
+        )
+        
+        # Дописываем ответы после последней контрольной точки одним пакетом
+        answers_saved = await checkpoint_answers(user_id, context.user_data)
+        answers = context.user_data['answers']
+        
         user_data = {
             'user_id': user.id,
             'telegram_username': user.username,
             'first_name': user.first_name,
             'last_name': user.last_name,
             'start_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'main_goal': context.user_data['answers'].get(0, ''),
+            'main_goal': answers.get(0, ''),
             'last_activity': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             'текущий_уровень': 'Новичок',
             'очки_опыта': '0',
@@ -216,19 +316,6 @@ async def finish_questionnaire(update: Update, context: ContextTypes.DEFAULT_TYP
             'assistant_name': assistant_name
         }
         
-        # Сохраняем ответы с номерами вопросов
-        for i, question_dict in enumerate(QUESTIONS):
-            answer = context.user_data['answers'].get(i, '❌ Нет ответа')
-            # Сохраняем текст вопроса и ответ
-            user_data[f'question_{i+1}_text'] = question_dict["text"]
-            user_data[f'question_{i+1}_answer'] = answer
-        
-        try:
-            save_client_to_sheets(user_data)
-            logger.info(f"✅ Данные анкеты {questionnaire_id} сохранены в Google Sheets")
-        except Exception as e:
-            logger.error(f"❌ Ошибка сохранения в Google Sheets: {e}")
-
         # Формируем анкету для администратора
         questionnaire = f"📋 Новая анкета от пользователя:\n\n"
         questionnaire += f"👤 ID: {user.id}\n"
@@ -243,10 +330,12 @@ async def finish_questionnaire(update: Update, context: ContextTypes.DEFAULT_TYP
         
         questionnaire += "📝 Ответы на вопросы:\n\n"
         
-        # ✅ ПРАВИЛЬНО: берем текст вопроса из словаря
+        # Один проход по ответам: данные для Google Sheets и текст для администратора
         for i, question_dict in enumerate(QUESTIONS):
-            answer = context.user_data['answers'].get(i, '❌ Нет ответа')
+            answer = answers.get(i, '❌ Нет ответа')
             question_text = question_dict["text"]
+            user_data[f'question_{i+1}_text'] = question_text
+            user_data[f'question_{i+1}_answer'] = answer
             # Обрезаем длинные ответы для читабельности
             truncated_answer = answer[:500] + "..." if len(answer) > 500 else answer
             # Обрезаем текст вопроса если слишком длинный
@@ -254,62 +343,46 @@ async def finish_questionnaire(update: Update, context: ContextTypes.DEFAULT_TYP
             questionnaire += f"❓ {i+1}. {truncated_question}:\n"
             questionnaire += f"💬 {truncated_answer}\n\n"
         
-        # Отправляем админу с обработкой ошибок
         max_length = 4096
-        if len(questionnaire) > max_length:
-            parts = [questionnaire[i:i+max_length] for i in range(0, len(questionnaire), max_length)]
-            for part_num, part in enumerate(parts, 1):
-                try:
-                    await context.bot.send_message(chat_id=YOUR_CHAT_ID, text=part)
-                    logger.info(f"✅ Отправлена часть анкеты {part_num}/{len(parts)}")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка отправки части анкеты {part_num}: {e}")
+        parts = [questionnaire[i:i+max_length] for i in range(0, len(questionnaire), max_length)]
+        
+        admin_markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton("📝 Ответить пользователю", callback_data=f"reply_{user.id}")],
+            [InlineKeyboardButton("👁️ Просмотреть анкету", callback_data=f"view_questionnaire_{user.id}")],
+            [InlineKeyboardButton("📊 Статистика пользователя", callback_data=f"stats_{user.id}")],
+            [InlineKeyboardButton("📋 Создать план", callback_data=f"create_plan_{user.id}")]
+        ])
+        
+        # Фоновые стадии: анкета админу, запись в Google Sheets, анализ профиля
+        task_queue.submit(
+            'admin_digest', send_admin_digest, context.bot, parts, admin_markup,
+            f"✅ Пользователь {user.first_name} завершил анкету {questionnaire_id}!", {'sent': 0},
+            description=f"анкета {questionnaire_id}"
+        )
+        task_queue.submit(
+            'sheets_upsert', save_client_to_sheets, user_data,
+            description=f"клиент {user_id}"
+        )
+        if answers_saved:
+            task_queue.submit(
+                'profile_analysis', analyze_profile_for_admin, context.bot, user_id, user.first_name,
+                description=f"профиль {user_id}"
+            )
         else:
-            try:
-                await context.bot.send_message(chat_id=YOUR_CHAT_ID, text=questionnaire)
-                logger.info("✅ Анкета отправлена админу")
-            except Exception as e:
-                logger.error(f"❌ Ошибка отправки анкеты: {e}")
-        
-        # Отправляем кнопки действий администратору
-        try:
-            reply_markup = InlineKeyboardMarkup([
-                [InlineKeyboardButton("📝 Ответить пользователю", callback_data=f"reply_{user.id}")],
-                [InlineKeyboardButton("👁️ Просмотреть анкету", callback_data=f"view_questionnaire_{user.id}")],
-                [InlineKeyboardButton("📊 Статистика пользователя", callback_data=f"stats_{user.id}")],
-                [InlineKeyboardButton("📋 Создать план", callback_data=f"create_plan_{user.id}")]
-            ])
-            
-            await context.bot.send_message(
-                chat_id=YOUR_CHAT_ID, 
-                text=f"✅ Пользователь {user.first_name} завершил анкету {questionnaire_id}!",
-                reply_markup=reply_markup
+            # Ответы остаются в user_data, пока фоновый повтор не запишет их в БД
+            checkpoint = context.user_data.get('answers_checkpoint', -1)
+            pending = {number: text for number, text in answers.items() if number > checkpoint}
+            logger.error(f"❌ Ответы анкеты {questionnaire_id} не сохранены в БД, запись повторится в фоне")
+            task_queue.submit(
+                'answers_save', save_remaining_answers, context.application, user_id, user.first_name,
+                questionnaire_id, pending, context.user_data,
+                description=f"ответы анкеты {questionnaire_id}"
             )
-            logger.info("✅ Кнопки действий отправлены админу")
-        except Exception as e:
-            logger.error(f"❌ Ошибка отправки кнопок админу: {e}")
-        
-        # Сообщение пользователю с меню
-        keyboard = [
-            ['📊 Прогресс', '👤 Профиль'],
-            ['📋 План на сегодня', '🔔 Мои напоминания'],
-            ['ℹ️ Помощь', '🎮 Очки опыта']
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        
-        await update.message.reply_text(
-            "🎉 Спасибо за ответы!\n\n"
-            "✅ Я передал всю информацию нашему специалисту. В течение 24 часов он проанализирует ваши данные и составит для вас индивидуальный план.\n\n"
-            "🔔 Теперь у вас есть доступ к персональному ассистенту!\n\n"
-            "💡 Вы можете писать напоминания естественным языком:\n"
-            "'напомни мне в 20:00 сходить в душ'\n"
-            "'напоминай каждый день в 8:00 делать зарядку'\n\n"
-            "Или использовать команды из меню ниже:",
-            reply_markup=reply_markup
-        )
         
-        # Очищаем данные анкеты, но сохраняем настройки ассистента
+        # Очищаем данные анкеты, но сохраняем настройки ассистента (и ответы, если они еще не в БД)
         keys_to_keep = ['assistant_name', 'assistant_gender', 'greeting_emoji']
+        if not answers_saved:
+            keys_to_keep.extend(UNSAVED_ANSWER_KEYS)
         preserved_data = {k: context.user_data.get(k) for k in keys_to_keep if k in context.user_data}
         context.user_data.clear()
         context.user_data.update(preserved_data)
@@ -1,33 +1,51 @@
 import logging
+import re
+import time
 from datetime import datetime, timedelta
+
+import pytz
 from telegram import Update
 from telegram.ext import ContextTypes, CallbackContext
 
-from config import logger
+from config import DEFAULT_TIMEZONE, logger
 from database import (
-    update_user_activity, check_user_registered, save_progress_to_db,
+    save_progress_to_db,
     has_sufficient_data, get_user_activity_streak, get_user_main_goal,
     get_favorite_ritual, get_user_level_info, get_user_usage_days,
-    get_connection_pool, save_completed_task
-)
-from services.google_sheets import (
-    get_daily_plan_from_sheets, save_daily_report_to_sheets
+    get_connection_pool, save_completed_task, get_user_timezone, set_user_timezone
 )
+from handlers.middleware import get_user_context
+from services.plan_service import get_daily_plan, record_plan_latency
 
 logger = logging.getLogger(__name__)
 
+async def get_user_today(user_id: int) -> str:
+    """Сегодняшняя дата (ГГГГ-ММ-ДД) в часовом поясе пользователя"""
+    try:
+        timezone = pytz.timezone(await get_user_timezone(user_id))
+    except pytz.UnknownTimeZoneError:
+        timezone = pytz.timezone(DEFAULT_TIMEZONE)
+    return datetime.now(timezone).strftime("%Y-%m-%d")
+
 async def plan_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает текущий план пользователя"""
+    started = time.perf_counter()
+    try:
+        await _send_plan(update, context)
+    finally:
+        record_plan_latency((time.perf_counter() - started) * 1000)
+
+async def _send_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Формирует и отправляет план на сегодня"""
     user_id = update.effective_user.id
-    await update_user_activity(user_id)
-    
-    if not await check_user_registered(user_id):
+    user_context = await get_user_context(update, context)
+    if not user_context.is_registered:
         await update.message.reply_text("❌ Сначала заполните анкету: /start")
         return
     
-    # Получаем план из Google Sheets
-    today = datetime.now().strftime("%Y-%m-%d")
-    plan_data = get_daily_plan_from_sheets(user_id, today)
+    # Получаем план из PostgreSQL (через кэш)
+    today = await get_user_today(user_id)
+    plan_data = await get_daily_plan(user_id, today)
     
     if not plan_data:
         await update.message.reply_text(
@@ -73,9 +91,8 @@ async def plan_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def progress_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает персонализированный прогресс"""
     user_id = update.effective_user.id
-    await update_user_activity(user_id)
-    
-    if not await check_user_registered(user_id):
+    user_context = await get_user_context(update, context)
+    if not user_context.is_registered:
         await update.message.reply_text("❌ Сначала заполните анкету: /start")
         return
     
@@ -166,9 +183,8 @@ async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает профиль пользователя"""
     user = update.effective_user
     user_id = user.id
-    await update_user_activity(user_id)
-    
-    if not await check_user_registered(user_id):
+    user_context = await get_user_context(update, context)
+    if not user_context.is_registered:
         await update.message.reply_text("❌ Сначала заполните анкету: /start")
         return
     
@@ -240,9 +256,6 @@ async def points_info_command(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает справку по командам"""
-    user_id = update.effective_user.id
-    await update_user_activity(user_id)
-    
     help_text = (
         "ℹ️ Справка по командам:\n\n"
         
@@ -252,6 +265,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/progress - Статистика прогресса\n"
         "/profile - Ваш профиль\n"
         "/points_info - Объяснение системы очков\n"
+        "/timezone - Ваш часовой пояс\n"
         "/help - Эта справка\n\n"
         
         "🔹 Команды для отслеживания:\n"
@@ -279,10 +293,9 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def done_command(update: Update, context: CallbackContext):
     """Отмечает выполнение задачи"""
     user_id = update.effective_user.id
-    await update_user_activity(user_id)
-    
     # Проверка регистрации
-    if not await check_user_registered(user_id):
+    user_context = await get_user_context(update, context)
+    if not user_context.is_registered:
         await update.message.reply_text("❌ Сначала заполните анкету: /start")
         return
     
@@ -316,10 +329,9 @@ async def done_command(update: Update, context: CallbackContext):
 async def mood_command(update: Update, context: CallbackContext):
     """Оценка настроения"""
     user_id = update.effective_user.id
-    await update_user_activity(user_id)
-    
     # Проверка регистрации
-    if not await check_user_registered(user_id):
+    user_context = await get_user_context(update, context)
+    if not user_context.is_registered:
         await update.message.reply_text("❌ Сначала заполните анкету: /start")
         return
     
@@ -340,17 +352,10 @@ async def mood_command(update: Update, context: CallbackContext):
         
         progress_data = {
             'mood': mood,
-            'progress_date': datetime.now().strftime("%Y-%m-%d")
+            'progress_date': await get_user_today(user_id)
         }
         await save_progress_to_db(user_id, progress_data)
         
-        # Сохраняем в Google Sheets
-        report_data = {
-            'date': datetime.now().strftime("%Y-%m-%d"),
-            'mood': mood
-        }
-        save_daily_report_to_sheets(user_id, report_data)
-        
         mood_responses = {
             1: "😔 Мне жаль, что у вас плохое настроение.",
             2: "😟 Надеюсь, завтра будет лучше!",
@@ -373,10 +378,9 @@ async def mood_command(update: Update, context: CallbackContext):
 async def energy_command(update: Update, context: CallbackContext):
     """Оценка уровня энергии"""
     user_id = update.effective_user.id
-    await update_user_activity(user_id)
-    
     # Проверка регистрации
-    if not await check_user_registered(user_id):
+    user_context = await get_user_context(update, context)
+    if not user_context.is_registered:
         await update.message.reply_text("❌ Сначала заполните анкету: /start")
         return
     
@@ -397,17 +401,10 @@ async def energy_command(update: Update, context: CallbackContext):
         
         progress_data = {
             'energy': energy,
-            'progress_date': datetime.now().strftime("%Y-%m-%d")
+            'progress_date': await get_user_today(user_id)
         }
         await save_progress_to_db(user_id, progress_data)
         
-        # Сохраняем в Google Sheets
-        report_data = {
-            'date': datetime.now().strftime("%Y-%m-%d"),
-            'energy': energy
-        }
-        save_daily_report_to_sheets(user_id, report_data)
-        
         energy_responses = {
             1: "💤 Важно отдыхать! Может, стоит сделать перерыв?",
             2: "😴 Похоже, сегодня тяжелый день. Берегите себя!",
@@ -430,10 +427,9 @@ async def energy_command(update: Update, context: CallbackContext):
 async def water_command(update: Update, context: CallbackContext):
     """Отслеживание водного баланса"""
     user_id = update.effective_user.id
-    await update_user_activity(user_id)
-    
     # Проверка регистрации
-    if not await check_user_registered(user_id):
+    user_context = await get_user_context(update, context)
+    if not user_context.is_registered:
         await update.message.reply_text("❌ Сначала заполните анкету: /start")
         return
     
@@ -452,17 +448,10 @@ async def water_command(update: Update, context: CallbackContext):
         
         progress_data = {
             'water_intake': water,
-            'progress_date': datetime.now().strftime("%Y-%m-%d")
+            'progress_date': await get_user_today(user_id)
         }
         await save_progress_to_db(user_id, progress_data)
         
-        # Сохраняем в Google Sheets
-        report_data = {
-            'date': datetime.now().strftime("%Y-%m-%d"),
-            'water_intake': water
-        }
-        save_daily_report_to_sheets(user_id, report_data)
-        
         responses = {
             0: "💧 Напомнить выпить воды?",
             1: "💧 Мало воды, нужно больше!",
@@ -479,3 +468,58 @@ async def water_command(update: Update, context: CallbackContext):
         
     except ValueError:
         await update.message.reply_text("❌ Количество должно быть числом")
+
+def parse_timezone_input(text: str) -> str:
+    """Преобразует ввод пользователя (Europe/Moscow, UTC+3, +3) в имя часового пояса"""
+    text = text.strip()
+    
+    offset_match = re.fullmatch(r'(?:UTC|GMT)?\s*([+-])(\d{1,2})', text, re.IGNORECASE)
+    if offset_match:
+        sign, hours = offset_match.groups()
+        if int(hours) == 0:
+            return 'UTC'
+        # В базе tz знак у Etc/GMT инвертирован: UTC+3 это Etc/GMT-3
+        return f"Etc/GMT{'-' if sign == '+' else '+'}{int(hours)}"
+    
+    return text
+
+async def timezone_command(update: Update, context: CallbackContext):
+    """Показывает или изменяет часовой пояс пользователя"""
+    user_id = update.effective_user.id
+    user_context = await get_user_context(update, context)
+    if not user_context.is_registered:
+        await update.message.reply_text("❌ Сначала заполните анкету: /start")
+        return
+    
+    if not context.args:
+        current_timezone = await get_user_timezone(user_id)
+        local_time = datetime.now(pytz.timezone(current_timezone)).strftime("%H:%M")
+        await update.message.reply_text(
+            f"🕒 Ваш часовой пояс: {current_timezone} (сейчас {local_time})\n\n"
+            "Чтобы изменить часовой пояс:\n"
+            "/timezone Europe/Moscow\n"
+            "/timezone Asia/Yekaterinburg\n"
+            "/timezone UTC+3\n\n"
+            "Утренний план, вечерний опрос и напоминания приходят по вашему местному времени."
+        )
+        return
+    
+    timezone_name = parse_timezone_input(context.args[0])
+    
+    try:
+        timezone = pytz.timezone(timezone_name)
+    except pytz.UnknownTimeZoneError:
+        await update.message.reply_text(
+            "❌ Не удалось распознать часовой пояс.\n"
+            "Укажите его в формате Europe/Moscow или UTC+3"
+        )
+        return
+    
+    if await set_user_timezone(user_id, timezone.zone):
+        local_time = datetime.now(timezone).strftime("%H:%M")
+        await update.message.reply_text(
+            f"✅ Часовой пояс установлен: {timezone.zone}\n"
+            f"🕒 Ваше местное время: {local_time}"
+        )
+    else:
+        await update.message.reply_text("❌ Не удалось сохранить часовой пояс. Попробуйте позже.")
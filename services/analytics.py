@@ -9,74 +9,75 @@ def _safe_analyze_text(text: Optional[str]) -> str:
     """Безопасно обрабатывает текст для анализа"""
     return text.lower() if text else ""
 
-def analyze_user_profile(user_id: int) -> Dict[str, Any]:
-    """Анализирует профиль пользователя по новой анкете"""
-    from database import get_db_connection
-
-    conn = None
+async def analyze_user_profile(user_id: int) -> Dict[str, Any]:
+    """Асинхронно анализирует профиль пользователя по новой анкете"""
+    from database import get_db_connection, POSTGRESQL_AVAILABLE
+    
+    if not POSTGRESQL_AVAILABLE:
+        return {}
+    
     try:
-        conn = get_db_connection()
-        if not conn:
-            return {}
-            
-        cursor = conn.cursor()
-        cursor.execute("SELECT question_number, answer_text FROM questionnaire_answers WHERE user_id = %s", (user_id,))
+        async with get_db_connection() as conn:
+            rows = await conn.fetch(
+                "SELECT question_number, answer_text FROM questionnaire_answers WHERE user_id = $1",
+                user_id
+            )
         
-        rows = cursor.fetchall()
         answers = {}
         
         for row in rows:
             answers[row['question_number']] = row['answer_text']
         
-        profile = {
-            'user_id': user_id,
-            'main_goal': answers.get(1, ''),
-            'goal_motivation': answers.get(2, ''),
-            'success_criteria': answers.get(3, ''),
-            'daily_hours': extract_hours(answers.get(4, '')),
-            'deadline_info': analyze_deadlines(answers.get(5, '')),
-            'sleep_schedule': answers.get(6, ''),
-            'daily_routine': answers.get(7, ''),
-            'energy_peaks': answers.get(8, ''),
-            'distraction_time': extract_hours(answers.get(9, '')),
-            'burnout_frequency': answers.get(10, ''),
-            'work_style': analyze_work_style(answers.get(11, '')),
-            'focus_aids': analyze_focus_aids(answers.get(12, '')),
-            'break_activities': analyze_break_activities(answers.get(13, '')),
-            'activity_level': analyze_activity_level(answers.get(14, '')),
-            'sport_preferences': answers.get(15, ''),
-            'sport_schedule': answers.get(16, ''),
-            'health_limitations': answers.get(17, ''),
-            'eating_habits': answers.get(18, ''),
-            'water_intake': analyze_water_intake(answers.get(19, '')),
-            'diet_changes': answers.get(20, ''),
-            'cooking_time': answers.get(21, ''),
-            'sleep_quality': answers.get(22, ''),
-            'motivation_triggers': analyze_motivation(answers.get(23, '')),
-            'obstacles': analyze_obstacles(answers.get(24, '')),
-            'stress_management': answers.get(25, ''),
-            'rest_preferences': analyze_rest_preferences(answers.get(26, '')),
-            'rest_frequency': answers.get(27, ''),
-            'personal_rituals': answers.get(28, ''),
-            'weekend_planning': answers.get(29, ''),
-            'social_needs': answers.get(30, ''),
-            'hobby_time': answers.get(31, ''),
-            'health_rituals': answers.get(32, ''),
-            'work_life_balance': answers.get(33, ''),
-            'plan_obstacles': answers.get(34, ''),
-            'contingency_planning': answers.get(35, ''),
-            'personality_type': determine_personality_type(answers),
-            'optimal_times': calculate_optimal_times(answers.get(6, ''), answers.get(8, ''))
-        }
-        
-        return profile
+        return build_user_profile(user_id, answers)
         
     except Exception as e:
         logger.error(f"❌ Ошибка анализа профиля пользователя {user_id}: {e}")
         return {}
-    finally:
-        if conn:
-            conn.close()
+
+def build_user_profile(user_id: int, answers: Dict[int, str]) -> Dict[str, Any]:
+    """Строит профиль пользователя по ответам анкеты {номер вопроса: ответ} (без обращений к БД)"""
+    profile = {
+        'user_id': user_id,
+        'main_goal': answers.get(1, ''),
+        'goal_motivation': answers.get(2, ''),
+        'success_criteria': answers.get(3, ''),
+        'daily_hours': extract_hours(answers.get(4, '')),
+        'deadline_info': analyze_deadlines(answers.get(5, '')),
+        'sleep_schedule': answers.get(6, ''),
+        'daily_routine': answers.get(7, ''),
+        'energy_peaks': answers.get(8, ''),
+        'distraction_time': extract_hours(answers.get(9, '')),
+        'burnout_frequency': answers.get(10, ''),
+        'work_style': analyze_work_style(answers.get(11, '')),
+        'focus_aids': analyze_focus_aids(answers.get(12, '')),
+        'break_activities': analyze_break_activities(answers.get(13, '')),
+        'activity_level': analyze_activity_level(answers.get(14, '')),
+        'sport_preferences': answers.get(15, ''),
+        'sport_schedule': answers.get(16, ''),
+        'health_limitations': answers.get(17, ''),
+        'eating_habits': answers.get(18, ''),
+        'water_intake': analyze_water_intake(answers.get(19, '')),
+        'diet_changes': answers.get(20, ''),
+        'cooking_time': answers.get(21, ''),
+        'sleep_quality': answers.get(22, ''),
+        'motivation_triggers': analyze_motivation(answers.get(23, '')),
+        'obstacles': analyze_obstacles(answers.get(24, '')),
+        'stress_management': answers.get(25, ''),
+        'rest_preferences': analyze_rest_preferences(answers.get(26, '')),
+        'rest_frequency': answers.get(27, ''),
+        'personal_rituals': answers.get(28, ''),
+        'weekend_planning': answers.get(29, ''),
+        'social_needs': answers.get(30, ''),
+        'hobby_time': answers.get(31, ''),
+        'health_rituals': answers.get(32, ''),
+        'work_life_balance': answers.get(33, ''),
+        'plan_obstacles': answers.get(34, ''),
+        'contingency_planning': answers.get(35, ''),
+        'personality_type': determine_personality_type(answers),
+        'optimal_times': calculate_optimal_times(answers.get(6, ''), answers.get(8, ''))
+    }
+    
+    return profile
 
 def analyze_work_style(answer: Optional[str]) -> Dict[str, Any]:
     """Анализирует предпочтения по стилю работы с защитой от ошибок"""
@@ -0,0 +1,307 @@
+"""
+Локальная замена Google Sheets для тестов и бенчмарков.
+
+Реализует ту часть API gspread (Spreadsheet/Worksheet), которой пользуется
+services/google_sheets.py, и хранит данные в памяти процесса. Задержка
+ответа и ошибки квоты (429) настраиваются, чтобы кэширование, повторы и
+ограничение частоты запросов можно было проверять без реальной таблицы:
+
+    from services.fake_sheets import FakeSpreadsheet, FaultConfig
+    from services.google_sheets import use_spreadsheet
+
+    use_spreadsheet(FakeSpreadsheet(FaultConfig(latency=0.2, error_rate=0.05)))
+"""
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional
+
+import gspread
+from gspread.cell import Cell
+from gspread.utils import a1_range_to_grid_range, rowcol_to_a1
+
+from config import logger
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FaultConfig:
+    """Параметры имитации сети и квот Google Sheets API"""
+    latency: float = 0.0               # базовая задержка каждого запроса, секунды
+    latency_jitter: float = 0.0        # случайная добавка к задержке, секунды
+    error_rate: float = 0.0            # вероятность ответа 429 на любой запрос
+    read_quota_per_minute: int = 0     # 0 - без ограничения
+    write_quota_per_minute: int = 0    # 0 - без ограничения
+    seed: Optional[int] = None
+
+
+class _FakeResponse:
+    """Минимальный ответ requests, из которого gspread строит APIError"""
+    
+    def __init__(self, status_code: int, message: str):
+        self.status_code = status_code
+        self.text = message
+        self._payload = {
+            'error': {'code': status_code, 'message': message, 'status': 'RESOURCE_EXHAUSTED'}
+        }
+    
+    def json(self) -> Dict[str, Any]:
+        return self._payload
+
+
+class FakeSpreadsheet:
+    """Таблица в памяти с имитацией задержек и ошибок квоты"""
+    
+    def __init__(self, faults: Optional[FaultConfig] = None, title: str = "fake"):
+        self.title = title
+        self.faults = faults or FaultConfig()
+        self._random = random.Random(self.faults.seed)
+        self._worksheets: Dict[str, 'FakeWorksheet'] = {}
+        self._lock = threading.RLock()
+        self._recent_requests: Dict[str, Deque[float]] = {'read': deque(), 'write': deque()}
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+    
+    def _quota(self, kind: str) -> int:
+        if kind == 'read':
+            return self.faults.read_quota_per_minute
+        return self.faults.write_quota_per_minute
+    
+    def _request(self, kind: str, method: str) -> None:
+        """Имитирует сетевой запрос: задержка, квота в минуту, случайный 429"""
+        delay = self.faults.latency
+        if self.faults.latency_jitter:
+            delay += self._random.uniform(0, self.faults.latency_jitter)
+        if delay:
+            time.sleep(delay)
+        
+        with self._lock:
+            self.calls[method] += 1
+            
+            quota = self._quota(kind)
+            if quota:
+                now = time.monotonic()
+                recent = self._recent_requests[kind]
+                while recent and now - recent[0] >= 60:
+                    recent.popleft()
+                if len(recent) >= quota:
+                    self.errors[method] += 1
+                    raise gspread.exceptions.APIError(
+                        _FakeResponse(429, f"Quota exceeded for {kind} requests per minute")
+                    )
+                recent.append(now)
+            
+            if self.faults.error_rate and self._random.random() < self.faults.error_rate:
+                self.errors[method] += 1
+                raise gspread.exceptions.APIError(_FakeResponse(429, "Injected quota error"))
+    
+    def worksheet(self, title: str) -> 'FakeWorksheet':
+        self._request('read', 'worksheet')
+        with self._lock:
+            if title not in self._worksheets:
+                raise gspread.exceptions.WorksheetNotFound(title)
+            return self._worksheets[title]
+    
+    def worksheets(self) -> List['FakeWorksheet']:
+        self._request('read', 'worksheets')
+        with self._lock:
+            return list(self._worksheets.values())
+    
+    def add_worksheet(self, title: str, rows: int, cols: int, index: Optional[int] = None) -> 'FakeWorksheet':
+        self._request('write', 'add_worksheet')
+        with self._lock:
+            worksheet = FakeWorksheet(self, title, rows, cols)
+            self._worksheets[title] = worksheet
+            return worksheet
+    
+    def del_worksheet(self, worksheet: 'FakeWorksheet') -> None:
+        self._request('write', 'del_worksheet')
+        with self._lock:
+            self._worksheets.pop(worksheet.title, None)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Количество запросов и внедренных ошибок по методам"""
+        with self._lock:
+            return {'calls': dict(self.calls), 'errors': dict(self.errors)}
+
+
+class FakeWorksheet:
+    """Лист таблицы в памяти: строки хранятся как списки строк, индексация с 1"""
+    
+    def __init__(self, spreadsheet: FakeSpreadsheet, title: str, rows: int, cols: int):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.row_count = rows
+        self.col_count = cols
+        self.hidden = False
+        self._rows: List[List[str]] = []
+    
+    # ---- внутренние операции без имитации сети ----
+    
+    def _set(self, row: int, col: int, value: Any) -> None:
+        while len(self._rows) < row:
+            self._rows.append([])
+        cells = self._rows[row - 1]
+        while len(cells) < col:
+            cells.append('')
+        cells[col - 1] = '' if value is None else str(value)
+        self.row_count = max(self.row_count, row)
+        self.col_count = max(self.col_count, col)
+    
+    def _get(self, row: int, col: int) -> str:
+        if row > len(self._rows) or col > len(self._rows[row - 1]):
+            return ''
+        return self._rows[row - 1][col - 1]
+    
+    def _last_row(self) -> int:
+        for index in range(len(self._rows), 0, -1):
+            if any(self._rows[index - 1]):
+                return index
+        return 0
+    
+    def _write_range(self, range_name: str, values: List[List[Any]]) -> None:
+        grid = a1_range_to_grid_range(range_name.split('!')[-1])
+        start_row = grid.get('startRowIndex', 0) + 1
+        start_col = grid.get('startColumnIndex', 0) + 1
+        for row_offset, row_values in enumerate(values):
+            for col_offset, value in enumerate(row_values):
+                self._set(start_row + row_offset, start_col + col_offset, value)
+    
+    def _append(self, rows: List[List[Any]]) -> Dict[str, Any]:
+        first_row = self._last_row() + 1
+        for offset, values in enumerate(rows):
+            for col, value in enumerate(values, start=1):
+                self._set(first_row + offset, col, value)
+        last_row = first_row + len(rows) - 1
+        width = max((len(values) for values in rows), default=1)
+        return {
+            'updates': {
+                'updatedRange': f"'{self.title}'!A{first_row}:{rowcol_to_a1(last_row, width)}",
+                'updatedRows': len(rows)
+            }
+        }
+    
+    def _matches(self, value: str, query: Any, case_sensitive: bool) -> bool:
+        if isinstance(query, re.Pattern):
+            return bool(query.search(value))
+        if case_sensitive:
+            return value == str(query)
+        return value.lower() == str(query).lower()
+    
+    def _search(self, query: Any, in_row: Optional[int], in_column: Optional[int],
+                case_sensitive: bool) -> List[Cell]:
+        found = []
+        for row_index, cells in enumerate(self._rows, start=1):
+            if in_row and row_index != in_row:
+                continue
+            for col_index, value in enumerate(cells, start=1):
+                if in_column and col_index != in_column:
+                    continue
+                if self._matches(value, query, case_sensitive):
+                    found.append(Cell(row_index, col_index, value))
+        return found
+    
+    # ---- чтение ----
+    
+    def find(self, query: Any, in_row: Optional[int] = None, in_column: Optional[int] = None,
+             case_sensitive: bool = True) -> Optional[Cell]:
+        self.spreadsheet._request('read', 'find')
+        with self.spreadsheet._lock:
+            found = self._search(query, in_row, in_column, case_sensitive)
+        return found[0] if found else None
+    
+    def findall(self, query: Any, in_row: Optional[int] = None, in_column: Optional[int] = None,
+                case_sensitive: bool = True) -> List[Cell]:
+        self.spreadsheet._request('read', 'findall')
+        with self.spreadsheet._lock:
+            return self._search(query, in_row, in_column, case_sensitive)
+    
+    def cell(self, row: int, col: int) -> Cell:
+        self.spreadsheet._request('read', 'cell')
+        with self.spreadsheet._lock:
+            return Cell(row, col, self._get(row, col) or None)
+    
+    def row_values(self, row: int) -> List[str]:
+        self.spreadsheet._request('read', 'row_values')
+        with self.spreadsheet._lock:
+            if row > len(self._rows):
+                return []
+            values = list(self._rows[row - 1])
+        while values and not values[-1]:
+            values.pop()
+        return values
+    
+    def col_values(self, col: int) -> List[str]:
+        self.spreadsheet._request('read', 'col_values')
+        with self.spreadsheet._lock:
+            values = [self._get(row, col) for row in range(1, len(self._rows) + 1)]
+        while values and not values[-1]:
+            values.pop()
+        return values
+    
+    def get_all_values(self) -> List[List[str]]:
+        self.spreadsheet._request('read', 'get_all_values')
+        with self.spreadsheet._lock:
+            rows = [list(cells) for cells in self._rows[:self._last_row()]]
+        width = max((len(cells) for cells in rows), default=0)
+        return [cells + [''] * (width - len(cells)) for cells in rows]
+    
+    def get_all_records(self) -> List[Dict[str, str]]:
+        values = self.get_all_values()
+        if not values:
+            return []
+        headers = values[0]
+        return [dict(zip(headers, row)) for row in values[1:]]
+    
+    # ---- запись ----
+    
+    def update(self, values: Any = None, range_name: Any = None, **kwargs: Any) -> Dict[str, Any]:
+        # Как и gspread 6, принимаем и старый порядок аргументов update(range, values)
+        if isinstance(values, str):
+            values, range_name = range_name, values
+        self.spreadsheet._request('write', 'update')
+        with self.spreadsheet._lock:
+            self._write_range(range_name or 'A1', values)
+        return {'updatedRange': f"'{self.title}'!{range_name}"}
+    
+    def update_cell(self, row: int, col: int, value: Any) -> Dict[str, Any]:
+        self.spreadsheet._request('write', 'update_cell')
+        with self.spreadsheet._lock:
+            self._set(row, col, value)
+        return {'updatedRange': f"'{self.title}'!{rowcol_to_a1(row, col)}"}
+    
+    def batch_update(self, data: List[Dict[str, Any]], **kwargs: Any) -> Dict[str, Any]:
+        self.spreadsheet._request('write', 'batch_update')
+        with self.spreadsheet._lock:
+            for item in data:
+                self._write_range(item['range'], item['values'])
+        return {'totalUpdatedCells': sum(len(row) for item in data for row in item['values'])}
+    
+    def append_row(self, values: List[Any], **kwargs: Any) -> Dict[str, Any]:
+        self.spreadsheet._request('write', 'append_row')
+        with self.spreadsheet._lock:
+            return self._append([values])
+    
+    def append_rows(self, values: List[List[Any]], **kwargs: Any) -> Dict[str, Any]:
+        self.spreadsheet._request('write', 'append_rows')
+        with self.spreadsheet._lock:
+            return self._append(values)
+    
+    def add_rows(self, rows: int) -> None:
+        self.spreadsheet._request('write', 'add_rows')
+        with self.spreadsheet._lock:
+            self.row_count += rows
+    
+    def hide(self) -> None:
+        self.spreadsheet._request('write', 'hide')
+        self.hidden = True
+    
+    def clear(self) -> None:
+        self.spreadsheet._request('write', 'clear')
+        with self.spreadsheet._lock:
+            self._rows = []
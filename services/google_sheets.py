@@ -3,18 +3,101 @@ import json
 import gspread
 import asyncio
 import os
+import threading
+import time
 from google.oauth2.service_account import Credentials
-from typing import Dict, Any, List, Optional
+from gspread.utils import rowcol_to_a1
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
 from config import GOOGLE_SHEETS_ID, logger
 from database import get_db_connection
+from services.sheets_executor import sheets_executor
+from services.sheets_gateway import sheets_gateway, appended_row_number
+from services.sheets_layout import (
+    plan_layout, LAYOUT_VERSION, PLANS_WORKSHEET_V1,
+    plan_headers, month_row, day_column, plan_row_range, empty_plan_row
+)
 
 logger = logging.getLogger(__name__)
 
+# Диапазонов в одном batch_update при пакетной выгрузке планов (ограничение размера запроса)
+SHEETS_BATCH_RANGES = 1000
+
 # Глобальная переменная для хранения подключения к Google Sheets
 google_sheet = None
 
+def ensure_worksheets(sheet) -> None:
+    """Создает недостающие листы таблицы с заголовками"""
+    try:
+        sheet.worksheet("клиенты_детали")
+    except gspread.exceptions.WorksheetNotFound:
+        worksheet = sheet.add_worksheet(title="клиенты_детали", rows=1000, cols=27)
+        worksheet.append_row([
+            "id_клиента", "telegram_username", "имя", "старт_работы",
+            "пробуждение", "отход_ко_сну", "предпочтения_активности",
+            "особенности_питания", "предпочтения_отдыха",
+            "постоянные_утренние_ритуалы", "постоянные_вечерние_ритуалы",
+            "индивидуальные_привычки", "лекарства_витамины",
+            "цели_развиния", "главная_цель", "особые_примечания",
+            "дата_последней_активности", "статус",
+            "текущий_уровень", "очки_опыта", "текущая_серия_активности",
+            "максимальная_серия_активности", "любимый_ритуал", 
+            "дата_последнего_прогресса", "ближайшая_цель"
+        ])
+    
+    try:
+        sheet.worksheet(PLANS_WORKSHEET_V1)
+    except gspread.exceptions.WorksheetNotFound:
+        worksheet = sheet.add_worksheet(title=PLANS_WORKSHEET_V1, rows=1000, cols=37)
+        worksheet.append_row(plan_headers())
+    
+    try:
+        sheet.worksheet("ежедневные_отчеты")
+    except gspread.exceptions.WorksheetNotFound:
+        worksheet = sheet.add_worksheet(title="ежедневные_отчеты", rows=1000, cols=28)
+        worksheet.append_row([
+            "id_клиента", "telegram_username", "имя", "дата",
+            "выполнено_стратегических_задач", "утренние_ритуалы_выполнены",
+            "вечерние_ритуалы_выполнены", "настроение", "энергия",
+            "уровень_фокуса", "уровень_мотивации", "проблемы_препятствия",
+            "вопросы_ассистенту", "что_получилось_хорошо", 
+            "ключевые_достижения_дня", "что_можно_улучшить",
+            "корректировки_на_завтра", "водный_баланс_факт", "статус_дня",
+            "уровень_дня", "серия_активности", "любимый_ритуал_выполнен",
+            "прогресс_по_цели", "рекомендации_на_день", "динамика_настроения",
+            "динамика_энергии", "динамика_продуктивности"
+        ])
+    
+    try:
+        sheet.worksheet("статистика_месяца")
+    except gspread.exceptions.WorksheetNotFound:
+        worksheet = sheet.add_worksheet(title="статистика_месяца", rows=1000, cols=29)
+        worksheet.append_row([
+            "id_клиента", "telegram_username", "имя", "месяц",
+            "среднее_настроение", "средний_уровень_мотивации",
+            "процент_выполнения_планов", "прогресс_по_целям",
+            "количество_активных_дней", "динамика_настроения",
+            "процент_выполнения_утренних_ритуалов",
+            "процент_выполнения_вечерних_ритуалов",
+            "общее_количество_достижений", "основные_корректировки_месяца",
+            "рекомендации_на_следующий_месяц", "итоги_месяца",
+            "текущий_уровень", "серия_активности", "любимые_ритуалы",
+            "динамика_регулярности", "персональные_рекомендации", 
+            "уровень_в_начале_месяца", "уровень_в_конце_месяца",
+            "общее_количество_очков", "средняя_продуктивность"
+        ])
+    
+    try:
+        sheet.worksheet("админ_панель")
+    except gspread.exceptions.WorksheetNotFound:
+        worksheet = sheet.add_worksheet(title="админ_панель", rows=1000, cols=10)
+        worksheet.append_row([
+            "id_клиента", "telegram_username", "имя", "текущий_статус",
+            "требует_внимания", "последняя_корректировка",
+            "следующий_чекап", "приоритет", "заметки_ассистента"
+        ])
+
 def init_google_sheets():
     """Инициализация Google Sheets с исправленной загрузкой credentials"""
     global google_sheet
@@ -81,78 +164,7 @@ def init_google_sheets():
         sheet = client.open_by_key(GOOGLE_SHEETS_ID)
         
         # Создаем листы если их нет
-        try:
-            sheet.worksheet("клиенты_детали")
-        except gspread.exceptions.WorksheetNotFound:
-            worksheet = sheet.add_worksheet(title="клиенты_детали", rows=1000, cols=27)
-            worksheet.append_row([
-                "id_клиента", "telegram_username", "имя", "старт_работы",
-                "пробуждение", "отход_ко_сну", "предпочтения_активности",
-                "особенности_питания", "предпочтения_отдыха",
-                "постоянные_утренние_ритуалы", "постоянные_вечерние_ритуалы",
-                "индивидуальные_привычки", "лекарства_витамины",
-                "цели_развиния", "главная_цель", "особые_примечания",
-                "дата_последней_активности", "статус",
-                "текущий_уровень", "очки_опыта", "текущая_серия_активности",
-                "максимальная_серия_активности", "любимый_ритуал", 
-                "дата_последнего_прогресса", "ближайшая_цель"
-            ])
-        
-        try:
-            sheet.worksheet("индивидуальные_планы_месяц")
-        except gspread.exceptions.WorksheetNotFound:
-            worksheet = sheet.add_worksheet(title="индивидуальные_планы_месяц", rows=1000, cols=37)
-            headers = ["id_клиента", "telegram_username", "имя", "месяц"]
-            for day in range(1, 32):
-                headers.append(f"день_{day}")
-            headers.extend(["общие_комментарии_месяца", "последнее_обновление"])
-            worksheet.append_row(headers)
-        
-        try:
-            sheet.worksheet("ежедневные_отчеты")
-        except gspread.exceptions.WorksheetNotFound:
-            worksheet = sheet.add_worksheet(title="ежедневные_отчеты", rows=1000, cols=28)
-            worksheet.append_row([
-                "id_клиента", "telegram_username", "имя", "дата",
-                "выполнено_стратегических_задач", "утренние_ритуалы_выполнены",
-                "вечерние_ритуалы_выполнены", "настроение", "энергия",
-                "уровень_фокуса", "уровень_мотивации", "проблемы_препятствия",
-                "вопросы_ассистенту", "что_получилось_хорошо", 
-                "ключевые_достижения_дня", "что_можно_улучшить",
-                "корректировки_на_завтра", "водный_баланс_факт", "статус_дня",
-                "уровень_дня", "серия_активности", "любимый_ритуал_выполнен",
-                "прогресс_по_цели", "рекомендации_на_день", "динамика_настроения",
-                "динамика_энергии", "динамика_продуктивности"
-            ])
-        
-        try:
-            sheet.worksheet("статистика_месяца")
-        except gspread.exceptions.WorksheetNotFound:
-            worksheet = sheet.add_worksheet(title="статистика_месяца", rows=1000, cols=29)
-            worksheet.append_row([
-                "id_клиента", "telegram_username", "имя", "месяц",
-                "среднее_настроение", "средний_уровень_мотивации",
-                "процент_выполнения_планов", "прогресс_по_целям",
-                "количество_активных_дней", "динамика_настроения",
-                "процент_выполнения_утренних_ритуалов",
-                "процент_выполнения_вечерних_ритуалов",
-                "общее_количество_достижений", "основные_корректировки_месяца",
-                "рекомендации_на_следующий_месяц", "итоги_месяца",
-                "текущий_уровень", "серия_активности", "любимые_ритуалы",
-                "динамика_регулярности", "персональные_рекомендации", 
-                "уровень_в_начале_месяца", "уровень_в_конце_месяца",
-                "общее_количество_очков", "средняя_продуктивность"
-            ])
-        
-        try:
-            sheet.worksheet("админ_панель")
-        except gspread.exceptions.WorksheetNotFound:
-            worksheet = sheet.add_worksheet(title="админ_панель", rows=1000, cols=10)
-            worksheet.append_row([
-                "id_клиента", "telegram_username", "имя", "текущий_статус",
-                "требует_внимания", "последняя_корректировка",
-                "следующий_чекап", "приоритет", "заметки_ассистента"
-            ])
+        ensure_worksheets(sheet)
         
         logger.info("✅ Google Sheets инициализирован с новой структурой")
         google_sheet = sheet
@@ -162,100 +174,194 @@ def init_google_sheets():
         logger.error(f"❌ Ошибка инициализации Google Sheets: {e}", exc_info=True)
         return None
 
-# Инициализируем Google Sheets при импорте модуля
-google_sheet = init_google_sheets()
+# Подключение создается лениво: импорт модуля не обращается к сети.
+# После неудачи повторная попытка не чаще, чем раз в SHEETS_INIT_RETRY_INTERVAL секунд.
+SHEETS_INIT_RETRY_INTERVAL = 60
+
+_init_lock = asyncio.Lock()
+_init_failed_at: Optional[float] = None
+_init_task: Optional[asyncio.Task] = None
+
+# Последние записанные строки листа клиентов: user_id -> (строка, значения, время записи)
+CLIENT_ROW_CACHE_TTL = 3600
+_client_rows: Dict[int, Tuple[int, List[str], float]] = {}
+_client_rows_lock = threading.Lock()
+
+async def get_google_sheet():
+    """Возвращает подключение к Google Sheets, при первом обращении инициализируя его в отдельном потоке"""
+    global _init_failed_at
+    if google_sheet is not None:
+        return google_sheet
+    
+    async with _init_lock:
+        # Пока ждали лок, подключение могла создать другая корутина
+        if google_sheet is not None:
+            return google_sheet
+        
+        if _init_failed_at is not None and time.monotonic() - _init_failed_at < SHEETS_INIT_RETRY_INTERVAL:
+            return None
+        
+        sheet = await sheets_executor.run(init_google_sheets)
+        _init_failed_at = None if sheet else time.monotonic()
+        return sheet
+
+def start_google_sheets_init() -> asyncio.Task:
+    """Запускает инициализацию Google Sheets в фоне, не блокируя старт бота"""
+    global _init_task
+    if _init_task is None or _init_task.done():
+        _init_task = asyncio.create_task(_connect_and_refresh())
+    return _init_task
+
+async def _connect_and_refresh():
+    """Подключается к таблице и обновляет индекс планов, восстановленный из локального снимка"""
+    sheet = await get_google_sheet()
+    if sheet:
+        try:
+            await sheets_executor.run(plan_layout.refresh, sheet)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось обновить индекс планов из Google Sheets: {e}")
+    return sheet
+
+def use_spreadsheet(sheet) -> None:
+    """
+    Подключает уже открытую таблицу вместо авторизации по credentials
+    (например, services.fake_sheets.FakeSpreadsheet для тестов и бенчмарков).
+    """
+    global google_sheet, _init_failed_at
+    ensure_worksheets(sheet)
+    sheets_gateway.clear_worksheet_cache()
+    plan_layout.invalidate()
+    with _client_rows_lock:
+        _client_rows.clear()
+    _init_failed_at = None
+    google_sheet = sheet
 
 async def save_client_to_sheets(user_data: Dict[str, Any]):
     """АСИНХРОННО сохраняет клиента в Google Sheets"""
-    global google_sheet
-    if google_sheet is None:
-        google_sheet = init_google_sheets()
-    
-    if not google_sheet:
+    if not await get_google_sheet():
         logger.warning("⚠️ Google Sheets не доступен")
         return False
     
     try:
-        # Запускаем синхронную операцию в отдельном потоке
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, _sync_save_client_to_sheets, user_data)
+        # Запускаем синхронную операцию в пуле потоков Google Sheets
+        result = await sheets_executor.run(_sync_save_client_to_sheets, user_data)
         
-        logger.info(f"✅ Клиент {user_data['user_id']} сохранен в Google Sheets")
-        return True
+        if result:
+            logger.info(f"✅ Клиент {user_data['user_id']} сохранен в Google Sheets")
+        return result
         
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения клиента в Google Sheets: {e}")
         return False
 
+def _cell_value(value: Any) -> str:
+    """Значение ячейки в виде, в котором его вернет таблица"""
+    return '' if value is None else str(value)
+
+def _get_cached_client_row(user_id: int) -> Optional[Tuple[int, List[str]]]:
+    """Номер строки клиента и последние записанные значения (None, если кэш устарел)"""
+    with _client_rows_lock:
+        cached = _client_rows.get(user_id)
+    if not cached:
+        return None
+    
+    row, values, cached_at = cached
+    # Строки могли сдвинуть вручную - периодически заново ищем клиента по ID
+    if time.time() - cached_at > CLIENT_ROW_CACHE_TTL:
+        return None
+    return row, values
+
+def _cache_client_row(user_id: int, row: int, values: List[str]) -> None:
+    """Запоминает строку клиента в том виде, в котором она записана в таблицу"""
+    with _client_rows_lock:
+        _client_rows[user_id] = (row, values, time.time())
+
+def export_client_rows() -> List[List[Any]]:
+    """Кэш строк клиентов для локального снимка"""
+    with _client_rows_lock:
+        return [[user_id, row, values, cached_at] for user_id, (row, values, cached_at) in _client_rows.items()]
+
+def restore_client_rows(entries: List[List[Any]]) -> int:
+    """Восстанавливает кэш строк клиентов из локального снимка (устаревшие записи пропускаются)"""
+    now = time.time()
+    restored = 0
+    with _client_rows_lock:
+        for user_id, row, values, cached_at in entries:
+            if now - cached_at <= CLIENT_ROW_CACHE_TTL:
+                _client_rows[int(user_id)] = (int(row), list(values), float(cached_at))
+                restored += 1
+    return restored
+
 def _sync_save_client_to_sheets(user_data: Dict[str, Any]):
     """Синхронная версия сохранения клиента в Google Sheets"""
     try:
-        worksheet = google_sheet.worksheet("клиенты_детали")
+        worksheet = sheets_gateway.worksheet(google_sheet, "клиенты_детали")
+        
+        client_row = [
+            user_data['user_id'],
+            user_data.get('telegram_username', ''),
+            user_data.get('first_name', ''),
+            user_data.get('start_date', ''),
+            user_data.get('wake_time', ''),
+            user_data.get('sleep_time', ''),
+            user_data.get('activity_preferences', ''),
+            user_data.get('diet_features', ''),
+            user_data.get('rest_preferences', ''),
+            user_data.get('morning_rituals', ''),
+            user_data.get('evening_rituals', ''),
+            user_data.get('personal_habits', ''),
+            user_data.get('medications', ''),
+            user_data.get('development_goals', ''),
+            user_data.get('main_goal', ''),
+            user_data.get('special_notes', ''),
+            user_data.get('last_activity', ''),
+            'active',
+            user_data.get('текущий_уровень', 'Новичок'),
+            user_data.get('очки_опыта', '0'),
+            user_data.get('текущая_серия_активности', '0'),
+            user_data.get('максимальная_серия_активности', '0'),
+            user_data.get('любимый_ритуал', ''),
+            user_data.get('дата_последнего_прогресса', ''),
+            user_data.get('ближайшая_цель', '')
+        ]
         
-        # Ищем существующего клиента
-        try:
-            cell = worksheet.find(str(user_data['user_id']))
-            row = cell.row
-            worksheet.update(f'A{row}:Y{row}', [[
-                user_data['user_id'],
-                user_data.get('telegram_username', ''),
-                user_data.get('first_name', ''),
-                user_data.get('start_date', ''),
-                user_data.get('wake_time', ''),
-                user_data.get('sleep_time', ''),
-                user_data.get('activity_preferences', ''),
-                user_data.get('diet_features', ''),
-                user_data.get('rest_preferences', ''),
-                user_data.get('morning_rituals', ''),
-                user_data.get('evening_rituals', ''),
-                user_data.get('personal_habits', ''),
-                user_data.get('medications', ''),
-                user_data.get('development_goals', ''),
-                user_data.get('main_goal', ''),
-                user_data.get('special_notes', ''),
-                user_data.get('last_activity', ''),
-                'active',
-                user_data.get('текущий_уровень', 'Новичок'),
-                user_data.get('очки_опыта', '0'),
-                user_data.get('текущая_серия_активности', '0'),
-                user_data.get('максимальная_серия_активности', '0'),
-                user_data.get('любимый_ритуал', ''),
-                user_data.get('дата_последнего_прогресса', ''),
-                user_data.get('ближайшая_цель', '')
-            ]])
-        except Exception:
-            # Создаем новую запись
-            worksheet.append_row([
-                user_data['user_id'],
-                user_data.get('telegram_username', ''),
-                user_data.get('first_name', ''),
-                user_data.get('start_date', ''),
-                user_data.get('wake_time', ''),
-                user_data.get('sleep_time', ''),
-                user_data.get('activity_preferences', ''),
-                user_data.get('diet_features', ''),
-                user_data.get('rest_preferences', ''),
-                user_data.get('morning_rituals', ''),
-                user_data.get('evening_rituals', ''),
-                user_data.get('personal_habits', ''),
-                user_data.get('medications', ''),
-                user_data.get('development_goals', ''),
-                user_data.get('main_goal', ''),
-                user_data.get('special_notes', ''),
-                user_data.get('last_activity', ''),
-                'active',
-                user_data.get('текущий_уровень', 'Новичок'),
-                user_data.get('очки_опыта', '0'),
-                user_data.get('текущая_серия_активности', '0'),
-                user_data.get('максимальная_серия_активности', '0'),
-                user_data.get('любимый_ритуал', ''),
-                user_data.get('дата_последнего_прогресса', ''),
-                user_data.get('ближайшая_цель', '')
-            ])
+        user_id = user_data['user_id']
+        row_values = [_cell_value(value) for value in client_row]
+        cached = _get_cached_client_row(user_id)
+        
+        if cached:
+            # Строка уже записывалась: отправляем только изменившиеся ячейки
+            row, written_values = cached
+            changed_cells = [
+                {'range': rowcol_to_a1(row, column), 'values': [[value]]}
+                for column, (value, written) in enumerate(zip(row_values, written_values), start=1)
+                if value != written
+            ]
+            if not changed_cells:
+                logger.debug(f"⏩ Строка клиента {user_id} в Google Sheets не изменилась")
+                return True
+            
+            sheets_gateway.write(worksheet.batch_update, changed_cells)
+            logger.debug(f"📝 Клиент {user_id}: обновлено ячеек {len(changed_cells)} из {len(row_values)}")
+        else:
+            # Ищем существующего клиента в колонке ID
+            cell = sheets_gateway.read(worksheet.find, str(user_id), in_column=1)
+            if cell:
+                row = cell.row
+                sheets_gateway.write(worksheet.update, f'A{row}:Y{row}', [client_row])
+            else:
+                # Создаем новую запись
+                response = sheets_gateway.write(worksheet.append_row, client_row)
+                row = appended_row_number(response)
         
+        if row:
+            _cache_client_row(user_id, row, row_values)
         return True
         
     except Exception as e:
+        # Состояние строки в таблице неизвестно - следующая запись будет полной
+        with _client_rows_lock:
+            _client_rows.pop(user_data.get('user_id'), None)
         logger.error(f"❌ Ошибка сохранения клиента в Google Sheets: {e}")
         return False
 
@@ -288,147 +394,54 @@ def format_enhanced_plan(plan_data: Dict[str, Any]) -> str:
     
     return plan_text.strip()
 
-async def save_daily_report_to_sheets(user_id: int, report_data: Dict[str, Any]):
-    """АСИНХРОННО сохраняет ежедневный отчет в Google Sheets"""
-    global google_sheet
-    if google_sheet is None:
-        google_sheet = init_google_sheets()
-    
-    if not google_sheet:
-        logger.warning("⚠️ Google Sheets не доступен")
-        return False
-    
-    try:
-        # Асинхронно получаем информацию о пользователе
-        async with get_db_connection() as conn:
-            user_info = await conn.fetchrow("SELECT username, first_name FROM clients WHERE user_id = $1", user_id)
-            
-            if not user_info:
-                logger.error(f"❌ Пользователь {user_id} не найден в БД")
-                return False
-            
-            username = user_info['username'] if user_info['username'] else ""
-            first_name = user_info['first_name'] if user_info['first_name'] else ""
-        
-        # Запускаем синхронную операцию в отдельном потоке
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, _sync_save_daily_report_to_sheets, user_id, username, first_name, report_data)
-        
-        logger.info(f"✅ Отчет сохранен в Google Sheets для пользователя {user_id}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"❌ Ошибка сохранения отчета: {e}")
-        return False
-
-def _sync_save_daily_report_to_sheets(user_id: int, username: str, first_name: str, report_data: Dict[str, Any]):
-    """Синхронная версия сохранения отчета в Google Sheets"""
-    try:
-        worksheet = google_sheet.worksheet("ежедневные_отчеты")
-        
-        worksheet.append_row([
-            user_id,
-            username,
-            first_name,
-            report_data.get('date', ''),
-            report_data.get('strategic_tasks_done', ''),
-            report_data.get('morning_rituals_done', ''),
-            report_data.get('evening_rituals_done', ''),
-            report_data.get('mood', ''),
-            report_data.get('energy', ''),
-            report_data.get('focus_level', ''),
-            report_data.get('motivation_level', ''),
-            report_data.get('problems', ''),
-            report_data.get('questions', ''),
-            report_data.get('what_went_well', ''),
-            report_data.get('key_achievements', ''),
-            report_data.get('what_to_improve', ''),
-            report_data.get('adjustments', ''),
-            report_data.get('water_intake', ''),
-            report_data.get('day_status', ''),
-            report_data.get('уровень_дня', ''),
-            report_data.get('серия_активности', ''),
-            report_data.get('любимый_ритуал_выполнен', ''),
-            report_data.get('прогресс_по_цели', ''),
-            report_data.get('рекомендации_на_день', ''),
-            report_data.get('динамика_настроения', ''),
-            report_data.get('динамика_энергии', ''),
-            report_data.get('динамика_продуктивности', '')
-        ])
-        
-        return True
-        
-    except Exception as e:
-        logger.error(f"❌ Ошибка сохранения отчета: {e}")
-        return False
+def _find_plan_row(worksheet, user_id: int, plan_month: str) -> Optional[int]:
+    """Номер строки пользователя за месяц на листе планов v1 (None, если строки нет)"""
+    user_cells = sheets_gateway.read(worksheet.findall, str(user_id), in_column=1)
+    for cell in user_cells:
+        month_in_row = sheets_gateway.read(worksheet.cell, cell.row, 4).value
+        if month_in_row == plan_month:
+            return cell.row
+    return None
 
-async def get_daily_plan_from_sheets(user_id: int, date: str) -> Dict[str, Any]:
-    """АСИНХРОННО получает план на день из Google Sheets"""
-    global google_sheet
-    if google_sheet is None:
-        google_sheet = init_google_sheets()
-    
-    if not google_sheet:
+async def get_all_plans_from_sheets() -> Optional[List[Tuple[int, str, str]]]:
+    """АСИНХРОННО читает все планы из Google Sheets одним запросом: (user_id, дата, текст)"""
+    if not await get_google_sheet():
         logger.warning("⚠️ Google Sheets не доступен")
-        return {}
+        return None
     
     try:
-        # Запускаем синхронную операцию в отдельном потоке
-        loop = asyncio.get_event_loop()
-        plan_data = await loop.run_in_executor(None, _sync_get_daily_plan_from_sheets, user_id, date)
-        
-        return plan_data
-        
+        return await sheets_gateway.run_coalesced(('all_plans',), _sync_get_all_plans_from_sheets)
     except Exception as e:
-        logger.error(f"❌ Ошибка получения плана: {e}")
-        return {}
+        logger.error(f"❌ Ошибка чтения планов из Google Sheets: {e}")
+        return None
 
-def _sync_get_daily_plan_from_sheets(user_id: int, date: str) -> Dict[str, Any]:
-    """Синхронная версия получения плана из Google Sheets"""
-    try:
-        worksheet = google_sheet.worksheet("индивидуальные_планы_месяц")
-        
-        # Определяем месяц плана
-        plan_month = datetime.strptime(date, "%Y-%m-%d").strftime("%B %Y")
-        day = datetime.strptime(date, "%Y-%m-%d").day
-        
-        # Ищем строку пользователя с нужным месяцем
+def _sync_get_all_plans_from_sheets() -> List[Tuple[int, str, str]]:
+    """Синхронная версия чтения всех планов из Google Sheets"""
+    worksheet = plan_layout.plans_worksheet(google_sheet)
+    rows = sheets_gateway.read(worksheet.get_all_values)
+    
+    plans = []
+    for row in rows[1:]:
+        # Пустые строки (незаполненные месяцы блоков v2) пропускаются
+        if len(row) < 5:
+            continue
         try:
-            user_cells = worksheet.findall(str(user_id))
-            row = None
-            for cell in user_cells:
-                month_in_row = worksheet.cell(cell.row, 4).value
-                if month_in_row == plan_month:
-                    row = cell.row
-                    break
-            
-            if not row:
-                logger.warning(f"⚠️ Пользователь {user_id} не найден в Google Sheets для месяца {plan_month}")
-                return {}
-        except Exception:
-            logger.warning(f"⚠️ Пользователь {user_id} не найден в Google Sheets")
-            return {}
-        
-        # Получаем все данные строки
-        row_data = worksheet.row_values(row)
-        
-        # Определяем колонку для нужного дня
-        date_column_index = 4 + day  # 4 базовые колонки + день
-        
-        if date_column_index > len(row_data):
-            logger.warning(f"⚠️ Для дня {day} нет данных в Google Sheets")
-            return {}
-        
-        plan_text = row_data[date_column_index - 1]  # Индексация в списке с 0
-        
-        # Парсим структурированный текст плана
-        plan_data = parse_structured_plan(plan_text)
-        
-        return plan_data
+            user_id = int(row[0])
+            month_start = datetime.strptime(row[3], "%B %Y")
+        except (ValueError, TypeError):
+            continue
         
-    except Exception as e:
-        logger.error(f"❌ Ошибка получения плана: {e}")
-        return {}
+        # Колонки 5..35 - дни месяца
+        for day, plan_text in enumerate(row[4:35], start=1):
+            if not plan_text.strip():
+                continue
+            try:
+                plan_date = month_start.replace(day=day).strftime("%Y-%m-%d")
+            except ValueError:
+                continue
+            plans.append((user_id, plan_date, plan_text))
+    
+    return plans
 
 def parse_structured_plan(plan_text: str) -> Dict[str, Any]:
     """Парсит структурированный текст плана на компоненты"""
@@ -505,20 +518,13 @@ def parse_structured_plan(plan_text: str) -> Dict[str, Any]:
     
     return sections
 
-async def save_daily_plan_to_sheets(user_id: int, date: str, plan: Dict[str, Any]) -> bool:
-    """АСИНХРОННО сохраняет план в Google Sheets"""
-    global google_sheet
-    if google_sheet is None:
-        google_sheet = init_google_sheets()
-    
-    if not google_sheet:
+async def save_daily_plan_to_sheets(user_id: int, date: str, plan_text: str) -> bool:
+    """АСИНХРОННО сохраняет текст плана (тот же, что в user_plans.plan_text) в Google Sheets"""
+    if not await get_google_sheet():
         logger.warning("⚠️ Google Sheets не доступен")
         return False
     
     try:
-        # Форматируем план в структурированный текст
-        plan_text = format_enhanced_plan(plan)
-        
         # Асинхронно получаем информацию о пользователе если нужно
         async with get_db_connection() as conn:
             user_info = await conn.fetchrow("SELECT username, first_name FROM clients WHERE user_id = $1", user_id)
@@ -526,9 +532,8 @@ async def save_daily_plan_to_sheets(user_id: int, date: str, plan: Dict[str, Any
             username = user_info['username'] if user_info and user_info['username'] else ""
             first_name = user_info['first_name'] if user_info and user_info['first_name'] else ""
         
-        # Запускаем синхронную операцию в отдельном потоке
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, _sync_save_daily_plan_to_sheets, user_id, username, first_name, date, plan_text)
+        # Запускаем синхронную операцию в пуле потоков Google Sheets
+        result = await sheets_executor.run(_sync_save_daily_plan_to_sheets, user_id, username, first_name, date, plan_text)
         
         return result
         
@@ -539,50 +544,47 @@ async def save_daily_plan_to_sheets(user_id: int, date: str, plan: Dict[str, Any
 def _sync_save_daily_plan_to_sheets(user_id: int, username: str, first_name: str, date: str, plan_text: str) -> bool:
     """Синхронная версия сохранения плана в Google Sheets"""
     try:
-        worksheet = google_sheet.worksheet("индивидуальные_планы_месяц")
+        worksheet = plan_layout.plans_worksheet(google_sheet)
         
         # Определяем месяц плана
-        plan_month = datetime.strptime(date, "%Y-%m-%d").strftime("%B %Y")
-        day = datetime.strptime(date, "%Y-%m-%d").day
+        plan_date = datetime.strptime(date, "%Y-%m-%d")
+        plan_month = plan_date.strftime("%B %Y")
         
-        # Ищем строку пользователя с нужным месяцем
-        try:
-            # Находим все ячейки с user_id
-            user_cells = worksheet.findall(str(user_id))
-            row = None
-            for cell in user_cells:
-                # Проверяем месяц в этой строке
-                month_in_row = worksheet.cell(cell.row, 4).value
-                if month_in_row == plan_month:
-                    row = cell.row
-                    break
+        # Определяем колонку для нужного дня
+        date_column_index = day_column(plan_date.day)
+        
+        # Новая строка месяца сразу с планом
+        new_row = empty_plan_row(user_id, username, first_name, plan_month)
+        new_row[-1] = datetime.now().strftime("%Y-%m-%d %H:%M")
+        new_row[date_column_index - 1] = plan_text
+        
+        if plan_layout.version >= LAYOUT_VERSION:
+            # v2: строка месяца в блоке пользователя известна заранее
+            first_row = plan_layout.block_for(user_id) or plan_layout.allocate_block(google_sheet, user_id)
+            row = month_row(first_row, plan_date)
+            month_in_row = sheets_gateway.read(worksheet.cell, row, 4).value
+            if month_in_row == plan_month:
+                sheets_gateway.write(worksheet.update_cell, row, date_column_index, plan_text)
+            else:
+                # Строка пустая или хранит тот же месяц прошлого года - перезаписываем целиком
+                sheets_gateway.write(worksheet.update, plan_row_range(row), [new_row])
             
-            if not row:
-                # Если не нашли строку с нужным месяцем, создаем новую
-                new_row = [user_id, username, first_name, plan_month]
-                for _ in range(31):
-                    new_row.append("")
-                new_row.extend(["", datetime.now().strftime("%Y-%m-%d %H:%M")])
-                worksheet.append_row(new_row)
-                # Находим добавленную строку
-                cell = worksheet.find(str(user_id))
-                row = cell.row
-        except Exception:
-            # Если пользователь не найден, создаем новую строку
-            new_row = [user_id, username, first_name, plan_month]
-            for _ in range(31):
-                new_row.append("")
-            new_row.extend(["", datetime.now().strftime("%Y-%m-%d %H:%M")])
-            worksheet.append_row(new_row)
-            # Находим добавленную строку
-            cell = worksheet.find(str(user_id))
-            row = cell.row
+            logger.info(f"✅ План сохранен в Google Sheets для пользователя {user_id} на {date} (строка {row})")
+            return True
         
-        # Определяем колонку для нужного дня
-        date_column_index = 4 + day  # 4 базовые колонки + день (индексация с 1)
+        # v1: ищем строку пользователя с нужным месяцем
+        row = _find_plan_row(worksheet, user_id, plan_month)
+        
+        if not row:
+            # Если не нашли строку с нужным месяцем, создаем новую сразу с планом
+            response = sheets_gateway.write(worksheet.append_row, new_row)
+            
+            logger.info(f"✅ План сохранен в Google Sheets для пользователя {user_id} на {date} "
+                        f"(новая строка {appended_row_number(response)})")
+            return True
         
         # Обновляем ячейку с планом
-        worksheet.update_cell(row, date_column_index, plan_text)
+        sheets_gateway.write(worksheet.update_cell, row, date_column_index, plan_text)
         
         logger.info(f"✅ План сохранен в Google Sheets для пользователя {user_id} на {date}")
         return True
@@ -590,3 +592,97 @@ def _sync_save_daily_plan_to_sheets(user_id: int, username: str, first_name: str
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения плана: {e}")
         return False
+
+async def save_daily_plans_to_sheets(plans: List[Tuple[int, str, str]]) -> bool:
+    """АСИНХРОННО выгружает пакет планов (user_id, дата, текст) в Google Sheets несколькими запросами"""
+    if not plans:
+        return True
+    
+    if not await get_google_sheet():
+        logger.warning("⚠️ Google Sheets не доступен")
+        return False
+    
+    try:
+        # Имена пользователей нужны только для новых строк месяца - берем их одним запросом
+        async with get_db_connection() as conn:
+            rows = await conn.fetch(
+                "SELECT user_id, username, first_name FROM clients WHERE user_id = ANY($1::bigint[])",
+                list({plan[0] for plan in plans})
+            )
+        users = {row['user_id']: (row['username'] or "", row['first_name'] or "") for row in rows}
+        
+        return await sheets_executor.run(_sync_save_daily_plans_to_sheets, plans, users)
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка пакетного сохранения планов: {e}")
+        return False
+
+def _sync_save_daily_plans_to_sheets(plans: List[Tuple[int, str, str]], users: Dict[int, Tuple[str, str]]) -> bool:
+    """
+    Синхронная версия пакетного сохранения планов: одно чтение листа, блоки v2
+    одним запросом к индексу, все ячейки одним batch_update и новые строки v1 одним append_rows.
+    """
+    worksheet = plan_layout.plans_worksheet(google_sheet)
+    
+    # Планы группируются по строкам месяца: (user_id, месяц) -> {колонка дня: текст}
+    month_cells: Dict[Tuple[int, str], Dict[int, str]] = {}
+    month_dates: Dict[Tuple[int, str], datetime] = {}
+    for user_id, date, plan_text in plans:
+        plan_date = datetime.strptime(date, "%Y-%m-%d")
+        key = (user_id, plan_date.strftime("%B %Y"))
+        month_cells.setdefault(key, {})[day_column(plan_date.day)] = plan_text
+        month_dates[key] = plan_date
+    
+    if plan_layout.version >= LAYOUT_VERSION:
+        # v2: строки известны по блокам, месяц в строке проверяем по колонке D
+        blocks = plan_layout.allocate_blocks(google_sheet, list(dict.fromkeys(user_id for user_id, _ in month_cells)))
+        months_column = sheets_gateway.read(worksheet.col_values, 4)
+        target_rows = {key: month_row(blocks[key[0]], month_dates[key]) for key in month_cells}
+        existing = {
+            key for key, row in target_rows.items()
+            if row <= len(months_column) and months_column[row - 1] == key[1]
+        }
+    else:
+        # v1: строки пользователей по месяцам находим по одному чтению листа
+        row_by_month = {}
+        for row_number, values in enumerate(sheets_gateway.read(worksheet.get_all_values)[1:], start=2):
+            if len(values) > 3:
+                row_by_month.setdefault((values[0], values[3]), row_number)
+        target_rows = {
+            key: row_by_month[(str(key[0]), key[1])]
+            for key in month_cells if (str(key[0]), key[1]) in row_by_month
+        }
+        existing = set(target_rows)
+    
+    updated_at = datetime.now().strftime("%Y-%m-%d %H:%M")
+    updates = []
+    new_rows = []
+    for key, cells in month_cells.items():
+        if key in existing:
+            for column, plan_text in cells.items():
+                updates.append({'range': rowcol_to_a1(target_rows[key], column), 'values': [[plan_text]]})
+            continue
+        
+        user_id, plan_month = key
+        username, first_name = users.get(user_id, ("", ""))
+        new_row = empty_plan_row(user_id, username, first_name, plan_month)
+        new_row[-1] = updated_at
+        for column, plan_text in cells.items():
+            new_row[column - 1] = plan_text
+        
+        if key in target_rows:
+            # v2: строка пустая или хранит тот же месяц прошлого года - перезаписываем целиком
+            updates.append({'range': plan_row_range(target_rows[key]), 'values': [new_row]})
+        else:
+            new_rows.append(new_row)
+    
+    for start in range(0, len(updates), SHEETS_BATCH_RANGES):
+        sheets_gateway.write(worksheet.batch_update, updates[start:start + SHEETS_BATCH_RANGES])
+    if new_rows:
+        sheets_gateway.write(worksheet.append_rows, new_rows)
+    
+    logger.info(
+        f"✅ Пакет планов сохранен в Google Sheets: {len(plans)} планов, "
+        f"строк месяца {len(month_cells)} (новых {len(new_rows)})"
+    )
+    return True
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import logging
+from functools import wraps
+from typing import Any, Awaitable, Callable, Optional, Set
+
+import asyncpg
+
+from config import DATABASE_URL, POSTGRESQL_AVAILABLE, LEADER_ELECTION_ENABLED, logger
+
+logger = logging.getLogger(__name__)
+
+# Пространство имен ключей advisory-локов, чтобы не пересекаться с другими приложениями в той же БД
+LOCK_NAMESPACE = "telegram_bot_job"
+
+# Отдельное соединение (не из пула): сессионные advisory-локи живут, пока живо соединение.
+# Если процесс-лидер падает, PostgreSQL закрывает его сессию и освобождает локи -
+# следующий запуск задачи на другой реплике захватывает лидерство.
+_lock_connection: Optional[asyncpg.Connection] = None
+_held_locks: Set[int] = set()
+_lock_guard = asyncio.Lock()
+
+
+def job_lock_key(job_name: str) -> int:
+    """Возвращает стабильный 64-битный ключ advisory-лока для задачи"""
+    digest = hashlib.sha256(f"{LOCK_NAMESPACE}:{job_name}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+
+async def _reset_lock_connection() -> None:
+    """Закрывает соединение с локами и сбрасывает лидерство"""
+    global _lock_connection
+    if _held_locks:
+        logger.warning(f"⚠️ Лидерство сброшено для {len(_held_locks)} задач")
+    _held_locks.clear()
+
+    if _lock_connection is not None:
+        try:
+            await _lock_connection.close()
+        except Exception as e:
+            logger.debug(f"Ошибка закрытия соединения для локов: {e}")
+        _lock_connection = None
+
+
+async def _get_lock_connection() -> asyncpg.Connection:
+    """Создает или возвращает соединение для advisory-локов"""
+    global _lock_connection
+    if _lock_connection is not None and _lock_connection.is_closed():
+        logger.warning("⚠️ Соединение для локов потеряно")
+        await _reset_lock_connection()
+
+    if _lock_connection is None:
+        _lock_connection = await asyncpg.connect(
+            DATABASE_URL,
+            server_settings={
+                'application_name': 'telegram_bot_leader',
+                'timezone': 'UTC'
+            }
+        )
+    return _lock_connection
+
+
+async def acquire_job_leadership(job_name: str) -> bool:
+    """Проверяет лидерство процесса для задачи, при необходимости пытаясь его захватить"""
+    if not LEADER_ELECTION_ENABLED or not POSTGRESQL_AVAILABLE:
+        return True
+
+    key = job_lock_key(job_name)
+
+    async with _lock_guard:
+        try:
+            conn = await _get_lock_connection()
+
+            if key in _held_locks:
+                # Лок держится, пока жива сессия - проверяем соединение
+                await conn.fetchval('SELECT 1')
+                return True
+
+            acquired = await conn.fetchval('SELECT pg_try_advisory_lock($1)', key)
+            if acquired:
+                _held_locks.add(key)
+                logger.info(f"👑 Процесс стал лидером задачи {job_name}")
+            return bool(acquired)
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка проверки лидерства для задачи {job_name}: {e}")
+            await _reset_lock_connection()
+            return False
+
+
+def leader_only(job_name: str) -> Callable:
+    """Декоратор для задач JobQueue: задача выполняется только на реплике-лидере"""
+    def decorator(callback: Callable[[Any], Awaitable[None]]) -> Callable[[Any], Awaitable[None]]:
+        @wraps(callback)
+        async def wrapper(context: Any) -> None:
+            if not await acquire_job_leadership(job_name):
+                logger.debug(f"⏩ Задача {job_name} выполняется другой репликой")
+                return
+            await callback(context)
+        return wrapper
+    return decorator
+
+
+async def release_job_leadership() -> None:
+    """Освобождает все локи лидерства (вызывается при завершении работы)"""
+    async with _lock_guard:
+        if _lock_connection is not None:
+            _held_locks.clear()
+            await _reset_lock_connection()
+            logger.info("✅ Локи лидерства освобождены")
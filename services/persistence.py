@@ -0,0 +1,256 @@
+import asyncio
+import contextlib
+import json
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from config import logger
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Задержка перед записью: изменения, пришедшие за это время, уходят в БД одним пакетом
+FLUSH_DELAY = 1.0
+# Повтор неудачной записи: задержка растет от FLUSH_RETRY_DELAY до FLUSH_RETRY_MAX_DELAY секунд
+FLUSH_RETRY_DELAY = 5.0
+FLUSH_RETRY_MAX_DELAY = 60.0
+
+INT_KEYS_MARKER = "__intkeys__"
+
+ConversationKey = Tuple[Any, ...]
+ConversationDict = Dict[ConversationKey, object]
+
+
+def _encode(value: Any) -> Any:
+    """Готовит данные к JSON, сохраняя целочисленные ключи словарей (номера вопросов анкеты)"""
+    if isinstance(value, dict):
+        if value and all(isinstance(key, int) for key in value):
+            return {INT_KEYS_MARKER: {str(key): _encode(item) for key, item in value.items()}}
+        return {str(key): _encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _decode(value: Any) -> Any:
+    """Восстанавливает данные, сохраненные через _encode"""
+    if isinstance(value, dict):
+        if len(value) == 1 and INT_KEYS_MARKER in value:
+            return {int(key): _decode(item) for key, item in value[INT_KEYS_MARKER].items()}
+        return {key: _decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+class PostgresPersistence(BasePersistence):
+    """
+    Хранение user_data и состояний ConversationHandler в PostgreSQL (JSONB).
+    
+    Application сам отслеживает, какие пользователи и диалоги изменились,
+    и передает их сюда раз в update_interval секунд. Изменения копятся
+    в памяти и записываются одним пакетом; flush() дописывает остаток
+    при остановке бота.
+    """
+    
+    def __init__(self, update_interval: float = 10):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self._user_data: Optional[Dict[int, Dict[str, Any]]] = None
+        self._conversations: Dict[str, ConversationDict] = {}
+        self._conversations_loaded = False
+        
+        # Изменения, ожидающие записи: значение None означает удаление
+        self._dirty_user_data: Dict[int, Optional[str]] = {}
+        self._dirty_conversations: Dict[Tuple[str, str], Optional[str]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+    
+    async def get_user_data(self) -> Dict[int, Dict[str, Any]]:
+        """Загружает user_data всех пользователей при старте"""
+        if self._user_data is None:
+            self._user_data = {}
+            try:
+                async with get_db_connection() as conn:
+                    rows = await conn.fetch('SELECT user_id, data FROM bot_user_data')
+                for row in rows:
+                    self._user_data[row['user_id']] = _decode(json.loads(row['data']))
+                logger.info(f"✅ Загружены данные {len(self._user_data)} пользователей из PostgreSQL")
+            except Exception as e:
+                logger.error(f"❌ Ошибка загрузки user_data: {e}")
+        return {user_id: dict(data) for user_id, data in self._user_data.items()}
+    
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+    
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+    
+    async def get_callback_data(self) -> None:
+        return None
+    
+    async def _load_conversations(self) -> None:
+        """Загружает состояния всех диалогов одним запросом"""
+        self._conversations_loaded = True
+        try:
+            async with get_db_connection() as conn:
+                rows = await conn.fetch('SELECT name, conv_key, state FROM bot_conversations')
+            for row in rows:
+                key = tuple(json.loads(row['conv_key']))
+                self._conversations.setdefault(row['name'], {})[key] = json.loads(row['state'])
+            logger.info(f"✅ Загружено {len(rows)} состояний диалогов из PostgreSQL")
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки состояний диалогов: {e}")
+    
+    async def get_conversations(self, name: str) -> ConversationDict:
+        if not self._conversations_loaded:
+            await self._load_conversations()
+        return dict(self._conversations.get(name, {}))
+    
+    async def update_conversation(self, name: str, key: ConversationKey, new_state: Optional[object]) -> None:
+        conversations = self._conversations.setdefault(name, {})
+        if conversations.get(key) == new_state:
+            return
+        
+        if new_state is None:
+            conversations.pop(key, None)
+        else:
+            conversations[key] = new_state
+        
+        self._dirty_conversations[(name, json.dumps(list(key)))] = (
+            None if new_state is None else json.dumps(new_state)
+        )
+        self._schedule_flush()
+    
+    async def update_user_data(self, user_id: int, data: Dict[str, Any]) -> None:
+        if self._user_data is None:
+            self._user_data = {}
+        
+        try:
+            # Снимок сериализуется сразу: дальнейшие изменения в обработчиках его не затронут
+            serialized = json.dumps(_encode(data), ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            logger.error(f"❌ user_data пользователя {user_id} не сериализуется в JSON: {e}")
+            return
+        
+        self._user_data[user_id] = dict(data)
+        self._dirty_user_data[user_id] = serialized
+        self._schedule_flush()
+    
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        pass
+    
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        pass
+    
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+    
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+    
+    async def drop_user_data(self, user_id: int) -> None:
+        if self._user_data is not None:
+            self._user_data.pop(user_id, None)
+        self._dirty_user_data[user_id] = None
+        self._schedule_flush()
+    
+    async def refresh_user_data(self, user_id: int, user_data: Dict[str, Any]) -> None:
+        pass
+    
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        pass
+    
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+    
+    def _schedule_flush(self) -> None:
+        """Планирует отложенную запись, если она еще не запланирована"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+    
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(FLUSH_DELAY)
+        
+        # Неудачная запись остается в очереди и повторяется, пока не пройдет
+        retry_delay = FLUSH_RETRY_DELAY
+        while not await self._write_dirty():
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, FLUSH_RETRY_MAX_DELAY)
+    
+    async def _write_dirty(self) -> bool:
+        """Записывает накопленные изменения пакетом. False - запись не удалась, изменения остались в очереди"""
+        async with self._flush_lock:
+            if not self._dirty_user_data and not self._dirty_conversations:
+                return True
+            
+            user_data, self._dirty_user_data = self._dirty_user_data, {}
+            conversations, self._dirty_conversations = self._dirty_conversations, {}
+            
+            upsert_users = [(user_id, data) for user_id, data in user_data.items() if data is not None]
+            delete_users = [user_id for user_id, data in user_data.items() if data is None]
+            upsert_states = [(name, key, state) for (name, key), state in conversations.items() if state is not None]
+            delete_states = [(name, key) for (name, key), state in conversations.items() if state is None]
+            
+            written = False
+            try:
+                async with get_db_connection() as conn:
+                    async with conn.transaction():
+                        if upsert_users:
+                            await conn.executemany(
+                                '''INSERT INTO bot_user_data (user_id, data, updated_at)
+                                   VALUES ($1, $2::jsonb, CURRENT_TIMESTAMP)
+                                   ON CONFLICT (user_id) DO UPDATE SET
+                                   data = EXCLUDED.data, updated_at = EXCLUDED.updated_at''',
+                                upsert_users
+                            )
+                        if delete_users:
+                            await conn.execute(
+                                'DELETE FROM bot_user_data WHERE user_id = ANY($1::bigint[])',
+                                delete_users
+                            )
+                        if upsert_states:
+                            await conn.executemany(
+                                '''INSERT INTO bot_conversations (name, conv_key, state, updated_at)
+                                   VALUES ($1, $2, $3::jsonb, CURRENT_TIMESTAMP)
+                                   ON CONFLICT (name, conv_key) DO UPDATE SET
+                                   state = EXCLUDED.state, updated_at = EXCLUDED.updated_at''',
+                                upsert_states
+                            )
+                        if delete_states:
+                            await conn.executemany(
+                                'DELETE FROM bot_conversations WHERE name = $1 AND conv_key = $2',
+                                delete_states
+                            )
+                
+                written = True
+                logger.debug(
+                    f"💾 Persistence: записано user_data {len(user_data)}, диалогов {len(conversations)}"
+                )
+                
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи persistence в PostgreSQL: {e}")
+            finally:
+                if not written:
+                    # Возвращаем изменения, если за это время не пришли более новые
+                    for user_id, data in user_data.items():
+                        self._dirty_user_data.setdefault(user_id, data)
+                    for key, state in conversations.items():
+                        self._dirty_conversations.setdefault(key, state)
+            return written
+    
+    async def flush(self) -> None:
+        """Дописывает все изменения при остановке приложения"""
+        if self._flush_task and not self._flush_task.done():
+            # Отложенная запись может ждать повтора - дописываем сами, не дожидаясь ее
+            self._flush_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._flush_task
+        if await self._write_dirty():
+            logger.info("✅ Persistence: данные диалогов сохранены")
+        else:
+            logger.error("❌ Persistence: часть данных диалогов не сохранена при остановке")
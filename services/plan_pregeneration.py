@@ -0,0 +1,120 @@
+"""
+Ночная генерация персонализированных планов на следующий день.
+
+Задача запускается каждый час и обрабатывает часовые пояса, где наступил
+локальный час PLAN_PREGENERATION_HOUR: активных пользователей, прошедших анкету
+и еще без плана на завтра. Ответы анкеты читаются порциями одним запросом,
+профили и адаптация шаблонов считаются в пуле процессов, а готовые планы
+сохраняются пакетом через save_daily_plans_bulk без перезаписи существующих -
+план, назначенный администратором, остается как есть. Утренняя рассылка
+только читает их.
+"""
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import pytz
+from telegram.ext import ContextTypes
+
+from config import PLAN_PREGENERATION_HOUR, PLAN_PREGENERATION_WORKERS, logger
+from database import get_active_timezones, get_pregeneration_batch
+from handlers.reminder import get_timezones_at_local_hour
+from services.plan_service import save_daily_plans_bulk
+from services.template import generate_plan_documents, template_key_for_date
+
+logger = logging.getLogger(__name__)
+
+# Пользователей в одной порции из БД (и в одном пакетном сохранении)
+PREGENERATION_BATCH_SIZE = 1000
+# Пользователей в одной задаче пула процессов
+PREGENERATION_CHUNK_SIZE = 100
+
+_last_run: Dict[str, Any] = {}
+
+
+async def pregenerate_plans(timezones: List[str], plan_date: str,
+                            pool: ProcessPoolExecutor) -> Dict[str, int]:
+    """Генерирует планы на plan_date пользователям из часовых поясов timezones"""
+    loop = asyncio.get_running_loop()
+    template_key = template_key_for_date(plan_date)
+    plan_day = datetime.strptime(plan_date, "%Y-%m-%d").date()
+    
+    counters = {'users': 0, 'generated': 0, 'saved': 0}
+    after_user_id = 0
+    
+    while True:
+        batch = await get_pregeneration_batch(timezones, plan_day, after_user_id, PREGENERATION_BATCH_SIZE)
+        if not batch:
+            break
+        after_user_id = batch[-1][0]
+        counters['users'] += len(batch)
+        
+        items = [(user_id, answers, template_key) for user_id, answers in batch]
+        chunks = [
+            items[start:start + PREGENERATION_CHUNK_SIZE]
+            for start in range(0, len(items), PREGENERATION_CHUNK_SIZE)
+        ]
+        results = await asyncio.gather(
+            *(loop.run_in_executor(pool, generate_plan_documents, chunk) for chunk in chunks)
+        )
+        
+        plans = [(user_id, plan_date, plan) for chunk_plans in results for user_id, plan in chunk_plans]
+        counters['generated'] += len(plans)
+        if plans:
+            # Планы, назначенные администратором после выборки порции, не перезаписываются
+            counters['saved'] += await save_daily_plans_bulk(plans, overwrite=False)
+        
+        if len(batch) < PREGENERATION_BATCH_SIZE:
+            break
+    
+    return counters
+
+
+async def pregenerate_next_day_plans(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Ежечасно генерирует планы на завтра тем часовым поясам, где наступил час генерации"""
+    try:
+        now_utc = datetime.now(pytz.utc)
+        timezones = get_timezones_at_local_hour(await get_active_timezones(), PLAN_PREGENERATION_HOUR, now_utc)
+        if not timezones:
+            return
+        
+        # В поясах по разные стороны линии перемены дат "завтра" - разные даты
+        timezones_by_date: Dict[str, List[str]] = {}
+        for timezone in timezones:
+            local_tomorrow = now_utc.astimezone(pytz.timezone(timezone)).date() + timedelta(days=1)
+            timezones_by_date.setdefault(local_tomorrow.strftime("%Y-%m-%d"), []).append(timezone)
+        
+        started = time.monotonic()
+        totals = {'users': 0, 'generated': 0, 'saved': 0}
+        
+        # spawn: дочерние процессы не наследуют потоки и соединения бота
+        pool = ProcessPoolExecutor(
+            max_workers=PLAN_PREGENERATION_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        try:
+            for plan_date, date_timezones in sorted(timezones_by_date.items()):
+                counters = await pregenerate_plans(date_timezones, plan_date, pool)
+                for key, value in counters.items():
+                    totals[key] += value
+                logger.info(
+                    f"🌙 Планы на {plan_date} ({', '.join(date_timezones)}): "
+                    f"пользователей {counters['users']}, сохранено {counters['saved']}"
+                )
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        
+        _last_run.update(totals, finished_at=datetime.now(), seconds=round(time.monotonic() - started, 1))
+    
+    except Exception as e:
+        logger.error(f"❌ Ошибка ночной генерации планов: {e}")
+
+
+def get_pregeneration_stats() -> Optional[Dict[str, Any]]:
+    """Итоги последнего запуска ночной генерации (None, если запусков не было)"""
+    return dict(_last_run) if _last_run else None
+
@@ -0,0 +1,274 @@
+import logging
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from config import logger
+from database import (
+    save_user_plan_to_db, get_plan_data_from_db, mark_plan_synced,
+    get_plans_sync_state, import_plan_texts_bulk,
+    get_unconverted_plans, save_plan_documents_bulk,
+    save_user_plans_bulk, mark_plans_synced_bulk
+)
+from services.google_sheets import (
+    save_daily_plan_to_sheets, save_daily_plans_to_sheets, get_all_plans_from_sheets,
+    format_enhanced_plan, parse_structured_plan
+)
+from services.task_queue import task_queue
+from utils.helpers import percentile
+
+logger = logging.getLogger(__name__)
+
+# Основное хранилище планов - таблица user_plans; Google Sheets - зеркало для администратора.
+# Прочитанные из БД планы держим в памяти PLAN_CACHE_TTL секунд, не больше
+# PLAN_CACHE_MAX_SIZE записей (давно не запрошенные вытесняются первыми)
+PLAN_CACHE_TTL = 300
+PLAN_CACHE_MAX_SIZE = 10000
+
+# Как часто и за какой период импортировать правки, сделанные прямо в таблице
+PLAN_RECONCILE_INTERVAL = 1800
+PLAN_RECONCILE_DAYS_BACK = 7
+PLAN_RECONCILE_DAYS_AHEAD = 31
+
+# Планов в одной фоновой задаче пакетной выгрузки в Google Sheets
+PLAN_MIRROR_BATCH = 500
+
+# Разделы структурированного плана (колонка user_plans.plan_data)
+PLAN_LIST_SECTIONS = (
+    'strategic_tasks', 'critical_tasks', 'priorities', 'advice', 'special_rituals',
+    'time_blocks', 'resources', 'expected_results', 'reminders'
+)
+
+_plan_cache: "OrderedDict[Tuple[int, str], Tuple[Dict[str, Any], float]]" = OrderedDict()
+
+# Последние замеры времени ответа /plan (мс)
+_plan_latencies: Deque[float] = deque(maxlen=1000)
+
+
+def normalize_plan_document(plan_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Приводит план к документу plan_data: списки разделов и мотивационная цитата"""
+    document = {}
+    for section in PLAN_LIST_SECTIONS:
+        items = plan_data.get(section) or []
+        if isinstance(items, str):
+            items = [items]
+        items = [str(item).strip() for item in items if item and str(item).strip()]
+        if items:
+            document[section] = items
+    
+    quote = plan_data.get('motivation_quote')
+    if isinstance(quote, list):
+        quote = ' '.join(quote)
+    if quote and str(quote).strip():
+        document['motivation_quote'] = str(quote).strip()
+    
+    for field in ('name', 'description'):
+        if plan_data.get(field):
+            document[field] = plan_data[field]
+    
+    return document
+
+
+def _document_from_legacy_columns(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Собирает документ плана из старых фиксированных колонок user_plans"""
+    def present(*columns: str) -> List[str]:
+        return [row[column] for column in columns if row.get(column)]
+    
+    reminders = []
+    for column, label in (('lunch_break', 'Обед'), ('sleep_time', 'Сон'),
+                          ('water_goal', 'Вода'), ('activity_goal', 'Активность')):
+        if row.get(column):
+            reminders.append(f"{label}: {row[column]}")
+    
+    return normalize_plan_document({
+        'strategic_tasks': present('task1', 'task2', 'task3'),
+        'critical_tasks': present('task4'),
+        'advice': present('advice'),
+        'special_rituals': present('morning_ritual1', 'morning_ritual2', 'evening_ritual1', 'evening_ritual2'),
+        'reminders': reminders
+    })
+
+
+async def convert_legacy_plans(batch_size: int = 1000) -> int:
+    """
+    Однократная конвертация старых планов в plan_data.
+    
+    Планы с текстом разбираются parse_structured_plan, остальные собираются
+    из фиксированных колонок. Повторный запуск обрабатывает только строки
+    без plan_data, поэтому безопасен.
+    """
+    converted = 0
+    while True:
+        rows = await get_unconverted_plans(batch_size)
+        if not rows:
+            break
+        
+        documents = []
+        for row in rows:
+            if row.get('plan_text'):
+                document = normalize_plan_document(parse_structured_plan(row['plan_text']))
+            else:
+                document = _document_from_legacy_columns(row)
+            documents.append((row['id'], document))
+        
+        if not await save_plan_documents_bulk(documents):
+            break
+        converted += len(documents)
+    
+    if converted:
+        logger.info(f"✅ Сконвертировано планов в JSONB: {converted}")
+    return converted
+
+
+def _cache_plan(key: Tuple[int, str], plan_data: Dict[str, Any]) -> None:
+    """Кладет план в кэш, вытесняя давно не запрошенные записи сверх PLAN_CACHE_MAX_SIZE"""
+    _plan_cache[key] = (plan_data, time.monotonic())
+    _plan_cache.move_to_end(key)
+    while len(_plan_cache) > PLAN_CACHE_MAX_SIZE:
+        _plan_cache.popitem(last=False)
+
+
+async def get_daily_plan(user_id: int, date: str) -> Dict[str, Any]:
+    """Возвращает план пользователя на дату из кэша или PostgreSQL (без разбора текста)"""
+    key = (user_id, date)
+    entry = _plan_cache.get(key)
+    if entry and time.monotonic() - entry[1] <= PLAN_CACHE_TTL:
+        _plan_cache.move_to_end(key)
+        return entry[0]
+    
+    plan_data = await get_plan_data_from_db(user_id, date) or {}
+    _cache_plan(key, plan_data)
+    return plan_data
+
+
+async def mirror_plan_to_sheets(user_id: int, date: str, plan_text: str) -> bool:
+    """Выгружает текст плана в Google Sheets и отмечает его синхронизированным"""
+    if not await save_daily_plan_to_sheets(user_id, date, plan_text):
+        return False
+    await mark_plan_synced(user_id, date, plan_text)
+    return True
+
+
+async def save_daily_plan(user_id: int, date: str, plan_data: Dict[str, Any]) -> bool:
+    """Сохраняет план в PostgreSQL и ставит выгрузку в Google Sheets в фоновую очередь"""
+    document = normalize_plan_document(plan_data)
+    plan_text = format_enhanced_plan(document)
+    
+    if not await save_user_plan_to_db(user_id, {'plan_date': date, 'plan_text': plan_text, 'plan_data': document}):
+        return False
+    
+    _cache_plan((user_id, date), document)
+    
+    task_queue.submit(
+        'sheets_upsert', mirror_plan_to_sheets, user_id, date, plan_text,
+        description=f"план {user_id} на {date}"
+    )
+    return True
+
+
+async def mirror_plans_to_sheets(plans: List[Tuple[int, str, str]]) -> bool:
+    """Выгружает пакет планов (user_id, дата, текст) в Google Sheets и отмечает их синхронизированными"""
+    if not await save_daily_plans_to_sheets(plans):
+        return False
+    await mark_plans_synced_bulk(plans)
+    return True
+
+
+async def save_daily_plans_bulk(plans: List[Tuple[int, str, Dict[str, Any]]], overwrite: bool = True) -> int:
+    """
+    Сохраняет пакет планов (user_id, дата, план) одним запросом в PostgreSQL
+    и ставит их выгрузку в Google Sheets в фоновую очередь пакетами по PLAN_MIRROR_BATCH.
+    С overwrite=False уже существующие планы на ту же дату остаются как есть.
+    Возвращает количество сохраненных планов.
+    """
+    entries = []
+    for user_id, date, plan_data in plans:
+        document = normalize_plan_document(plan_data)
+        entries.append((user_id, date, format_enhanced_plan(document), document))
+    
+    saved = set(await save_user_plans_bulk(entries, overwrite=overwrite))
+    if not saved:
+        return 0
+    
+    mirrored = []
+    for user_id, date, plan_text, _ in entries:
+        if (user_id, date) in saved:
+            # Пакет не наполняет кэш (ночью это все активные пользователи), только сбрасывает устаревшее
+            _plan_cache.pop((user_id, date), None)
+            mirrored.append((user_id, date, plan_text))
+    
+    for start in range(0, len(mirrored), PLAN_MIRROR_BATCH):
+        batch = mirrored[start:start + PLAN_MIRROR_BATCH]
+        task_queue.submit(
+            'sheets_upsert', mirror_plans_to_sheets, batch,
+            description=f"пакет планов ({len(batch)})"
+        )
+    return len(mirrored)
+
+
+def invalidate_daily_plan(user_id: int, date: Optional[str] = None) -> None:
+    """Удаляет план (или все планы пользователя) из кэша"""
+    for key in [key for key in _plan_cache if key[0] == user_id and (date is None or key[1] == date)]:
+        del _plan_cache[key]
+
+
+async def reconcile_plans_from_sheets(context) -> None:
+    """
+    Импортирует планы, отредактированные администратором прямо в Google Sheets.
+    
+    Таблица читается одним запросом. Планы, еще не выгруженные в Google Sheets
+    после изменения в боте, не перезаписываются.
+    """
+    sheet_plans = await get_all_plans_from_sheets()
+    if sheet_plans is None:
+        return
+    
+    today = datetime.now().date()
+    start_date = today - timedelta(days=PLAN_RECONCILE_DAYS_BACK)
+    end_date = today + timedelta(days=PLAN_RECONCILE_DAYS_AHEAD)
+    
+    db_plans = await get_plans_sync_state(start_date, end_date)
+    
+    changed = []
+    for user_id, plan_date, plan_text in sheet_plans:
+        if not start_date.strftime("%Y-%m-%d") <= plan_date <= end_date.strftime("%Y-%m-%d"):
+            continue
+        
+        db_plan = db_plans.get((user_id, plan_date))
+        if db_plan is None or (db_plan['synced'] and db_plan['plan_text'] != plan_text):
+            # Текст из таблицы разбирается один раз - при импорте
+            document = normalize_plan_document(parse_structured_plan(plan_text))
+            changed.append((user_id, plan_date, plan_text, document))
+    
+    if not changed:
+        logger.debug("🔄 Сверка планов: изменений в Google Sheets нет")
+        return
+    
+    await import_plan_texts_bulk(changed)
+    for user_id, plan_date, _, _ in changed:
+        invalidate_daily_plan(user_id, plan_date)
+    
+    logger.info(f"🔄 Сверка планов: найдено изменений в Google Sheets: {len(changed)}")
+
+
+def record_plan_latency(latency_ms: float) -> None:
+    """Сохраняет время ответа на /plan"""
+    _plan_latencies.append(latency_ms)
+
+
+def get_plan_latency_stats() -> Dict[str, float]:
+    """Возвращает p50/p99 времени ответа на /plan по последним замерам"""
+    if not _plan_latencies:
+        return {'count': 0, 'p50': 0.0, 'p99': 0.0}
+    
+    return {
+        'count': len(_plan_latencies),
+        'p50': percentile(_plan_latencies, 50),
+        'p99': percentile(_plan_latencies, 99)
+    }
+
+
+def get_plan_cache_size() -> int:
+    """Количество планов в кэше"""
+    return len(_plan_cache)
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict
+
+from config import SHEETS_EXECUTOR_WORKERS, logger
+from utils.helpers import percentile
+
+logger = logging.getLogger(__name__)
+
+
+class SheetsExecutor:
+    """
+    Отдельный ограниченный пул потоков для блокирующих вызовов Google Sheets.
+    
+    Общий пул по умолчанию (run_in_executor(None, ...)) не занимается, а
+    медленный API таблиц не может занять больше max_workers потоков.
+    Собирает глубину очереди, время ожидания в очереди и время выполнения.
+    """
+    
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sheets")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._failed = 0
+        self._wait_times: Deque[float] = deque(maxlen=1000)
+        self._run_times: Deque[float] = deque(maxlen=1000)
+        self._closed = False
+    
+    def _instrumented(self, func: Callable[..., Any], submitted_at: float, *args: Any) -> Any:
+        """Выполняет функцию в потоке пула, замеряя ожидание и выполнение"""
+        started_at = time.monotonic()
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+            self._wait_times.append((started_at - submitted_at) * 1000)
+        
+        try:
+            result = func(*args)
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        else:
+            with self._lock:
+                self._completed += 1
+            return result
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._run_times.append((time.monotonic() - started_at) * 1000)
+    
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Выполняет блокирующую функцию в пуле Sheets и возвращает результат"""
+        if self._closed:
+            raise RuntimeError("Пул Google Sheets остановлен")
+        
+        with self._lock:
+            self._queued += 1
+        
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self._executor, self._instrumented, func, time.monotonic(), *args)
+        except RuntimeError:
+            # Пул остановили между проверкой и отправкой задачи
+            with self._lock:
+                self._queued -= 1
+            raise
+        return await future
+    
+    async def shutdown(self) -> None:
+        """Перестает принимать задачи и дожидается выполняющихся записей"""
+        if self._closed:
+            return
+        
+        self._closed = True
+        with self._lock:
+            pending = self._queued + self._active
+        if pending:
+            logger.info(f"⏳ Ожидаем завершения {pending} операций Google Sheets...")
+        
+        # shutdown(wait=True) блокирует поток - ждем его вне event loop
+        await asyncio.to_thread(self._executor.shutdown, wait=True)
+        logger.info("✅ Пул Google Sheets остановлен")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Глубина очереди и p50/p99 ожидания и выполнения (мс) по последним задачам"""
+        with self._lock:
+            wait_times = list(self._wait_times)
+            run_times = list(self._run_times)
+            stats = {
+                'workers': self.max_workers,
+                'queued': self._queued,
+                'active': self._active,
+                'completed': self._completed,
+                'failed': self._failed
+            }
+        
+        stats.update({
+            'wait_p50': percentile(wait_times, 50),
+            'wait_p99': percentile(wait_times, 99),
+            'run_p50': percentile(run_times, 50),
+            'run_p99': percentile(run_times, 99)
+        })
+        return stats
+
+
+sheets_executor = SheetsExecutor(SHEETS_EXECUTOR_WORKERS)
+
@@ -0,0 +1,185 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+from gspread.utils import rowcol_to_a1
+from telegram.ext import ContextTypes
+
+from config import logger
+from database import (
+    get_daily_reports_for_export, get_monthly_progress_stats,
+    get_exported_periods, mark_period_exported
+)
+from services.google_sheets import get_google_sheet
+from services.sheets_executor import sheets_executor
+from services.sheets_gateway import sheets_gateway
+
+logger = logging.getLogger(__name__)
+
+REPORTS_EXPORT = "daily_reports"
+# Сколько прошедших дней проверяется на невыгруженные отчеты (после простоя бота)
+EXPORT_CATCHUP_DAYS = 7
+
+REPORTS_WORKSHEET = "ежедневные_отчеты"
+MONTHLY_STATS_WORKSHEET = "статистика_месяца"
+MONTHLY_STATS_WIDTH = 25
+
+# Колонки листа статистика_месяца (с 1), которые считаются из user_progress.
+# Остальные колонки заполняются вручную и при обновлении не перезаписываются.
+MONTHLY_STATS_COLUMNS = {
+    2: 'username',
+    3: 'first_name',
+    5: 'avg_mood',
+    9: 'active_days',
+    10: 'mood_trend',
+    13: 'tasks_total',
+    25: 'avg_tasks'
+}
+
+
+def _value(value: Any) -> Any:
+    """Значение для ячейки: None -> пустая строка, Decimal -> float"""
+    if value is None:
+        return ''
+    if isinstance(value, (int, float, str)):
+        return value
+    return float(value)
+
+
+def _report_row(report: Dict[str, Any]) -> List[Any]:
+    """Строка листа ежедневные_отчеты из записи user_progress"""
+    row = [''] * 27
+    row[0] = report['user_id']
+    row[1] = report['username']
+    row[2] = report['first_name']
+    row[3] = report['progress_date'].strftime("%Y-%m-%d")
+    row[4] = _value(report['tasks_completed'])
+    row[7] = _value(report['mood'])
+    row[8] = _value(report['energy'])
+    row[11] = _value(report['challenges'])
+    row[13] = _value(report['user_comment'])
+    row[14] = _value(report['activity_done'])
+    row[17] = _value(report['water_intake'])
+    row[19] = _value(report['day_rating'])
+    return row
+
+
+def _sync_append_reports(sheet, rows: List[List[Any]]) -> None:
+    """Добавляет отчеты за день одним запросом append_rows"""
+    worksheet = sheets_gateway.worksheet(sheet, REPORTS_WORKSHEET)
+    sheets_gateway.write(worksheet.append_rows, rows, value_input_option='RAW')
+
+
+def _sync_upsert_monthly_stats(sheet, month_label: str, stats: List[Dict[str, Any]]) -> Tuple[int, int]:
+    """
+    Обновляет статистику месяца: одно чтение листа, один batch_update для
+    существующих строк и один append_rows для новых. Возвращает (обновлено, добавлено).
+    """
+    worksheet = sheets_gateway.worksheet(sheet, MONTHLY_STATS_WORKSHEET)
+    existing = sheets_gateway.read(worksheet.get_all_values)
+    
+    row_by_user = {}
+    for row_number, values in enumerate(existing[1:], start=2):
+        if len(values) >= 4 and values[3] == month_label:
+            row_by_user[values[0]] = row_number
+    
+    updates = []
+    new_rows = []
+    for user_stats in stats:
+        row_number = row_by_user.get(str(user_stats['user_id']))
+        if row_number:
+            for column, key in MONTHLY_STATS_COLUMNS.items():
+                updates.append({
+                    'range': rowcol_to_a1(row_number, column),
+                    'values': [[_value(user_stats[key])]]
+                })
+        else:
+            row = [''] * MONTHLY_STATS_WIDTH
+            row[0] = user_stats['user_id']
+            row[3] = month_label
+            for column, key in MONTHLY_STATS_COLUMNS.items():
+                row[column - 1] = _value(user_stats[key])
+            new_rows.append(row)
+    
+    if updates:
+        sheets_gateway.write(worksheet.batch_update, updates)
+    if new_rows:
+        sheets_gateway.write(worksheet.append_rows, new_rows, value_input_option='RAW')
+    
+    return len(updates) // len(MONTHLY_STATS_COLUMNS), len(new_rows)
+
+
+async def export_monthly_stats(month_start) -> bool:
+    """Пересчитывает статистику месяца в PostgreSQL и выгружает ее в Google Sheets"""
+    sheet = await get_google_sheet()
+    if not sheet:
+        return False
+    
+    month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    stats = await get_monthly_progress_stats(month_start, month_end)
+    if not stats:
+        return True
+    
+    month_label = month_start.strftime("%B %Y")
+    updated, added = await sheets_executor.run(_sync_upsert_monthly_stats, sheet, month_label, stats)
+    logger.info(f"✅ Статистика за {month_label} выгружена: обновлено {updated}, добавлено {added}")
+    return True
+
+
+async def export_reports_to_sheets(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Пакетная выгрузка отчетов в Google Sheets.
+    
+    Каждый завершившийся день, еще не выгруженный, уходит на лист
+    ежедневные_отчеты одним append_rows; затем статистика затронутых месяцев
+    пересчитывается SQL-агрегатом и обновляется на листе статистика_месяца.
+    Если выгружать нечего, к Google Sheets не обращается.
+    """
+    today = datetime.now().date()
+    yesterday = today - timedelta(days=1)
+    first_day = today - timedelta(days=EXPORT_CATCHUP_DAYS)
+    
+    exported = await get_exported_periods(REPORTS_EXPORT, first_day, yesterday)
+    if exported is None:
+        # Без списка отметок уже выгруженные дни ушли бы в таблицу повторно
+        return
+    
+    pending_days = [
+        first_day + timedelta(days=offset)
+        for offset in range(EXPORT_CATCHUP_DAYS)
+        if first_day + timedelta(days=offset) not in exported
+    ]
+    if not pending_days:
+        return
+    
+    sheet = await get_google_sheet()
+    if not sheet:
+        logger.warning("⚠️ Google Sheets не доступен, выгрузка отчетов отложена")
+        return
+    
+    months = set()
+    for day in pending_days:
+        reports = await get_daily_reports_for_export(day)
+        if reports is None:
+            # Ошибка чтения из БД - день не отмечаем, повторим при следующем запуске
+            break
+        
+        try:
+            if reports:
+                await sheets_executor.run(_sync_append_reports, sheet, [_report_row(report) for report in reports])
+        except Exception as e:
+            logger.error(f"❌ Ошибка выгрузки отчетов за {day}: {e}")
+            break
+        
+        months.add(day.replace(day=1))
+        if not await mark_period_exported(REPORTS_EXPORT, day, len(reports)):
+            # Следующие дни не выгружаем: без отметок повторный запуск продублировал бы и их строки
+            logger.error(f"❌ Отчеты за {day} выгружены ({len(reports)}), но не отмечены - выгрузка остановлена")
+            break
+        logger.info(f"✅ Отчеты за {day} выгружены в Google Sheets: {len(reports)}")
+    
+    for month_start in sorted(months):
+        try:
+            await export_monthly_stats(month_start)
+        except Exception as e:
+            logger.error(f"❌ Ошибка выгрузки статистики за {month_start:%Y-%m}: {e}")
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import gspread
+import requests
+from tenacity import (
+    Retrying, RetryCallState, retry_if_exception, stop_after_attempt, wait_random_exponential
+)
+
+from config import SHEETS_READ_REQUESTS_PER_MINUTE, SHEETS_WRITE_REQUESTS_PER_MINUTE, logger
+from services.sheets_executor import sheets_executor
+
+logger = logging.getLogger(__name__)
+
+# Коды ответа Google API, при которых запрос имеет смысл повторить
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_ATTEMPTS = 5
+MAX_BACKOFF_SECONDS = 32
+
+
+class TokenBucket:
+    """
+    Потокобезопасный token bucket для квоты запросов в минуту.
+    
+    acquire() блокирует поток-исполнитель, пока не появится токен, поэтому
+    вызывается только из синхронного кода, работающего в executor.
+    """
+    
+    def __init__(self, requests_per_minute: int):
+        self.capacity = float(requests_per_minute)
+        self.tokens = float(requests_per_minute)
+        self.refill_per_second = requests_per_minute / 60.0
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self) -> float:
+        """Забирает токен, возвращает время ожидания в секундах"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.refill_per_second)
+                self._updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.refill_per_second
+            time.sleep(delay)
+            waited += delay
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    """Возвращает HTTP код ошибки gspread"""
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """Проверяет, стоит ли повторить запрос: превышение квоты, 5xx или сетевой сбой"""
+    if isinstance(error, gspread.exceptions.APIError):
+        return _status_code(error) in RETRYABLE_STATUS_CODES
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+def appended_row_number(response: Dict[str, Any]) -> Optional[int]:
+    """Номер строки, добавленной append_row (из updatedRange ответа API)"""
+    updated_range = (response or {}).get('updates', {}).get('updatedRange', '')
+    match = re.search(r'![A-Z]+(\d+)', updated_range)
+    return int(match.group(1)) if match else None
+
+
+class SheetsGateway:
+    """
+    Единая точка доступа к Google Sheets API.
+    
+    - квоты чтения и записи соблюдаются отдельными token bucket;
+    - 429 и 5xx повторяются с экспоненциальной задержкой и джиттером;
+    - одинаковые одновременные чтения объединяются в один запрос;
+    - объекты листов кэшируются, чтобы не запрашивать метаданные таблицы каждый раз.
+    """
+    
+    def __init__(self, read_per_minute: int, write_per_minute: int):
+        self._read_bucket = TokenBucket(read_per_minute)
+        self._write_bucket = TokenBucket(write_per_minute)
+        self._worksheets: Dict[str, gspread.Worksheet] = {}
+        self._worksheets_lock = threading.Lock()
+        self._inflight_reads: Dict[Hashable, asyncio.Future] = {}
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'reads': 0,
+            'writes': 0,
+            'retries': 0,
+            'throttled_seconds': 0.0,
+            'coalesced_reads': 0
+        }
+    
+    def _count(self, key: str, value: float = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += value
+    
+    def _log_retry(self, retry_state: RetryCallState) -> None:
+        self._count('retries')
+        error = retry_state.outcome.exception() if retry_state.outcome else None
+        logger.warning(
+            f"⚠️ Google Sheets: попытка {retry_state.attempt_number}/{MAX_ATTEMPTS} не удалась "
+            f"({_status_code(error) or type(error).__name__}), повтор через {retry_state.next_action.sleep:.1f} c"
+        )
+    
+    def _call(self, bucket: TokenBucket, stat_key: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Выполняет запрос с учетом квоты и повторами"""
+        retrying = Retrying(
+            retry=retry_if_exception(is_retryable_error),
+            wait=wait_random_exponential(multiplier=1, max=MAX_BACKOFF_SECONDS),
+            stop=stop_after_attempt(MAX_ATTEMPTS),
+            before_sleep=self._log_retry,
+            reraise=True
+        )
+        for attempt in retrying:
+            with attempt:
+                waited = bucket.acquire()
+                if waited:
+                    self._count('throttled_seconds', waited)
+                self._count(stat_key)
+                return func(*args, **kwargs)
+    
+    def read(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Синхронный запрос на чтение (вызывать из executor)"""
+        return self._call(self._read_bucket, 'reads', func, *args, **kwargs)
+    
+    def write(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Синхронный запрос на запись (вызывать из executor)"""
+        return self._call(self._write_bucket, 'writes', func, *args, **kwargs)
+    
+    def worksheet(self, spreadsheet: gspread.Spreadsheet, title: str) -> gspread.Worksheet:
+        """Возвращает лист по названию (с кэшированием)"""
+        with self._worksheets_lock:
+            worksheet = self._worksheets.get(title)
+        if worksheet is None:
+            worksheet = self.read(spreadsheet.worksheet, title)
+            with self._worksheets_lock:
+                self._worksheets[title] = worksheet
+        return worksheet
+    
+    def clear_worksheet_cache(self) -> None:
+        """Сбрасывает кэш листов (при смене таблицы)"""
+        with self._worksheets_lock:
+            self._worksheets.clear()
+    
+    async def run_coalesced(self, key: Hashable, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Выполняет синхронное чтение в пуле Sheets. Если такое же чтение (тот же
+        ключ) уже выполняется, ждет его результат вместо нового запроса.
+        """
+        future = self._inflight_reads.get(key)
+        if future is not None:
+            self._count('coalesced_reads')
+            return await asyncio.shield(future)
+        
+        future = asyncio.ensure_future(sheets_executor.run(func, *args))
+        self._inflight_reads[key] = future
+        future.add_done_callback(lambda _: self._inflight_reads.pop(key, None))
+        return await asyncio.shield(future)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика запросов к Google Sheets"""
+        with self._stats_lock:
+            return dict(self.stats)
+
+
+sheets_gateway = SheetsGateway(SHEETS_READ_REQUESTS_PER_MINUTE, SHEETS_WRITE_REQUESTS_PER_MINUTE)
@@ -0,0 +1,243 @@
+"""
+Раскладка листа планов в Google Sheets.
+
+v1 (индивидуальные_планы_месяц): строка на пару (пользователь, месяц) в конце
+листа. Чтобы найти план, нужны findall по user_id и проверка месяца каждой строки.
+
+v2 (планы_v2): каждому пользователю принадлежит блок из 12 строк, по строке на
+календарный месяц: строка = начало блока + номер месяца - 1 (хранится последний
+год, более старый месяц перезаписывается). Скрытый лист индекс_планов содержит
+user_id -> первая строка блока и читается одним запросом, после чего чтения и
+записи планов - прямые A1-диапазоны. Строки индекса не сортируются вручную:
+блоки выдаются по порядку строк индекса.
+
+Переход на v2 выполняет tools/migrate_sheets_layout.py; до этого бот работает с v1.
+"""
+import logging
+import threading
+import time
+from datetime import date as date_type
+from typing import Any, Dict, List, Optional
+
+import gspread
+from gspread.utils import rowcol_to_a1
+
+from config import logger
+from services.sheets_gateway import sheets_gateway, appended_row_number
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_VERSION = 2
+
+PLANS_WORKSHEET_V1 = "индивидуальные_планы_месяц"
+PLANS_WORKSHEET_V2 = "планы_v2"
+PLAN_INDEX_WORKSHEET = "индекс_планов"
+
+BLOCK_SIZE = 12
+FIRST_BLOCK_ROW = 2         # строка 1 листа планов - заголовки
+FIRST_INDEX_ROW = 3         # строки 1-2 индекса - версия раскладки и заголовки
+PLAN_ROW_WIDTH = 37         # id, username, имя, месяц, 31 день, комментарии, обновление
+GROW_ROWS = BLOCK_SIZE * 100
+
+# Пока раскладка v1, наличие индекса перепроверяется не чаще этого интервала (секунды)
+LAYOUT_CHECK_INTERVAL = 600
+
+
+def plan_headers() -> List[str]:
+    """Заголовки листа планов (одинаковые для v1 и v2)"""
+    headers = ["id_клиента", "telegram_username", "имя", "месяц"]
+    headers.extend(f"день_{day}" for day in range(1, 32))
+    headers.extend(["общие_комментарии_месяца", "последнее_обновление"])
+    return headers
+
+
+def block_first_row(index_row: int) -> int:
+    """Первая строка блока пользователя по номеру его строки в индексе"""
+    return FIRST_BLOCK_ROW + (index_row - FIRST_INDEX_ROW) * BLOCK_SIZE
+
+
+def month_row(first_row: int, plan_date: date_type) -> int:
+    """Строка блока, отведенная под месяц даты плана"""
+    return first_row + plan_date.month - 1
+
+
+def day_column(day: int) -> int:
+    """Колонка дня месяца (с 1): 4 базовые колонки + день"""
+    return 4 + day
+
+
+def plan_row_range(row: int) -> str:
+    """A1-диапазон всей строки плана"""
+    return f"A{row}:{rowcol_to_a1(row, PLAN_ROW_WIDTH)}"
+
+
+def empty_plan_row(user_id: int, username: str, first_name: str, plan_month: str) -> List[Any]:
+    """Новая строка месяца без планов"""
+    return [user_id, username, first_name, plan_month] + [""] * (PLAN_ROW_WIDTH - 4)
+
+
+def appended_row(response: Dict[str, Any]) -> int:
+    """Номер строки из ответа append_row (ошибка, если API его не вернул)"""
+    row = appended_row_number(response)
+    if not row:
+        raise RuntimeError("API не вернул номер добавленной строки индекса")
+    return row
+
+
+class PlanLayout:
+    """
+    Версия раскладки листа планов и кэш индекса блоков пользователей.
+    
+    Методы синхронные (вызываются в пуле потоков Google Sheets) и потокобезопасные.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sheet = None
+        self._checked_at = 0.0
+        self.version = 1
+        self._blocks: Dict[int, int] = {}
+        self._restored = False
+    
+    def load(self, sheet) -> int:
+        """Определяет версию раскладки и загружает индекс одним запросом"""
+        with self._lock:
+            if self._restored and self._sheet is None:
+                # Индекс восстановлен из локального снимка - API не нужен, refresh() обновит его в фоне
+                self._sheet = sheet
+                self._checked_at = time.monotonic()
+            
+            if self._sheet is sheet and (
+                self.version >= LAYOUT_VERSION or time.monotonic() - self._checked_at < LAYOUT_CHECK_INTERVAL
+            ):
+                return self.version
+            
+            version, blocks = self._read_index(sheet)
+            self._sheet = sheet
+            self._checked_at = time.monotonic()
+            self.version = version
+            self._blocks = blocks
+            
+            if version >= LAYOUT_VERSION:
+                logger.info(f"✅ Раскладка планов v{version}: в индексе {len(blocks)} пользователей")
+            return version
+    
+    def _read_index(self, sheet):
+        """Читает лист индекса: (версия, {user_id: первая строка блока})"""
+        try:
+            index_worksheet = sheets_gateway.worksheet(sheet, PLAN_INDEX_WORKSHEET)
+        except gspread.exceptions.WorksheetNotFound:
+            return 1, {}
+        
+        values = sheets_gateway.read(index_worksheet.get_all_values)
+        try:
+            version = int(values[0][1])
+        except (IndexError, ValueError):
+            logger.warning("⚠️ Лист индекса планов без версии раскладки, используется v1")
+            return 1, {}
+        
+        blocks = {}
+        for index_row, row in enumerate(values[FIRST_INDEX_ROW - 1:], start=FIRST_INDEX_ROW):
+            try:
+                user_id = int(row[0])
+            except (IndexError, ValueError):
+                continue
+            # Если пользователь попал в индекс дважды (гонка реплик), действует первая запись
+            blocks.setdefault(user_id, block_first_row(index_row))
+        return version, blocks
+    
+    def refresh(self, sheet) -> int:
+        """Перечитывает индекс из таблицы независимо от кэша"""
+        with self._lock:
+            self._sheet = None
+            self._restored = False
+        return self.load(sheet)
+    
+    def export_state(self) -> Dict[str, Any]:
+        """Состояние индекса для локального снимка"""
+        with self._lock:
+            return {'version': self.version, 'blocks': [[user_id, row] for user_id, row in self._blocks.items()]}
+    
+    def restore_state(self, state: Dict[str, Any]) -> None:
+        """Восстанавливает индекс из локального снимка (до подключения к таблице)"""
+        with self._lock:
+            self.version = int(state.get('version', 1))
+            self._blocks = {int(user_id): int(row) for user_id, row in state.get('blocks', [])}
+            self._sheet = None
+            self._restored = True
+    
+    def invalidate(self) -> None:
+        """Сбрасывает кэш индекса (при смене таблицы или после миграции)"""
+        with self._lock:
+            self._sheet = None
+            self._checked_at = 0.0
+            self.version = 1
+            self._blocks = {}
+            self._restored = False
+    
+    def plans_worksheet(self, sheet) -> gspread.Worksheet:
+        """Лист планов текущей раскладки"""
+        title = PLANS_WORKSHEET_V2 if self.load(sheet) >= LAYOUT_VERSION else PLANS_WORKSHEET_V1
+        return sheets_gateway.worksheet(sheet, title)
+    
+    def block_for(self, user_id: int) -> Optional[int]:
+        """Первая строка блока пользователя (None, если блок еще не выделен)"""
+        with self._lock:
+            return self._blocks.get(user_id)
+    
+    def allocate_block(self, sheet, user_id: int) -> int:
+        """Выделяет пользователю блок строк (см. allocate_blocks)"""
+        return self.allocate_blocks(sheet, [user_id])[user_id]
+    
+    def allocate_blocks(self, sheet, user_ids: List[int]) -> Dict[int, int]:
+        """
+        Выделяет блоки строк пользователям без блока одним append_rows в индекс.
+        Номера блоков определяются строками, в которые API добавил записи
+        индекса, поэтому реплики не выдают один блок дважды. Если другая реплика
+        одновременно добавила того же пользователя, после записи индекс
+        перечитывается и действует первая запись; проигравший блок не используется.
+        Возвращает {user_id: первая строка блока} для всех переданных пользователей.
+        """
+        with self._lock:
+            missing = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in self._blocks]
+            if missing:
+                # Блоки могли выделить другие процессы после загрузки индекса - перечитываем его
+                _, self._blocks = self._read_index(sheet)
+                missing = [user_id for user_id in missing if user_id not in self._blocks]
+            
+            if missing:
+                index_worksheet = sheets_gateway.worksheet(sheet, PLAN_INDEX_WORKSHEET)
+                response = sheets_gateway.write(
+                    index_worksheet.append_rows, [[user_id, ""] for user_id in missing]
+                )
+                first_index_row = appended_row(response)
+                last_index_row = first_index_row + len(missing) - 1
+                first_rows = [block_first_row(first_index_row + offset) for offset in range(len(missing))]
+                sheets_gateway.write(
+                    index_worksheet.update,
+                    values=[[first_row] for first_row in first_rows],
+                    range_name=f"B{first_index_row}:B{last_index_row}"
+                )
+                
+                plans_worksheet = sheets_gateway.worksheet(sheet, PLANS_WORKSHEET_V2)
+                last_row = first_rows[-1] + BLOCK_SIZE - 1
+                if last_row > plans_worksheet.row_count:
+                    sheets_gateway.write(plans_worksheet.add_rows, last_row - plans_worksheet.row_count + GROW_ROWS)
+                
+                # Свои записи индекса не берем на веру: побеждает первая запись пользователя в индексе
+                _, self._blocks = self._read_index(sheet)
+                lost = 0
+                for user_id, first_row in zip(missing, first_rows):
+                    if self._blocks.setdefault(user_id, first_row) != first_row:
+                        lost += 1
+                
+                logger.info(
+                    f"📐 Выделено блоков строк: {len(missing) - lost} "
+                    f"(строки {first_rows[0]}-{last_row})"
+                )
+                if lost:
+                    logger.warning(f"⚠️ Блоки {lost} пользователей уже выделены другой репликой - используются они")
+            
+            return {user_id: self._blocks[user_id] for user_id in user_ids}
+
+plan_layout = PlanLayout()
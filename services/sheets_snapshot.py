@@ -0,0 +1,125 @@
+"""
+Локальный снимок состояния Google Sheets для быстрого холодного старта.
+
+В снимок попадает то, что сервис таблиц иначе заново запрашивал бы у API после
+перезапуска: индекс блоков листа планов (раскладка v2) и кэш строк клиентов.
+Формат - строка заголовка с версией формата и ревизией снимка, затем JSON,
+сжатый zlib. Снимок читается при старте без обращений к API, после подключения
+к таблице индекс обновляется в фоне, а сохраняется снимок периодически и при
+завершении работы (атомарной заменой файла).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+from telegram.ext import ContextTypes
+
+from config import GOOGLE_SHEETS_ID, SHEETS_SNAPSHOT_PATH, logger
+from services.google_sheets import export_client_rows, restore_client_rows
+from services.sheets_layout import plan_layout
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"SHEETS-SNAPSHOT"
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_SAVE_INTERVAL = 600
+
+_revision = 0
+_saved_digest: Optional[str] = None
+
+
+def _encode(revision: int, payload: Dict[str, Any]) -> bytes:
+    body = zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 6)
+    header = b"%s %d %d\n" % (SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, revision)
+    return header + body
+
+
+def _decode(data: bytes) -> Optional[Dict[str, Any]]:
+    header, _, body = data.partition(b"\n")
+    parts = header.split(b" ")
+    if len(parts) != 3 or parts[0] != SNAPSHOT_MAGIC or int(parts[1]) != SNAPSHOT_FORMAT:
+        return None
+    payload = json.loads(zlib.decompress(body).decode('utf-8'))
+    payload['revision'] = int(parts[2])
+    return payload
+
+
+def _collect_state() -> Dict[str, Any]:
+    """Текущее состояние кэшей сервиса таблиц"""
+    return {
+        'spreadsheet_id': GOOGLE_SHEETS_ID,
+        'layout': plan_layout.export_state(),
+        'client_rows': export_client_rows()
+    }
+
+
+def load_snapshot(path: Optional[str] = SHEETS_SNAPSHOT_PATH) -> bool:
+    """Восстанавливает кэши из снимка. Снимок другой таблицы или формата игнорируется."""
+    global _revision, _saved_digest
+    if not path or not os.path.exists(path):
+        return False
+    
+    try:
+        with open(path, 'rb') as f:
+            payload = _decode(f.read())
+    except Exception as e:
+        logger.warning(f"⚠️ Снимок Google Sheets поврежден, будет создан заново: {e}")
+        return False
+    
+    if not payload or payload.get('spreadsheet_id') != GOOGLE_SHEETS_ID:
+        logger.info("ℹ️ Снимок Google Sheets от другой таблицы или версии формата - пропускаем")
+        return False
+    
+    plan_layout.restore_state(payload.get('layout', {}))
+    restored_rows = restore_client_rows(payload.get('client_rows', []))
+    
+    _revision = payload['revision']
+    _saved_digest = None
+    saved_at = time.strftime("%Y-%m-%d %H:%M", time.localtime(payload.get('saved_at', 0)))
+    logger.info(
+        f"✅ Снимок Google Sheets r{_revision} от {saved_at} загружен: "
+        f"блоков планов {len(payload.get('layout', {}).get('blocks', []))}, строк клиентов {restored_rows}"
+    )
+    return True
+
+
+def save_snapshot(path: Optional[str] = SHEETS_SNAPSHOT_PATH) -> bool:
+    """Сохраняет снимок, если состояние изменилось с прошлого сохранения"""
+    global _revision, _saved_digest
+    if not path:
+        return False
+    
+    state = _collect_state()
+    digest = hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    if digest == _saved_digest:
+        return False
+    
+    revision = _revision + 1
+    state['saved_at'] = time.time()
+    data = _encode(revision, state)
+    
+    # Пишем во временный файл и атомарно подменяем - снимок не окажется недописанным
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    
+    _revision = revision
+    _saved_digest = digest
+    logger.debug(f"💾 Снимок Google Sheets r{revision} сохранен ({len(data)} байт)")
+    return True
+
+
+async def save_snapshot_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Периодическое сохранение снимка (на каждой реплике - файл локальный)"""
+    try:
+        await asyncio.to_thread(save_snapshot)
+    except Exception as e:
+        logger.error(f"❌ Ошибка сохранения снимка Google Sheets: {e}")
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import random
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Set
+
+from config import logger
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StageStats:
+    """Счетчики выполнения задач стадии"""
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    retries: int = 0
+
+
+@dataclass
+class Stage:
+    """Стадия фоновой обработки со своим лимитом параллельности и политикой повторов"""
+    name: str
+    concurrency: int
+    max_attempts: int = 3
+    base_delay: float = 2.0
+    semaphore: asyncio.Semaphore = field(init=False)
+    stats: StageStats = field(default_factory=StageStats)
+    
+    def __post_init__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+
+class BackgroundTaskQueue:
+    """
+    Очередь фоновых задач, не блокирующих ответ пользователю.
+    
+    Задача считается неудачной, если выбросила исключение или вернула False;
+    такие задачи повторяются с экспоненциальной задержкой и джиттером.
+    """
+    
+    def __init__(self):
+        self._stages: Dict[str, Stage] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._accepting = True
+    
+    def register_stage(self, name: str, concurrency: int, max_attempts: int = 3, base_delay: float = 2.0) -> None:
+        """Регистрирует стадию обработки"""
+        self._stages[name] = Stage(name, concurrency, max_attempts, base_delay)
+    
+    def submit(self, stage_name: str, func: Callable[..., Awaitable[Any]], *args: Any, description: str = "") -> bool:
+        """Ставит задачу в очередь стадии, возвращает False если очередь остановлена"""
+        if not self._accepting:
+            logger.warning(f"⚠️ Очередь остановлена, задача {stage_name} ({description}) отклонена")
+            return False
+        
+        stage = self._stages[stage_name]
+        stage.stats.submitted += 1
+        
+        task = asyncio.create_task(self._run(stage, func, args, description or func.__name__))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+    
+    async def _run(self, stage: Stage, func: Callable[..., Awaitable[Any]], args: tuple, description: str) -> None:
+        """Выполняет задачу с повторами, соблюдая лимит параллельности стадии"""
+        for attempt in range(1, stage.max_attempts + 1):
+            try:
+                async with stage.semaphore:
+                    result = await func(*args)
+                if result is not False:
+                    stage.stats.completed += 1
+                    return
+                error = "задача вернула False"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = str(e)
+            
+            if attempt < stage.max_attempts:
+                stage.stats.retries += 1
+                delay = stage.base_delay * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                logger.warning(
+                    f"⚠️ [{stage.name}] {description}: попытка {attempt}/{stage.max_attempts} не удалась "
+                    f"({error}), повтор через {delay:.1f} c"
+                )
+                await asyncio.sleep(delay)
+            else:
+                stage.stats.failed += 1
+                logger.error(f"❌ [{stage.name}] {description}: все {stage.max_attempts} попытки не удались ({error})")
+    
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """Статистика по стадиям"""
+        return {
+            name: {
+                'submitted': stage.stats.submitted,
+                'completed': stage.stats.completed,
+                'failed': stage.stats.failed,
+                'retries': stage.stats.retries
+            }
+            for name, stage in self._stages.items()
+        }
+    
+    @property
+    def pending(self) -> int:
+        """Количество незавершенных задач"""
+        return len(self._tasks)
+    
+    async def shutdown(self, timeout: float = 30) -> None:
+        """Дожидается незавершенных задач, по таймауту отменяет оставшиеся"""
+        self._accepting = False
+        if not self._tasks:
+            return
+        
+        logger.info(f"⏳ Ожидаем завершения фоновых задач: {len(self._tasks)}")
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.warning(f"⚠️ Отменено незавершенных фоновых задач: {len(pending)}")
+
+
+# Общая очередь бота. Сообщения администратору идут по одному, чтобы не упираться
+# в лимиты Telegram на один чат; Google Sheets ограничен квотой API
+task_queue = BackgroundTaskQueue()
+task_queue.register_stage('admin_digest', concurrency=1, max_attempts=3)
+task_queue.register_stage('sheets_upsert', concurrency=2, max_attempts=5, base_delay=5.0)
+task_queue.register_stage('profile_analysis', concurrency=4, max_attempts=2)
+task_queue.register_stage('answers_save', concurrency=2, max_attempts=6, base_delay=10.0)
@@ -1,14 +1,62 @@
 import logging
-from typing import Dict, Any, List
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, timedelta
 
 from config import PLAN_TEMPLATES, WEEKLY_TEMPLATE_SCHEDULE, logger
 
 logger = logging.getLogger(__name__)
 
-def create_personalized_template(template_key: str, user_profile: Dict[str, Any]) -> Dict[str, Any]:
-    """Создает персонализированный шаблон на основе профиля пользователя"""
-    base_template = PLAN_TEMPLATES[template_key].copy()
+# Персонализированных шаблонов в кэше (на процесс; ключ - шаблон и отпечаток профиля)
+TEMPLATE_CACHE_SIZE = 512
+
+# (тип личности, тип цели, срочность дедлайна, начало глубокой работы,
+#  уровень энергии, препятствия, мотиваторы)
+ProfileFingerprint = Tuple[Optional[str], str, Optional[str], Optional[str], str, Tuple[str, ...], Tuple[str, ...]]
+
+WEEKDAY_NAMES = ('понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота', 'воскресенье')
+
+def template_key_for_date(date: str) -> str:
+    """Ключ шаблона на дату по недельному расписанию WEEKLY_TEMPLATE_SCHEDULE"""
+    weekday = datetime.strptime(date, "%Y-%m-%d").weekday()
+    return WEEKLY_TEMPLATE_SCHEDULE.get(WEEKDAY_NAMES[weekday], "продуктивный_день")
+
+def profile_fingerprint(user_profile: Dict[str, Any]) -> ProfileFingerprint:
+    """
+    Признаки профиля, от которых зависят адаптации шаблона. Пользователи с
+    одинаковым отпечатком получают одинаковый персонализированный шаблон.
+    """
+    optimal_times = user_profile.get('optimal_times') or {}
+    return (
+        user_profile.get('personality_type'),
+        user_profile.get('goal_analysis', {}).get('type', "unknown"),
+        user_profile.get('deadline_info', {}).get('urgency_level'),
+        optimal_times.get('deep_work_start', '09:00') if optimal_times else None,
+        user_profile.get('energy_level', 'medium'),
+        tuple(sorted(user_profile.get('obstacles', []))),
+        tuple(sorted(user_profile.get('motivation_triggers', [])))
+    )
+
+def _profile_from_fingerprint(fingerprint: ProfileFingerprint) -> Dict[str, Any]:
+    """Профиль только из признаков отпечатка - адаптации не видят остальных полей"""
+    personality, goal_type, urgency, deep_work_start, energy_level, obstacles, triggers = fingerprint
+    return {
+        'personality_type': personality,
+        'goal_analysis': {'type': goal_type},
+        'deadline_info': {'urgency_level': urgency},
+        'optimal_times': {'deep_work_start': deep_work_start} if deep_work_start else {},
+        'energy_level': energy_level,
+        'obstacles': list(obstacles),
+        'motivation_triggers': list(triggers)
+    }
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _personalized_template(template_key: str, fingerprint: ProfileFingerprint) -> Dict[str, Any]:
+    """Адаптирует шаблон под отпечаток профиля (результат кэшируется, не изменять)"""
+    user_profile = _profile_from_fingerprint(fingerprint)
+    
+    # Шаблоны в конфиге неизменяемые - работаем с копией в виде словаря
+    base_template = PLAN_TEMPLATES[template_key].to_dict()
     
     # Адаптируем под тип личности
     personality = user_profile['personality_type']
@@ -18,7 +66,7 @@ def create_personalized_template(template_key: str, user_profile: Dict[str, Any]
         base_template = adapt_for_dynamic(base_template, user_profile)
     
     # Адаптируем под цели
-    goal_type = user_profile.get('goal_analysis', {}).get('type', "unknown")
+    goal_type = user_profile['goal_analysis']['type']
     if goal_type == "project":
         base_template = adapt_for_project_goal(base_template, user_profile)
     
@@ -33,6 +81,17 @@ def create_personalized_template(template_key: str, user_profile: Dict[str, Any]
     
     return base_template
 
+def create_personalized_template(template_key: str, user_profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Создает персонализированный шаблон на основе профиля пользователя"""
+    cached = _personalized_template(template_key, profile_fingerprint(user_profile))
+    # Вызывающий код дополняет план (цель пользователя) - отдаем копию списков
+    return {key: list(value) if isinstance(value, list) else value for key, value in cached.items()}
+
+def get_template_cache_stats() -> Dict[str, int]:
+    """Попадания и промахи кэша персонализированных шаблонов"""
+    info = _personalized_template.cache_info()
+    return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'max_size': info.maxsize}
+
 def adapt_for_deep_focus(template: Dict[str, Any], profile: Dict[str, Any]) -> Dict[str, Any]:
     """Адаптация для глубоко сконцентрированного типа"""
     if 'time_blocks' in template:
@@ -70,6 +129,19 @@ def adapt_for_dynamic(template: Dict[str, Any], profile: Dict[str, Any]) -> Dict
     
     return template
 
+def adapt_for_project_goal(template: Dict[str, Any], profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Адаптация для проектной цели: контрольные точки и срочность дедлайна"""
+    deadline_info = profile.get('deadline_info', {})
+    
+    template.setdefault('critical_tasks', [])
+    template['critical_tasks'].append("Продвинуть проект к ближайшей контрольной точке")
+    
+    if deadline_info.get('urgency_level') == 'high':
+        template.setdefault('advice', [])
+        template['advice'].append("Дедлайн близко - сначала задачи, без которых проект не будет сдан")
+    
+    return template
+
 def adapt_work_blocks(template: Dict[str, Any], profile: Dict[str, Any]) -> Dict[str, Any]:
     """Адаптирует рабочие блоки под предпочтения пользователя"""
     work_style = profile.get('work_style', {})
@@ -130,35 +202,50 @@ def add_30_min(time_str: str) -> str:
     except:
         return time_str
 
-def generate_highly_personalized_plan(user_id: int, date: str, template_key: str = None) -> bool:
+def personalize_plan(template_key: str, user_profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Персонализированный план по шаблону и профилю: адаптации шаблона и цель пользователя"""
+    personalized_plan = create_personalized_template(template_key, user_profile)
+    
+    # Добавляем цель пользователя в план
+    goal_text = user_profile.get('main_goal', '')
+    if goal_text and goal_text != "Цель не установлена":
+        if 'strategic_tasks' in personalized_plan:
+            personalized_plan['strategic_tasks'].insert(0, f"Движение к цели: {goal_text}")
+    
+    return personalized_plan
+
+def generate_plan_documents(items: List[Tuple[int, Dict[int, str], str]]) -> List[Tuple[int, Dict[str, Any]]]:
+    """
+    Генерирует планы для пакета (user_id, ответы анкеты, ключ шаблона).
+    Выполняется в пуле процессов ночной генерации, поэтому не обращается к БД.
+    """
+    from services.analytics import build_user_profile
+    
+    plans = []
+    for user_id, answers, template_key in items:
+        try:
+            plans.append((user_id, personalize_plan(template_key, build_user_profile(user_id, answers))))
+        except Exception as e:
+            logger.error(f"❌ Ошибка генерации плана для {user_id}: {e}")
+    return plans
+
+async def generate_highly_personalized_plan(user_id: int, date: str, template_key: str = None) -> bool:
     """Генерирует высоко персонализированный план для пользователя"""
     try:
         # Анализируем профиль пользователя
         from services.analytics import analyze_user_profile
-        user_profile = analyze_user_profile(user_id)
+        user_profile = await analyze_user_profile(user_id)
         
         # Определяем шаблон
         if not template_key:
-            day_name = datetime.strptime(date, "%Y-%m-%d").strftime("%A").lower()
-            day_translation = {
-                'monday': 'понедельник', 'tuesday': 'вторник', 'wednesday': 'среда',
-                'thursday': 'четверг', 'friday': 'пятница', 'saturday': 'суббота', 'sunday': 'воскресенье'
-            }
-            russian_day = day_translation.get(day_name, 'понедельник')
-            template_key = WEEKLY_TEMPLATE_SCHEDULE.get(russian_day, "продуктивный_день")
-        
-        # Создаем персонализированный шаблон
-        personalized_plan = create_personalized_template(template_key, user_profile)
+            template_key = template_key_for_date(date)
         
-        # Добавляем цель пользователя в план
-        goal_text = user_profile.get('main_goal', '')
-        if goal_text and goal_text != "Цель не установлена":
-            if 'strategic_tasks' in personalized_plan:
-                personalized_plan['strategic_tasks'].insert(0, f"Движение к цели: {goal_text}")
+        # Создаем персонализированный план
+        personalized_plan = personalize_plan(template_key, user_profile)
         
-        # Сохраняем план
-        from services.google_sheets import save_daily_plan_to_sheets
-        success = save_daily_plan_to_sheets(user_id, date, personalized_plan)
+        # Сохраняем план (PostgreSQL, затем фоновая выгрузка в Google Sheets)
+        from services.plan_service import save_daily_plan
+        success = await save_daily_plan(user_id, date, personalized_plan)
         
         if success:
             logger.info(f"✅ Персонализированный план создан для {user_id} на {date}")
@@ -0,0 +1,118 @@
+"""
+Локальная проверка webhook режима: отправляет фейковые Telegram Update
+на webhook сервер бота и выводит задержки ответов.
+
+С WEBHOOK_REGISTER=false бот не вызывает setWebhook: локальный запуск с рабочим
+токеном не перенаправляет доставку обновлений продакшен-бота.
+
+Пример:
+    BOT_MODE=webhook WEBHOOK_REGISTER=false WEBHOOK_LISTEN=127.0.0.1 \\
+    WEBHOOK_SECRET_TOKEN=local-secret python bot.py
+
+    python tools/fake_update_poster.py --secret local-secret --count 200 --concurrency 20
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.helpers import percentile
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def build_update(update_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    """Собирает минимальный Update с текстовым сообщением от пользователя"""
+    now = int(time.time())
+    user = {
+        "id": user_id,
+        "is_bot": False,
+        "first_name": f"Test{user_id}",
+        "username": f"test_user_{user_id}",
+        "language_code": "ru"
+    }
+    message = {
+        "message_id": update_id,
+        "date": now,
+        "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+        "from": user,
+        "text": text
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": update_id, "message": message}
+
+
+def post_update(url: str, secret: Optional[str], update: Dict[str, Any], timeout: float) -> Tuple[int, float]:
+    """Отправляет Update, возвращает HTTP статус и задержку в миллисекундах"""
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers[SECRET_HEADER] = secret
+
+    request = urllib.request.Request(
+        url, data=json.dumps(update).encode('utf-8'), headers=headers, method='POST'
+    )
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return status, (time.perf_counter() - started) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Отправка фейковых обновлений на webhook бота")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram", help="Адрес webhook сервера")
+    parser.add_argument("--secret", default=None, help="Значение WEBHOOK_SECRET_TOKEN")
+    parser.add_argument("--count", type=int, default=10, help="Количество обновлений")
+    parser.add_argument("--concurrency", type=int, default=1, help="Количество параллельных отправителей")
+    parser.add_argument("--users", type=int, default=5, help="Количество разных пользователей")
+    parser.add_argument("--base-user-id", type=int, default=900000000, help="Первый ID фейкового пользователя")
+    parser.add_argument("--text", default="/help", help="Текст сообщения")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Таймаут запроса в секундах")
+    args = parser.parse_args()
+
+    first_update_id = int(time.time())
+    updates = [
+        build_update(first_update_id + i, args.base_user_id + i % max(1, args.users), args.text)
+        for i in range(args.count)
+    ]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+        results = list(executor.map(
+            lambda update: post_update(args.url, args.secret, update, args.timeout), updates
+        ))
+    elapsed = time.perf_counter() - started
+
+    statuses: Dict[int, int] = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    latencies = [latency for status, latency in results if status == 200]
+
+    print(f"Отправлено: {len(results)} за {elapsed:.2f} c ({len(results) / elapsed:.1f} req/s)")
+    print(f"Статусы: {', '.join(f'{code}={n}' for code, n in sorted(statuses.items()))}")
+    if latencies:
+        print(
+            f"Задержка, мс: p50={percentile(latencies, 50):.1f} "
+            f"p99={percentile(latencies, 99):.1f} "
+            f"mean={statistics.mean(latencies):.1f} max={max(latencies):.1f}"
+        )
+    if statuses.get(403):
+        print("⚠️ Сервер вернул 403 - проверьте --secret")
+
+
+if __name__ == "__main__":
+    main()
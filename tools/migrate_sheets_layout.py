@@ -0,0 +1,171 @@
+"""
+Миграция листа планов Google Sheets на раскладку v2 (см. services/sheets_layout.py).
+
+Читает индивидуальные_планы_месяц одним запросом, объединяет дубли строк
+(пользователь, месяц), раскладывает планы по блокам пользователей на листе
+планы_v2 и последним шагом создает скрытый лист индекс_планов - с его
+появлением бот переключается на v2 (в течение LAYOUT_CHECK_INTERVAL или после
+перезапуска). Лист v1 не изменяется и остается для отката: достаточно удалить
+лист индекса.
+
+Планы, сохраненные ботом в v1 во время миграции, остаются в PostgreSQL, но не
+попадут на новый лист - запускайте миграцию при остановленном боте.
+
+Пример:
+    python tools/migrate_sheets_layout.py --dry-run
+    python tools/migrate_sheets_layout.py
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gspread
+from gspread.utils import rowcol_to_a1
+
+from services.google_sheets import init_google_sheets
+from services.sheets_gateway import sheets_gateway
+from services.sheets_layout import (
+    LAYOUT_VERSION, PLANS_WORKSHEET_V1, PLANS_WORKSHEET_V2, PLAN_INDEX_WORKSHEET,
+    BLOCK_SIZE, FIRST_INDEX_ROW, PLAN_ROW_WIDTH, GROW_ROWS, block_first_row, plan_headers
+)
+
+# Строк в одном запросе update (ограничение размера запроса API)
+WRITE_CHUNK_ROWS = 2400
+
+
+def merge_rows(target: List[str], source: List[str]) -> None:
+    """Переносит непустые ячейки source в target (более поздняя строка побеждает)"""
+    for column, value in enumerate(source):
+        if value.strip():
+            target[column] = value
+
+
+def collect_plans(rows: List[List[str]]) -> Tuple[Dict[int, Dict[int, Tuple[datetime, List[str]]]], Dict[str, int]]:
+    """
+    Группирует строки v1 по пользователям и календарным месяцам.
+    Возвращает ({user_id: {месяц: (дата месяца, строка)}}, счетчики).
+    """
+    users: Dict[int, Dict[int, Tuple[datetime, List[str]]]] = {}
+    counters = {'rows': 0, 'skipped': 0, 'merged': 0, 'dropped_old_years': 0}
+
+    for row in rows[1:]:
+        if not any(cell.strip() for cell in row):
+            continue
+        counters['rows'] += 1
+        try:
+            user_id = int(row[0])
+            month_date = datetime.strptime(row[3], "%B %Y")
+        except (IndexError, ValueError):
+            counters['skipped'] += 1
+            continue
+
+        padded = (row + [""] * PLAN_ROW_WIDTH)[:PLAN_ROW_WIDTH]
+        user_months = users.setdefault(user_id, {})
+        existing = user_months.get(month_date.month)
+
+        if existing is None:
+            user_months[month_date.month] = (month_date, padded)
+        elif existing[0] == month_date:
+            # Дубль строки за тот же месяц (старые версии бота добавляли их при ошибках)
+            merge_rows(existing[1], padded)
+            counters['merged'] += 1
+        elif existing[0] < month_date:
+            # Блок хранит один год: более поздний месяц вытесняет прошлогодний
+            user_months[month_date.month] = (month_date, padded)
+            counters['dropped_old_years'] += 1
+        else:
+            counters['dropped_old_years'] += 1
+
+    return users, counters
+
+
+def build_grid(users: Dict[int, Dict[int, Tuple[datetime, List[str]]]]) -> Tuple[List[List[str]], List[List[object]]]:
+    """Строит содержимое листа v2 и строки индекса"""
+    grid = [plan_headers()]
+    index_rows = []
+
+    for position, (user_id, user_months) in enumerate(users.items()):
+        first_row = block_first_row(FIRST_INDEX_ROW + position)
+        index_rows.append([user_id, first_row])
+        for month in range(1, BLOCK_SIZE + 1):
+            month_plan = user_months.get(month)
+            grid.append(month_plan[1] if month_plan else [""] * PLAN_ROW_WIDTH)
+
+    return grid, index_rows
+
+
+def get_or_create_worksheet(sheet, title: str, rows: int, cols: int, force: bool):
+    """Возвращает пустой лист: создает его или (с --force) очищает существующий"""
+    try:
+        worksheet = sheet.worksheet(title)
+    except gspread.exceptions.WorksheetNotFound:
+        return sheets_gateway.write(sheet.add_worksheet, title=title, rows=rows, cols=cols)
+
+    if not force:
+        raise SystemExit(f"Лист {title} уже существует, используйте --force для перезаписи")
+    sheets_gateway.write(worksheet.clear)
+    if worksheet.row_count < rows:
+        sheets_gateway.write(worksheet.add_rows, rows - worksheet.row_count)
+    return worksheet
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Миграция листа планов Google Sheets на раскладку v2")
+    parser.add_argument("--dry-run", action="store_true", help="только посчитать, ничего не записывать")
+    parser.add_argument("--force", action="store_true", help="перезаписать уже существующие листы v2")
+    args = parser.parse_args()
+
+    sheet = init_google_sheets()
+    if not sheet:
+        print("Не удалось подключиться к Google Sheets")
+        return 1
+
+    try:
+        sheet.worksheet(PLAN_INDEX_WORKSHEET)
+        if not args.force:
+            print(f"Лист {PLAN_INDEX_WORKSHEET} уже существует - миграция выполнена ранее (--force для повтора)")
+            return 0
+    except gspread.exceptions.WorksheetNotFound:
+        pass
+
+    v1_worksheet = sheets_gateway.worksheet(sheet, PLANS_WORKSHEET_V1)
+    rows = sheets_gateway.read(v1_worksheet.get_all_values)
+    users, counters = collect_plans(rows)
+    grid, index_rows = build_grid(users)
+
+    print(f"Строк v1: {counters['rows']}, пропущено некорректных: {counters['skipped']}, "
+          f"объединено дублей: {counters['merged']}, вытеснено прошлогодних месяцев: {counters['dropped_old_years']}")
+    print(f"Пользователей: {len(users)}, строк v2: {len(grid)}")
+
+    if args.dry_run:
+        return 0
+
+    plans_worksheet = get_or_create_worksheet(
+        sheet, PLANS_WORKSHEET_V2, len(grid) + GROW_ROWS, PLAN_ROW_WIDTH, args.force
+    )
+    for start in range(0, len(grid), WRITE_CHUNK_ROWS):
+        chunk = grid[start:start + WRITE_CHUNK_ROWS]
+        range_name = f"A{start + 1}:{rowcol_to_a1(start + len(chunk), PLAN_ROW_WIDTH)}"
+        sheets_gateway.write(plans_worksheet.update, values=chunk, range_name=range_name)
+        print(f"Записаны строки {start + 1}-{start + len(chunk)}")
+
+    # Индекс создается последним: его появление переключает бота на v2
+    index_values = [["layout_version", LAYOUT_VERSION], ["user_id", "первая_строка"]] + index_rows
+    index_worksheet = get_or_create_worksheet(
+        sheet, PLAN_INDEX_WORKSHEET, len(index_values) + GROW_ROWS, 2, args.force
+    )
+    sheets_gateway.write(
+        index_worksheet.update, values=index_values, range_name=f"A1:B{len(index_values)}"
+    )
+    sheets_gateway.write(index_worksheet.hide)
+
+    print(f"Готово: раскладка v{LAYOUT_VERSION}, лист {PLANS_WORKSHEET_V2}, индекс {PLAN_INDEX_WORKSHEET}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,41 @@
 import logging
-from typing import Any
+from typing import Any, Iterable, Optional
+
+from telegram.error import BadRequest, Forbidden
 
 from config import logger
 
 logger = logging.getLogger(__name__)
+
+# Фрагменты текста ошибок Telegram, означающие недоступный чат
+UNREACHABLE_CHAT_MARKERS = (
+    "bot was blocked by the user",
+    "user is deactivated",
+    "bot was kicked",
+    "chat not found",
+    "bot can't initiate conversation",
+)
+
+
+def is_chat_unreachable_error(error: Optional[BaseException]) -> bool:
+    """Проверяет, означает ли ошибка Telegram, что пользователь заблокировал бота или удалил чат"""
+    if error is None:
+        return False
+    
+    if isinstance(error, Forbidden):
+        return True
+    
+    if isinstance(error, BadRequest):
+        error_str = str(error).lower()
+        return any(marker in error_str for marker in UNREACHABLE_CHAT_MARKERS)
+    
+    return False
+
+
+def percentile(values: Iterable[float], pct: float) -> float:
+    """Процентиль выборки методом ближайшего ранга (0.0 для пустой выборки)"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import logger
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обработчик обновлений с параллельной обработкой разных пользователей.
+    
+    Обновления одного пользователя выполняются строго по очереди, чтобы
+    состояние анкеты и ConversationHandler оставалось согласованным.
+    Общее число одновременно обрабатываемых обновлений ограничено
+    max_concurrent_updates; слот занимается только после блокировки пользователя.
+    """
+    
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._user_locks: Dict[int, asyncio.Lock] = {}
+        self._lock_waiters: Dict[int, int] = {}
+    
+    @staticmethod
+    def _get_order_key(update: object) -> Optional[int]:
+        """Ключ упорядочивания: ID пользователя, иначе ID чата"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+    
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """
+        Сначала ждет очереди пользователя, затем занимает слот параллельности.
+        
+        Базовый класс занимает слот до вызова do_process_update: серия обновлений
+        одного пользователя заняла бы все слоты ожиданием его блокировки, и
+        остальные пользователи простаивали бы. Здесь обновление, ждущее очереди
+        своего пользователя, слот не держит.
+        """
+        key = self._get_order_key(update)
+        if key is None:
+            async with self._slots:
+                await self.do_process_update(update, coroutine)
+            return
+        
+        lock = self._user_locks.get(key)
+        if lock is None:
+            lock = self._user_locks[key] = asyncio.Lock()
+        self._lock_waiters[key] = self._lock_waiters.get(key, 0) + 1
+        
+        try:
+            async with lock:
+                async with self._slots:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            # Удаляем блокировку, когда обновлений пользователя больше нет
+            self._lock_waiters[key] -= 1
+            if not self._lock_waiters[key]:
+                del self._lock_waiters[key]
+                del self._user_locks[key]
+    
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """Выполняет обработку обновления (очередь пользователя и слот уже заняты)"""
+        await coroutine
+    
+    async def initialize(self) -> None:
+        """Инициализация не требуется"""
+    
+    async def shutdown(self) -> None:
+        """Сбрасывает блокировки пользователей"""
+        if self._user_locks:
+            logger.debug(f"Сброс блокировок для {len(self._user_locks)} пользователей")
+        self._user_locks.clear()
+        self._lock_waiters.clear()
@@ -0,0 +1,20 @@
+"""
+HTTP-слой Bot API для локальной проверки webhook режима (WEBHOOK_REGISTER=false).
+
+Вызов setWebhook не уходит в Telegram, иначе локальный запуск с рабочим токеном
+перенаправил бы доставку обновлений бота на локальный адрес. Остальные методы
+Bot API выполняются как обычно.
+"""
+import json
+from typing import Any, Tuple
+
+from telegram.request import HTTPXRequest
+
+
+class LocalWebhookRequest(HTTPXRequest):
+    """HTTPXRequest, который отвечает на setWebhook успехом без запроса к Telegram"""
+
+    async def do_request(self, url: str, method: str, *args: Any, **kwargs: Any) -> Tuple[int, bytes]:
+        if url.rsplit('/', 1)[-1] == "setWebhook":
+            return 200, json.dumps({"ok": True, "result": True}).encode('utf-8')
+        return await super().do_request(url, method, *args, **kwargs)